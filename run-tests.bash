@@ -33,4 +33,7 @@ cd test/correctness/
 
 python setup.py develop
 
-pytest --doclayer-port 27000 smoke/
+pytest --doclayer-port 27000 -n auto -m "not query_budget" smoke/
+
+# query budgets read the server wide metrics of the trace files of fdbdoc, they must run on their own
+pytest --doclayer-port 27000 --doclayer-trace-dir ../.. -m query_budget smoke/
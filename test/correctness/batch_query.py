@@ -0,0 +1,167 @@
+#!/usr/bin/python
+#
+# batch_query.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Batched queries. pymongo waits for the reply of a request before sending the next one on a connection, find_many()
+# instead sends a list of filters as raw OP_QUERY messages on one connection without waiting, and Document Layer runs
+# up to CONNECTION_MAX_PIPELINE_DEPTH (50) requests of a connection concurrently. Cursors left open by a first batch
+# are followed with OP_GET_MORE in the same pipeline. The model side, MongoCollection.find_many(), evaluates all
+# filters in one pass over its documents.
+#
+# Results are compared by canonical_digest(), which does not depend on the order of documents or of their fields and
+# treats numbers and strings the way == does, e.g. 1 == 1.0 and 'a' == u'a':
+#
+#   dl_results = batch_query.find_many(collection, filters)
+#   mm_results = model_collection.find_many(filters)
+#   same = [canonical_digest(a) == canonical_digest(b) for (a, b) in zip(dl_results, mm_results)]
+
+import hashlib
+import itertools
+import socket
+import struct
+
+import bson
+import pymongo
+from bson.binary import Binary
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_GET_MORE = 2005
+HEADER = struct.Struct('<iiii')
+REPLY = struct.Struct('<iqii')
+CURSOR_NOT_FOUND = 1
+QUERY_FAILURE = 2
+
+PIPELINE_DEPTH = 50
+
+
+def encode_query(request_id, namespace, query):
+    body = struct.pack('<i', 0) + namespace + '\x00' + struct.pack('<ii', 0, 0) + bson.BSON.encode(query)
+    return HEADER.pack(HEADER.size + len(body), request_id, 0, OP_QUERY) + body
+
+
+def encode_get_more(request_id, namespace, cursor_id):
+    body = struct.pack('<i', 0) + namespace + '\x00' + struct.pack('<iq', 0, cursor_id)
+    return HEADER.pack(HEADER.size + len(body), request_id, 0, OP_GET_MORE) + body
+
+
+class PipelinedConnection(object):
+    def __init__(self, address, depth=PIPELINE_DEPTH):
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.depth = depth
+        self.request_ids = itertools.count(1)
+        self.incoming = ''
+
+    def read_reply(self):
+        """Returns (response to, flags, cursor id, documents) of the next reply."""
+        while True:
+            if len(self.incoming) >= HEADER.size:
+                (length, _, response_to, op_code) = HEADER.unpack_from(self.incoming)
+                if len(self.incoming) >= length:
+                    break
+            data = self.sock.recv(1 << 16)
+            if data == '':
+                raise socket.error('connection closed by the server')
+            self.incoming += data
+        (message, self.incoming) = (self.incoming[:length], self.incoming[length:])
+        if op_code != OP_REPLY:
+            raise socket.error('unexpected op code %d' % op_code)
+        (flags, cursor_id, _, _) = REPLY.unpack_from(message, HEADER.size)
+        return (response_to, flags, cursor_id, bson.decode_all(message[HEADER.size + REPLY.size:]))
+
+    def find_many(self, namespace, filters):
+        """Runs the filters with at most depth requests in flight, returns the documents each matched."""
+        results = [[] for _ in filters]
+        errors = []
+        # request id -> index of the filter
+        pending = {}
+        next_filter = 0
+        while next_filter < len(filters) or len(pending) > 0:
+            while next_filter < len(filters) and len(pending) < self.depth:
+                request_id = next(self.request_ids)
+                self.sock.sendall(encode_query(request_id, namespace, filters[next_filter]))
+                pending[request_id] = next_filter
+                next_filter += 1
+            (response_to, flags, cursor_id, docs) = self.read_reply()
+            ii = pending.pop(response_to)
+            if flags & (QUERY_FAILURE | CURSOR_NOT_FOUND):
+                # the other replies are still read, so that the connection can be used again
+                error = docs[0] if len(docs) > 0 else {'$err': 'cursor not found'}
+                errors.append(pymongo.errors.OperationFailure(error.get('$err'), error.get('code'), error))
+                continue
+            results[ii].extend(docs)
+            if cursor_id != 0:
+                request_id = next(self.request_ids)
+                self.sock.sendall(encode_get_more(request_id, namespace, cursor_id))
+                pending[request_id] = ii
+        if len(errors) > 0:
+            raise errors[0]
+        return results
+
+    def close(self):
+        self.sock.close()
+
+
+# (host, port) -> PipelinedConnection, kept for the next batches
+connections = {}
+
+
+def find_many(collection, filters):
+    """Runs a find() for each of the filters on a pymongo collection, all pipelined on one connection."""
+    address = collection.database.client.address
+    if address not in connections:
+        connections[address] = PipelinedConnection(address)
+    try:
+        return connections[address].find_many(collection.full_name, filters)
+    except socket.error:
+        connections.pop(address).close()
+        raise
+
+
+def close_connections():
+    while len(connections) > 0:
+        connections.popitem()[1].close()
+
+
+def canonical(value):
+    if isinstance(value, bool):
+        return 'b%d' % value
+    if isinstance(value, (int, long)):
+        return 'n%d' % value
+    if isinstance(value, float):
+        return 'n%d' % value if value.is_integer() else 'n%r' % value
+    if isinstance(value, Binary):
+        return 'x%r' % value
+    if isinstance(value, basestring):
+        value = value.encode('utf-8') if isinstance(value, unicode) else value
+        return 's%d:%s' % (len(value), value)
+    if isinstance(value, dict):
+        return '{%s}' % ','.join(sorted([canonical(k) + ':' + canonical(v) for (k, v) in value.items()]))
+    if isinstance(value, list):
+        return '[%s]' % ','.join([canonical(v) for v in value])
+    return '%s:%r' % (type(value).__name__, value)
+
+
+def canonical_digest(docs):
+    """Digest of a query result, the same for results that are equal as unordered lists of unordered documents."""
+    return hashlib.md5('\n'.join(sorted([canonical(doc) for doc in docs]))).hexdigest()
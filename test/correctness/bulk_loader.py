@@ -0,0 +1,119 @@
+#!/usr/bin/python
+#
+# bulk_loader.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+import time
+
+import bson
+import pymongo
+
+DUPLICATE_KEY = 11000
+
+
+def document_size(doc):
+    return len(bson.BSON.encode(doc))
+
+
+class BatchResult(object):
+    def __init__(self, number, docs, size, seconds):
+        self.number = number
+        self.docs = docs
+        self.bytes = size
+        self.seconds = seconds
+
+    def __str__(self):
+        return "batch %d: %d docs, %d bytes in %.2f ms" % (self.number, self.docs, self.bytes, self.seconds * 1000)
+
+
+class BulkLoader(object):
+    """
+    Inserts documents with insert_many(), split into batches bounded by number of documents and/or bytes. A bound of
+    0 means unbounded, so the default is a single batch. Works on both pymongo and model collections. Errors of a
+    batch are raised as an OperationFailure carrying the code of the first write error, to be comparable with the
+    codes of the model and of the legacy insert().
+    """
+
+    def __init__(self, collection, batch_size=0, batch_bytes=0, ordered=True, report=None, measure_bytes=False):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.ordered = ordered
+        # batch sizes in bytes are only known if bounded by bytes or measured on purpose, as it takes encoding
+        self.measure_bytes = measure_bytes or batch_bytes > 0
+        # called with a BatchResult after every batch
+        self.report = report
+        self.results = []
+
+    def batches(self, docs):
+        batch = []
+        size = 0
+        for doc in docs:
+            doc_size = document_size(doc) if self.measure_bytes else 0
+            if len(batch) > 0 and ((self.batch_size > 0 and len(batch) >= self.batch_size) or
+                                   (self.batch_bytes > 0 and size + doc_size > self.batch_bytes)):
+                yield (batch, size)
+                batch = []
+                size = 0
+            batch.append(doc)
+            size += doc_size
+        if len(batch) > 0:
+            yield (batch, size)
+
+    def insert_batch(self, batch):
+        try:
+            self.collection.insert_many(batch, ordered=self.ordered)
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if len(errors) == 0:
+                raise
+            raise pymongo.errors.OperationFailure(errors[0]['errmsg'], errors[0]['code'], e.details)
+
+    def load(self, docs, skip_duplicates=False):
+        """
+        Inserts all docs, stops at the first failing batch. With skip_duplicates, batches whose write errors are all
+        duplicate keys count as successful, which makes loading documents that may already be there idempotent with
+        unordered inserts. Returns the number of documents in successful batches.
+        """
+        inserted = 0
+        for (batch, size) in self.batches(docs):
+            start = time.time()
+            try:
+                self.insert_batch(batch)
+            except pymongo.errors.OperationFailure as e:
+                errors = (e.details or {}).get('writeErrors', [])
+                if not skip_duplicates or len(errors) == 0 or any([error['code'] != DUPLICATE_KEY for error in errors]):
+                    raise
+            result = BatchResult(len(self.results) + 1, len(batch), size, time.time() - start)
+            self.results.append(result)
+            if self.report is not None:
+                self.report(result)
+            inserted += len(batch)
+        return inserted
+
+    def total_seconds(self):
+        return sum([r.seconds for r in self.results])
+
+    def latency_percentile(self, percentile):
+        if len(self.results) == 0:
+            return 0.0
+        latencies = sorted([r.seconds for r in self.results])
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100.0))]
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# collection_pool.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+import pymongo
+
+from mongo_model import MongoCollection
+
+
+def index_name(keys):
+    # Same naming scheme as PyMongo and the model use for indexes created without an explicit name
+    return "_".join(["%s_%s" % item for item in keys])
+
+
+def clear_collection(collection, index_names):
+    if isinstance(collection, MongoCollection):
+        # nothing to save on the model, it has no metadata
+        collection.drop()
+        return
+    if index_names is None:
+        # the indexes are unknown, drop all of them but the one on _id
+        collection.drop_indexes()
+        collection.delete_many({})
+        return
+    for name in index_names:
+        try:
+            collection.drop_index(name)
+        except pymongo.errors.OperationFailure:
+            # the index build may have failed, e.g. because of a unique constraint
+            pass
+    # Document Layer has no command that clears the key range of a collection without dropping its metadata, so the
+    # documents are deleted one by one. Only the metadata and directory updates of drop and create are saved.
+    collection.delete_many({})
+
+
+class CollectionPool(object):
+    """
+    A fixed set of collections which are created once and then cleared between uses, instead of creating and dropping
+    a new collection every time. On Document Layer this saves the metadata and directory updates that come with
+    creating and dropping collections, the documents are still deleted one by one. Every slot holds the same collection
+    name on each of the given clients.
+    """
+
+    def __init__(self, clients, db_name, prefix, size=1):
+        self.names = [prefix + str(ii) for ii in range(size)]
+        self.slots = [[client[db_name][name] for client in clients] for name in self.names]
+        self.indexes = [set() for _ in range(size)]
+        self.current = -1
+
+        for collections in self.slots:
+            for collection in collections:
+                collection.drop()
+                if not isinstance(collection, MongoCollection):
+                    collection.database.command('create', collection.name)
+
+    def acquire(self):
+        """Returns the collections of the next slot, which are empty and have no indexes other than _id."""
+        self.current = (self.current + 1) % len(self.slots)
+        return self.slots[self.current]
+
+    def current_name(self):
+        return self.names[self.current]
+
+    def note_index(self, keys):
+        """Remembers an index created on the current slot, so that release() only drops what has been created."""
+        self.indexes[self.current].add(index_name(keys))
+
+    def release(self, all_indexes=False):
+        """Clears the current slot, dropping every index with all_indexes instead of only the noted ones."""
+        for collection in self.slots[self.current]:
+            clear_collection(collection, None if all_indexes else self.indexes[self.current])
+        self.indexes[self.current].clear()
+
+    def drop(self):
+        for collections in self.slots:
+            for collection in collections:
+                collection.drop()
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+#
+# compare_bench.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Side by side performance comparison of Document Layer and MongoDB. A workload of random documents, indexes, queries
+# and updates is generated once from the seed, with the generator options document-correctness.py uses when testing
+# the two against each other. It is then run against each server on its own, one after the other: the documents are
+# inserted and indexed, the reads run --warmup times unmeasured and --passes times measured, and the updates run last
+# as they change the documents. Latencies are recorded per operation class, e.g. find:range or update:upsert, and
+# reported next to each other with their ratio, Document Layer over MongoDB.
+#
+# Operations run one at a time from a single client, so the throughput of a class is its operations per second of
+# busy time. Operations failing on a server are counted as errors and left out of its latencies.
+
+import argparse
+import json
+import random
+import sys
+import time
+from collections import OrderedDict
+
+import pymongo
+from bson.son import SON
+
+import gen
+import slow_queries
+import stats
+import util
+from bulk_loader import BulkLoader
+from mongo_model import MongoModel
+from util import MongoModelException
+
+BACKENDS = ['doclayer', 'mongo']
+
+RANGE_OPERATORS = ['$lt', '$lte', '$gt', '$gte']
+LOGICAL_OPERATORS = ['$and', '$or', '$nor']
+
+
+def query_class(query):
+    """Names the shape of a generated query by the operator of its first predicate."""
+    if len(query) == 0:
+        return 'all'
+    (field, predicate) = query.items()[0]
+    if field in LOGICAL_OPERATORS:
+        return 'logical'
+    if isinstance(predicate, dict) and len(predicate) > 0 and predicate.keys()[0].startswith('$'):
+        operator = predicate.keys()[0]
+        if operator in RANGE_OPERATORS:
+            return 'range'
+        if operator in ['$regex', '$options']:
+            return 'regex'
+        return operator[1:]
+    return 'id_equality' if field == '_id' else 'equality'
+
+
+def update_class(update):
+    if update['upsert']:
+        return 'upsert'
+    return 'multi' if update['multi'] else 'single'
+
+
+class Workload(object):
+    def __init__(self, ns):
+        gen.global_prng = random.Random(ns['seed'])
+        self.documents = []
+        seen = set()
+        while len(self.documents) < ns['num_doc']:
+            doc = gen.random_document(True)
+            # unique ids, so that every document makes it into both servers
+            if repr(doc['_id']) not in seen:
+                seen.add(repr(doc['_id']))
+                self.documents.append(doc)
+        self.indexes = [gen.random_index_spec() for _ in range(0, ns['indexes'])]
+
+        # (class, query)
+        self.reads = [('find:' + query_class(query), query) for query in
+                      [gen.random_query() for _ in range(0, ns['queries'])]]
+        self.reads.extend([('find:_id', {'_id': gen.global_prng.choice(self.documents)['_id']})
+                           for _ in range(0, ns['point_reads'])])
+        gen.global_prng.shuffle(self.reads)
+
+        # updates pick their queries on the documents, which are held by the model for that
+        model = MongoModel('DocLayer')['test']['compare']
+        BulkLoader(model).load(self.documents)
+        self.updates = [gen.random_update(model) for _ in range(0, ns['updates'])]
+
+
+def run_timed(timings, errors, name, backend, func, *args, **kwargs):
+    """Runs and times an operation, returns its latency in seconds or None if it failed."""
+    start = time.time()
+    try:
+        func(*args, **kwargs)
+    except (pymongo.errors.OperationFailure, MongoModelException):
+        errors[(name, backend)] = errors.get((name, backend), 0) + 1
+        return None
+    seconds = time.time() - start
+    timings.record(name, seconds, backend)
+    return seconds
+
+
+def run_backend(ns, workload, timings, errors, backend, slow_log):
+    kind = BACKENDS[backend]
+    client = pymongo.MongoClient(ns[kind + '_host'], ns[kind + '_port'], maxPoolSize=1)
+    collection = client['test']['compare' + str(ns['seed'])]
+    collection.drop()
+    print 'Running against %s at %s:%d' % (kind, ns[kind + '_host'], ns[kind + '_port'])
+
+    start = time.time()
+    loader = BulkLoader(collection, ns['insert_batch_size'], ordered=False)
+    for (batch, _) in loader.batches(workload.documents):
+        run_timed(timings, errors, 'insert', backend, loader.insert_batch, batch)
+    for index in workload.indexes:
+        run_timed(timings, errors, 'ensure_index', backend, collection.create_index, index)
+
+    for _ in range(0, ns['warmup']):
+        for (_, query) in workload.reads:
+            try:
+                list(collection.find(query))
+            except pymongo.errors.OperationFailure:
+                pass
+    if slow_log is not None:
+        slow_log.begin(ns['seed'], [(index, False) for index in workload.indexes], {'num_doc': ns['num_doc']})
+    for _ in range(0, ns['passes']):
+        for (name, query) in workload.reads:
+            seconds = run_timed(timings, errors, name, backend, lambda q: list(collection.find(q)), query)
+            if slow_log is not None and seconds is not None:
+                slow_log.observe(collection, kind, seconds, 'find', SON([('filter', query)]))
+
+    for update in workload.updates:
+        # an update changes the documents, a slow one is kept with those it ran on
+        before = slow_log.capture(collection) if slow_log is not None else None
+        seconds = run_timed(timings, errors, 'update:' + update_class(update), backend, collection.update,
+                            update['query'], update['update'], upsert=update['upsert'], multi=update['multi'])
+        if slow_log is not None and seconds is not None:
+            slow_log.observe(collection, kind, seconds, 'update',
+                             SON([('query', update['query']), ('update', update['update']),
+                                  ('upsert', update['upsert']), ('multi', update['multi'])]), before)
+    print '  done in %.2f s' % (time.time() - start)
+
+    collection.drop()
+    client.close()
+
+
+def class_names(timings):
+    names = []
+    for name in timings.histograms:
+        name = name.rsplit(':', 1)[0]
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def ratio(a, b):
+    return float(a) / b if b > 0 else None
+
+
+def compare(ns, timings, errors):
+    """Returns a row per operation class comparing the two servers."""
+    rows = []
+    for name in class_names(timings):
+        row = OrderedDict([('class', name)])
+        for kind in BACKENDS:
+            histogram = timings.histograms.get(name + ':' + kind, stats.LatencyHistogram())
+            row[kind] = histogram.to_dict()
+            row[kind]['ops_per_s'] = histogram.count * 1000000.0 / histogram.total if histogram.total > 0 else 0.0
+            row[kind]['errors'] = errors.get((name, BACKENDS.index(kind)), 0)
+        (doclayer, mongo) = (row['doclayer'], row['mongo'])
+        row['p50_ratio'] = ratio(doclayer['p50_us'], mongo['p50_us'])
+        row['p99_ratio'] = ratio(doclayer['p99_us'], mongo['p99_us'])
+        row['throughput_ratio'] = ratio(doclayer['ops_per_s'], mongo['ops_per_s'])
+        row['slow'] = row['p50_ratio'] is not None and row['p50_ratio'] > ns['slow_ratio']
+        rows.append(row)
+    return rows
+
+
+def format_ratio(value):
+    return '%.2f' % value if value is not None else '-'
+
+
+def print_comparison(rows):
+    print '{:<20} {:>7} {:>10} {:>10} {:>7} {:>10} {:>10} {:>7} {:>10} {:>10} {:>7} {:>9}'.format(
+        'class', 'count', 'dl p50 us', 'mdb p50 us', 'ratio', 'dl p99 us', 'mdb p99 us', 'ratio', 'dl ops/s',
+        'mdb ops/s', 'ratio', 'errors')
+    for row in rows:
+        (doclayer, mongo) = (row['doclayer'], row['mongo'])
+        print '{:<20} {:>7} {:>10} {:>10} {:>7} {:>10} {:>10} {:>7} {:>10.1f} {:>10.1f} {:>7} {:>9}{}'.format(
+            row['class'], max(doclayer['count'], mongo['count']), doclayer['p50_us'], mongo['p50_us'],
+            format_ratio(row['p50_ratio']), doclayer['p99_us'], mongo['p99_us'], format_ratio(row['p99_ratio']),
+            doclayer['ops_per_s'], mongo['ops_per_s'], format_ratio(row['throughput_ratio']),
+            '%d/%d' % (doclayer['errors'], mongo['errors']), '  SLOW' if row['slow'] else '')
+
+
+def run_compare(ns):
+    util.weaken_tests({'testers': BACKENDS})
+    workload = Workload(ns)
+    print 'Workload: %d documents, %d indexes, %d reads x %d passes, %d updates, seed %d' % (
+        len(workload.documents), len(workload.indexes), len(workload.reads), ns['passes'], len(workload.updates),
+        ns['seed'])
+
+    timings = stats.Timings(BACKENDS)
+    errors = {}
+    slow_log = slow_queries.open_log(ns, 'compare_bench')
+    for backend in range(0, len(BACKENDS)):
+        run_backend(ns, workload, timings, errors, backend, slow_log)
+    if slow_log is not None:
+        print 'Kept %d slow operations in %s' % (slow_log.count, ns['slow_query_corpus'])
+        slow_log.close()
+
+    rows = compare(ns, timings, errors)
+    print_comparison(rows)
+    slow = [row['class'] for row in rows if row['slow']]
+    if len(slow) > 0:
+        print 'Document Layer is more than %.1f times slower than MongoDB on: %s' % (ns['slow_ratio'], ', '.join(slow))
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump({'seed': ns['seed'], 'classes': rows, 'timings': timings.to_dict()}, f, indent=2)
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Performance of Document Layer and MongoDB on identical workloads')
+    parser.add_argument('--mongo-host', type=str, default='localhost', help='hostname of MongoDB server')
+    parser.add_argument('--mongo-port', type=int, default=27018, help='port of MongoDB server')
+    parser.add_argument('--doclayer-host', type=str, default='localhost', help='hostname of document layer server')
+    parser.add_argument('--doclayer-port', type=int, default=27019, help='port of document layer server')
+    parser.add_argument('--num-doc', type=int, default=1000, help='number of documents in the collection')
+    parser.add_argument('--indexes', type=int, default=5, help='number of random indexes')
+    parser.add_argument('--queries', type=int, default=200, help='number of random queries')
+    parser.add_argument('--point-reads', type=int, default=200, help='number of reads of a document by _id')
+    parser.add_argument('--updates', type=int, default=50, help='number of random updates')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured passes over the reads')
+    parser.add_argument('--passes', type=int, default=3, help='measured passes over the reads')
+    parser.add_argument('--insert-batch-size', type=int, default=100, help='number of documents per insert')
+    parser.add_argument(
+        '--slow-ratio', type=float, default=5, help='p50 ratio above which a class is reported as slow on Document Layer')
+    parser.add_argument('--seed', type=int, default=random.randint(0, sys.maxint), help='random seed to use')
+    parser.add_argument('--output', default='', help='JSON file to write the comparison to')
+    slow_queries.add_arguments(parser)
+    ns = vars(parser.parse_args())
+    sys.exit(not run_compare(ns))
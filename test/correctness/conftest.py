@@ -21,37 +21,99 @@
 # MongoDB is a registered trademark of MongoDB, Inc.
 #
 
+import os
 import pytest
 import pymongo
 import random
 
+import batch_query
 import log
+from collection_pool import CollectionPool
+from console_metrics import MetricsCollector
+from query_budget import QueryBudget
+from shared_datasets import DatasetCache
 
 logger = log.setup_logger(__name__)
 
 
 def pytest_addoption(parser):
     parser.addoption('--doclayer-port', action='store', default=27018, help="Port that Doc Layer is listening on")
+    parser.addoption(
+        '--doclayer-trace-dir',
+        action='store',
+        default=None,
+        help="Trace directory of Doc Layer, whose metrics query budget tests check")
+
+
+@pytest.fixture(scope='session')
+def fixture_namespace():
+    # pytest-xdist runs the tests in processes named gw0, gw1, ..., each of which gets databases of its own
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'master')
+    return 'db_{}_{}'.format(worker, random.getrandbits(64))
 
 
 @pytest.yield_fixture(scope='session')
 def fixture_client(request):
     port = request.config.getoption('--doclayer-port')
+    # one client, and so one pool of connections, for all the tests of a process
     client = pymongo.MongoClient('127.0.0.1:{}'.format(port))
     yield client
+    client.close()
+
+
+@pytest.yield_fixture(scope='session', autouse=True)
+def fixture_batch_connections():
+    yield
+    # find_many() keeps a connection per server open for the next batches, each xdist worker closes its own
+    batch_query.close_connections()
 
 
 @pytest.yield_fixture(scope='session')
-def fixture_db(fixture_client):
-    db_name = 'db_{}'.format(random.getrandbits(64))
-    db = fixture_client[db_name]
+def fixture_db(fixture_client, fixture_namespace):
+    db = fixture_client[fixture_namespace]
     yield db
+    fixture_client.drop_database(fixture_namespace)
+
+
+@pytest.yield_fixture(scope='session')
+def fixture_collection_pool(fixture_client, fixture_namespace):
+    # a database of its own, so that the tests listing the collections of fixture_db do not see the pooled one
+    db_name = fixture_namespace + '_pool'
+    pool = CollectionPool([fixture_client], db_name, 'coll_')
+    yield pool
     fixture_client.drop_database(db_name)
 
 
 @pytest.yield_fixture(scope='function')
-def fixture_collection(fixture_db):
-    coll_name = 'coll_{}'.format(random.getrandbits(64))
-    collection = fixture_db[coll_name]  # type: pymongo.collection
+def fixture_collection(fixture_collection_pool):
+    (collection, ) = fixture_collection_pool.acquire()  # type: pymongo.collection
     yield collection
-    collection.drop()
+    try:
+        fixture_collection_pool.release(all_indexes=True)
+    except pymongo.errors.OperationFailure as e:
+        logger.warning('Dropping {} as clearing it failed: {}'.format(collection.full_name, e))
+        collection.drop()
+
+
+@pytest.yield_fixture(scope='session')
+def fixture_datasets(fixture_client, fixture_namespace):
+    db_name = fixture_namespace + '_datasets'
+    yield DatasetCache(fixture_client[db_name])
+    fixture_client.drop_database(db_name)
+
+
+@pytest.yield_fixture(scope='session')
+def fixture_metrics(request):
+    trace_dir = request.config.getoption('--doclayer-trace-dir')
+    if trace_dir is None:
+        yield None
+    else:
+        collector = MetricsCollector(trace_dir, poll_interval=0.5)
+        collector.start()
+        yield collector
+        collector.stop()
+
+
+@pytest.fixture(scope='function')
+def fixture_query_budget(fixture_metrics):
+    return QueryBudget(fixture_metrics)
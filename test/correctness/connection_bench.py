@@ -0,0 +1,358 @@
+#!/usr/bin/python
+#
+# connection_bench.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Connection scaling benchmark. Steps through numbers of client connections and pipeline depths, keeping depth point
+# reads in flight on every connection, and reports the throughput, the latency and the CPU of the server per step.
+# Document Layer handles all connections on one network thread and runs up to CONNECTION_MAX_PIPELINE_DEPTH (50)
+# requests of a connection concurrently, the steps show where this saturates.
+#
+# pymongo waits for the reply of a request before sending the next one on a connection, so requests are sent as raw
+# OP_QUERY messages here, from a few threads each polling many non-blocking sockets. A single Python process may
+# saturate before the server does: the CPU the client used is printed next to the server CPU, a client close to 100%
+# means the step measured the client. The server CPU comes from the dl_cpu_percentage and dl_main_th_cpu_percentage
+# ConsoleMetric gauges if --trace-dir is given, otherwise from the CPU time of the fdbdoc processes.
+
+import argparse
+import errno
+import itertools
+import json
+import os
+import random
+import resource
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+import pymongo
+
+import console_metrics
+import memory_monitor
+import stats
+import ycsb
+
+OP_REPLY = 1
+OP_QUERY = 2004
+HEADER = struct.Struct('<iiii')
+QUERY_FAILURE = 2
+
+# CPU usage of the client, in percent of one core, above which it limits the throughput it measures
+CLIENT_CPU_BOUND_PERCENT = 90
+
+
+def encode_query(request_id, namespace, query):
+    """OP_QUERY message returning a single batch, so that no cursor is left open."""
+    body = struct.pack('<i', 0) + namespace + '\x00' + struct.pack('<ii', 0, -1) + bson.BSON.encode(query)
+    return HEADER.pack(HEADER.size + len(body), request_id, 0, OP_QUERY) + body
+
+
+class Connection(object):
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+        # request id -> send time
+        self.pending = {}
+        self.outgoing = ''
+        self.incoming = ''
+        self.writing = False
+
+    def close(self):
+        self.sock.close()
+
+
+class Worker(object):
+    """Keeps depth requests in flight on each of its connections, from one thread polling all of them."""
+
+    def __init__(self, connections, depth, namespace, record_count, seed):
+        self.connections = dict([(c.sock.fileno(), c) for c in connections])
+        self.depth = depth
+        self.namespace = namespace
+        self.record_count = record_count
+        self.prng = random.Random(seed)
+        self.request_ids = itertools.count(1)
+        self.latency = stats.LatencyHistogram()
+        self.completed = 0
+        self.errors = 0
+        self.thread = None
+
+    def start(self, measure_start, stop_time):
+        self.thread = threading.Thread(target=self.run, args=(measure_start, stop_time))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def issue(self, connection):
+        while len(connection.pending) < self.depth:
+            request_id = next(self.request_ids)
+            query = {'_id': str(self.prng.randint(0, self.record_count - 1))}
+            connection.outgoing += encode_query(request_id, self.namespace, query)
+            connection.pending[request_id] = time.time()
+
+    def receive(self, connection, measure_start, stop_time):
+        data = connection.sock.recv(1 << 16)
+        if data == '':
+            raise socket.error('connection closed by the server')
+        connection.incoming += data
+        now = time.time()
+        while len(connection.incoming) >= HEADER.size:
+            (length, _, response_to, op_code) = HEADER.unpack_from(connection.incoming)
+            if len(connection.incoming) < length:
+                break
+            (flags, ) = struct.unpack_from('<i', connection.incoming, HEADER.size)
+            connection.incoming = connection.incoming[length:]
+            sent = connection.pending.pop(response_to, None)
+            if sent is None or op_code != OP_REPLY:
+                continue
+            if flags & QUERY_FAILURE:
+                self.errors += 1
+            elif sent >= measure_start and now < stop_time:
+                self.latency.record(now - sent)
+                self.completed += 1
+
+    def run(self, measure_start, stop_time):
+        poller = select.poll()
+        for (fd, connection) in self.connections.items():
+            self.issue(connection)
+            poller.register(fd, select.POLLIN | select.POLLOUT)
+            connection.writing = True
+        while len(self.connections) > 0 and time.time() < stop_time:
+            for (fd, event) in poller.poll(100):
+                connection = self.connections[fd]
+                try:
+                    if event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                        self.receive(connection, measure_start, stop_time)
+                        self.issue(connection)
+                    if connection.outgoing != '' and event & select.POLLOUT:
+                        sent = connection.sock.send(connection.outgoing)
+                        connection.outgoing = connection.outgoing[sent:]
+                except socket.error as e:
+                    if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                        continue
+                    self.errors += 1
+                    poller.unregister(fd)
+                    del self.connections[fd]
+                    connection.close()
+                    continue
+                # only wait for the socket to become writable while there is something to send
+                if connection.writing != (connection.outgoing != ''):
+                    connection.writing = connection.outgoing != ''
+                    poller.modify(fd, select.POLLIN | (select.POLLOUT if connection.writing else 0))
+
+
+def raise_file_limit(needed):
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed and (hard == resource.RLIM_INFINITY or soft < hard):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    return soft == resource.RLIM_INFINITY or soft >= needed
+
+
+def process_cpu_seconds(names=memory_monitor.PROCESS_NAMES):
+    """Returns the user and system CPU seconds of all processes whose name contains one of names."""
+    import psutil
+    seconds = 0.0
+    for proc in psutil.process_iter():
+        try:
+            if any([name in proc.name() for name in names]):
+                cpu = proc.cpu_times()
+                seconds += cpu.user + cpu.system
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return seconds
+
+
+def gauge_mean(collector, metric, start, end):
+    samples = collector.series(metric, start, end)
+    return sum([s.avg for s in samples]) / len(samples) if len(samples) > 0 else None
+
+
+def run_step(ns, collection_name, collector, connections, depth):
+    namespace = 'test.' + collection_name
+    opened = []
+    connect_start = time.time()
+    try:
+        for _ in range(0, connections):
+            opened.append(Connection(ns['host'], ns['port']))
+    except socket.error as e:
+        print 'Could only open %d of %d connections: %s' % (len(opened), connections, e)
+        for connection in opened:
+            connection.close()
+        return None
+    connect_time = time.time() - connect_start
+
+    threads = min(ns['threads'], connections)
+    workers = [
+        Worker(opened[ii::threads], depth, namespace, ns['record_count'], ns['seed'] + ii) for ii in range(0, threads)
+    ]
+    measure_start = time.time() + ns['warmup']
+    stop_time = measure_start + ns['duration']
+    for worker in workers:
+        worker.start(measure_start, stop_time)
+
+    time.sleep(max(0, measure_start - time.time()))
+    client_cpu = sum(os.times()[:2])
+    server_cpu = process_cpu_seconds() if collector is None and ns['psutil'] else None
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - measure_start
+    client_cpu = sum(os.times()[:2]) - client_cpu
+    if server_cpu is not None:
+        server_cpu = process_cpu_seconds() - server_cpu
+    for connection in opened:
+        connection.close()
+
+    latency = stats.LatencyHistogram()
+    for worker in workers:
+        latency.merge(worker.latency)
+    step = OrderedDict([
+        ('connections', connections),
+        ('depth', depth),
+        ('connect_s', connect_time),
+        ('ops_per_s', sum([w.completed for w in workers]) / ns['duration']),
+        ('latency', latency.to_dict()),
+        ('p99.9_us', latency.percentile(99.9)),
+        ('errors', sum([w.errors for w in workers])),
+        ('client_cpu_percent', 100.0 * client_cpu / elapsed),
+        ('server_cpu_percent', 100.0 * server_cpu / elapsed if server_cpu is not None else None),
+        ('main_thread_cpu_percent', None),
+        ('active_connections', None),
+    ])
+    if collector is not None:
+        collector.wait_for_flush()
+        step['server_cpu_percent'] = gauge_mean(collector, console_metrics.CPU_PERCENTAGE, measure_start, stop_time)
+        step['main_thread_cpu_percent'] = gauge_mean(collector, console_metrics.MAIN_THREAD_CPU_PERCENTAGE,
+                                                     measure_start, stop_time)
+        step['active_connections'] = gauge_mean(collector, console_metrics.ACTIVE_CONNECTIONS, measure_start,
+                                                stop_time)
+    return step
+
+
+def format_optional(value, spec):
+    return ('{:' + spec + '}').format(value) if value is not None else '-'
+
+
+def print_step(step):
+    print '{:>7} {:>6} {:>10.1f} {:>10} {:>10} {:>10} {:>7} {:>8} {:>8} {:>8} {:>8}'.format(
+        step['connections'], step['depth'], step['ops_per_s'], step['latency']['p50_us'], step['latency']['p99_us'],
+        step['p99.9_us'], step['errors'], format_optional(step['server_cpu_percent'], '.1f'),
+        format_optional(step['main_thread_cpu_percent'], '.1f'), '%.1f' % step['client_cpu_percent'],
+        format_optional(step['active_connections'], '.0f'))
+
+
+def run_connection_bench(ns):
+    collection_name = ycsb.load_records(ns)
+    if collection_name is None:
+        return False
+    if not raise_file_limit(max(ns['connections']) + 100):
+        print 'WARNING: the open file limit is below %d, the largest steps will fail' % max(ns['connections'])
+
+    collector = ycsb.start_collector(ns)
+    print '{:>7} {:>6} {:>10} {:>10} {:>10} {:>10} {:>7} {:>8} {:>8} {:>8} {:>8}'.format(
+        'conns', 'depth', 'ops/s', 'p50 us', 'p99 us', 'p99.9 us', 'errors', 'srv cpu', 'main cpu', 'cli cpu',
+        'srv conn')
+    steps = []
+    best = None
+    saturation = None
+    for (connections, depth) in itertools.product(ns['connections'], ns['depths']):
+        step = run_step(ns, collection_name, collector, connections, depth)
+        if step is None:
+            break
+        print_step(step)
+        sys.stdout.flush()
+        steps.append(step)
+        # saturated once more requests in flight no longer buy more throughput
+        if best is not None and saturation is None and step['ops_per_s'] < (1 + ns['min_gain']) * best['ops_per_s'] \
+                and connections * depth > best['connections'] * best['depth']:
+            saturation = step
+        if best is None or step['ops_per_s'] > best['ops_per_s']:
+            best = step
+
+    if collector is not None:
+        collector.stop()
+    if best is not None:
+        print 'Best throughput %.1f/s with %d connections at depth %d' % (best['ops_per_s'], best['connections'],
+                                                                          best['depth'])
+    if saturation is not None:
+        print 'Throughput stopped growing at %d connections at depth %d' % (saturation['connections'],
+                                                                            saturation['depth'])
+    # the worker threads share the GIL, so the client saturates at one core whatever --threads is
+    if any([s['client_cpu_percent'] > CLIENT_CPU_BOUND_PERCENT for s in steps]):
+        print 'WARNING: the client was CPU bound in some steps, run several instances of the benchmark to go further'
+
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump(steps, f, indent=2)
+    if ns['drop']:
+        client = pymongo.MongoClient(ns['host'], ns['port'])
+        client['test'][collection_name].drop()
+        client.close()
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput and latency of Document Layer over connections and depths')
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument(
+        '--connections',
+        type=lambda s: [int(n) for n in s.split(',')],
+        default=[1, 10, 100, 1000, 2000],
+        help='comma separated numbers of client connections')
+    parser.add_argument(
+        '--depths',
+        type=lambda s: [int(n) for n in s.split(',')],
+        default=[1, 8, 50],
+        help='comma separated numbers of requests in flight per connection')
+    parser.add_argument('--duration', type=float, default=15, help='seconds to measure every step for')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds to run every step before measuring')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='number of client threads sharing the sockets')
+    parser.add_argument(
+        '--min-gain',
+        type=float,
+        default=0.1,
+        help='throughput gain below which more requests in flight count as saturation')
+    parser.add_argument(
+        '-r', '--record-count', type=int, default=10000, help='number of records to load, or loaded before with --skip-load')
+    parser.add_argument('-c', '--collection', default='', help='collection in database test, generated by default')
+    parser.add_argument(
+        '--skip-load', default=False, action='store_true', help='run on the records loaded into --collection before')
+    parser.add_argument('--load-processes', type=int, default=1, help='number of processes loading the records')
+    parser.add_argument('--load-batch-size', type=int, default=100, help='number of records per insert when loading')
+    parser.add_argument('--drop', default=False, action='store_true', help='drop the collection afterwards')
+    parser.add_argument('--seed', type=int, default=random.randint(0, sys.maxint), help='random seed to use')
+    parser.add_argument('--trace-dir', default='', help='trace directory of Document Layer for its CPU gauges')
+    parser.add_argument(
+        '--no-psutil', dest='psutil', default=True, action='store_false', help='do not measure the CPU of fdbdoc')
+    parser.add_argument('--output', default='', help='JSON file to write the steps to')
+
+    ns = vars(parser.parse_args())
+    if ns['skip_load'] and ns['collection'] == '':
+        parser.error('--skip-load needs --collection')
+    sys.exit(not run_connection_bench(ns))
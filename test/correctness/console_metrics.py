@@ -0,0 +1,278 @@
+#!/usr/bin/python
+#
+# console_metrics.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Collector of the metrics Document Layer publishes with its default ConsoleMetric reporter. Every flush interval (5
+# seconds by default) the reporter writes one ConsoleMetric event per metric with new data to the trace files in the
+# --logdir of Document Layer. The collector tails these files in a background thread and keeps the events as a time
+# series, so that they can be lined up with client side timings of the same period. Event times are the wall clock
+# of the server, aligning them with the client assumes both run on the same host or have synchronized clocks.
+#
+# It can run on its own alongside any benchmark or fuzz run, printing or saving the time series:
+#
+#   console_metrics.py --trace-dir /var/log/foundationdb/document --output metrics.jsonl
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# metric ids, from src/Constants.cpp
+QUERY_LATENCY = 'dl_query_latency_useconds'
+INSERT_LATENCY = 'dl_insert_latency_useconds'
+TR_PER_REQUEST = 'dl_tr_per_request'
+INDEX_SCAN_DOCS = 'dl_index_scan_rate'
+TABLE_SCAN_DOCS = 'dl_table_scan_rate'
+ACTIVE_CURSORS = 'dl_active_cursors'
+ACTIVE_CONNECTIONS = 'dl_active_connections'
+NEW_CONNECTIONS = 'dl_new_connections'
+CPU_PERCENTAGE = 'dl_cpu_percentage'
+MAIN_THREAD_CPU_PERCENTAGE = 'dl_main_th_cpu_percentage'
+MEMORY_USAGE = 'dl_memory_usage_bytes'
+
+FLUSH_INTERVAL = 5
+
+PERCENTILES = [('p25', 'Top25%'), ('p50', 'Top50%'), ('p90', 'Top90%'), ('p99', 'Top99%'), ('p99.99', 'Top99.99%')]
+
+EVENT_ATTRIBUTE = re.compile(r'([\w.%]+)="([^"]*)"')
+
+
+class Sample(object):
+    """
+    One ConsoleMetric event: the statistics of a metric over the flush interval ending at time. Gauges only have a
+    value, which is kept as count 1 with sum, avg, min and max all set to it.
+    """
+
+    def __init__(self, time, metric, metric_type, count, total, avg, min_value, max_value, percentiles):
+        self.time = time
+        self.metric = metric
+        self.type = metric_type
+        self.count = count
+        self.sum = total
+        self.avg = avg
+        self.min = min_value
+        self.max = max_value
+        self.percentiles = percentiles
+
+    def to_dict(self):
+        d = OrderedDict([
+            ('time', self.time),
+            ('metric', self.metric),
+            ('type', self.type),
+            ('count', self.count),
+            ('sum', self.sum),
+            ('avg', self.avg),
+            ('min', self.min),
+            ('max', self.max),
+        ])
+        d.update(self.percentiles)
+        return d
+
+
+def parse_event(line):
+    """Returns the Sample of a ConsoleMetric trace event line, None for any other line."""
+    if 'ConsoleMetric' not in line:
+        return None
+    attributes = dict(EVENT_ATTRIBUTE.findall(line))
+    if attributes.get('Type') != 'ConsoleMetric' or 'MetricId' not in attributes:
+        return None
+    t = float(attributes['Time'])
+    if 'Value' in attributes:
+        value = float(attributes['Value'])
+        return Sample(t, attributes['MetricId'], attributes['MetricType'], 1, value, value, value, value,
+                      OrderedDict([(name, value) for (name, _) in PERCENTILES]))
+    return Sample(t, attributes['MetricId'], attributes['MetricType'], int(attributes['Count']),
+                  int(attributes['Sum']), float(attributes['Avg']), int(attributes['Min']), int(attributes['Max']),
+                  OrderedDict([(name, int(attributes[detail])) for (name, detail) in PERCENTILES if detail in attributes]))
+
+
+class MetricsCollector(object):
+    """
+    Tails the trace files of a Document Layer in a background thread and collects the ConsoleMetric samples. Only
+    events written after start() are collected, unless from_start is set. Files created later, e.g. when the trace
+    file rolls, are read from their beginning. on_sample is called from the collector thread with every new sample.
+    """
+
+    def __init__(self, trace_dir, poll_interval=1.0, from_start=False, on_sample=None):
+        self.trace_dir = trace_dir
+        self.poll_interval = poll_interval
+        self.from_start = from_start
+        self.on_sample = on_sample
+        self.samples = []
+        self.lock = threading.Lock()
+        # polls happen in the collector thread and in wait_for_flush(), the offsets must not be read twice
+        self.poll_lock = threading.Lock()
+        self.offsets = {}
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def trace_files(self):
+        return sorted(glob.glob(os.path.join(self.trace_dir, 'fdbdoc-trace*.xml')))
+
+    def start(self):
+        if not self.from_start:
+            self.offsets = dict([(path, os.path.getsize(path)) for path in self.trace_files()])
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops the thread after reading what has been written until now."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.poll()
+
+    def run(self):
+        while not self.stopping.wait(self.poll_interval):
+            self.poll()
+
+    def poll(self):
+        """Reads the complete lines appended to the trace files since the last poll."""
+        with self.poll_lock:
+            new_samples = []
+            for path in self.trace_files():
+                with open(path) as f:
+                    f.seek(self.offsets.get(path, 0))
+                    data = f.read()
+                # a partial last line is read again at the next poll
+                consumed = data.rfind('\n') + 1
+                self.offsets[path] = self.offsets.get(path, 0) + consumed
+                for line in data[:consumed].splitlines():
+                    sample = parse_event(line)
+                    if sample is not None:
+                        new_samples.append(sample)
+            new_samples.sort(key=lambda s: s.time)
+            with self.lock:
+                self.samples.extend(new_samples)
+            if self.on_sample is not None:
+                for sample in new_samples:
+                    self.on_sample(sample)
+
+    def series(self, metric, start=None, end=None):
+        """The samples of a metric published in (start, end], all of them if not given."""
+        with self.lock:
+            return [
+                s for s in self.samples
+                if s.metric == metric and (start is None or s.time > start) and (end is None or s.time <= end)
+            ]
+
+    def wait_for_flush(self, flush_interval=FLUSH_INTERVAL):
+        """Waits until the metrics of the requests done until now have been published and read."""
+        time.sleep(flush_interval + self.poll_interval)
+        self.poll()
+
+
+def summarize(samples):
+    """
+    Combines the samples of one metric over several flush intervals. Count, sum, mean, min and max are exact, the
+    percentiles are only the count-weighted mean of the percentiles of every interval, as these can not be merged.
+    """
+    count = sum([s.count for s in samples])
+    summary = OrderedDict([
+        ('samples', len(samples)),
+        ('count', count),
+        ('sum', sum([s.sum for s in samples])),
+        ('mean', float(sum([s.sum for s in samples])) / count if count > 0 else 0.0),
+        ('min', min([s.min for s in samples]) if samples else 0),
+        ('max', max([s.max for s in samples]) if samples else 0),
+    ])
+    for (name, _) in PERCENTILES:
+        weighted = [(s.percentiles[name], s.count) for s in samples if name in s.percentiles]
+        weight = sum([w for (_, w) in weighted])
+        summary[name] = float(sum([v * w for (v, w) in weighted])) / weight if weight > 0 else 0.0
+    return summary
+
+
+def compare_latency(client, server_samples):
+    """
+    Lines up a client side stats.LatencyHistogram with the samples of a server side latency metric in microseconds
+    of the same period. The difference is spent outside of the request handling of Document Layer: in the network,
+    in the client and queued in front of the server.
+    """
+    server = summarize(server_samples)
+    return OrderedDict([
+        ('client_count', client.count),
+        ('server_count', server['count']),
+        ('client_mean_us', round(client.mean(), 1)),
+        ('server_mean_us', round(server['mean'], 1)),
+        ('client_p50_us', client.percentile(50)),
+        ('server_p50_us', round(server['p50'], 1)),
+        ('client_p99_us', client.percentile(99)),
+        ('server_p99_us', round(server['p99'], 1)),
+        ('client_max_us', client.max),
+        ('server_max_us', server['max']),
+    ])
+
+
+def print_comparison(name, comparison):
+    print '{:<26} {:>10} {:>12} {:>12} {:>12} {:>12}'.format('latency', 'count', 'mean us', 'p50 us', 'p99 us',
+                                                               'max us')
+    for side in ['client', 'server']:
+        print '{:<26} {:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+            '%s (%s)' % (name, side), comparison[side + '_count'], comparison[side + '_mean_us'],
+            comparison[side + '_p50_us'], comparison[side + '_p99_us'], comparison[side + '_max_us'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collects the ConsoleMetric metrics of a running Document Layer')
+    parser.add_argument('--trace-dir', required=True, help='trace directory (--logdir) of Document Layer')
+    parser.add_argument(
+        '--metrics', type=lambda s: s.split(','), default=[], help='comma separated metric ids to collect, all by default')
+    parser.add_argument('--duration', type=float, default=0, help='seconds to collect for, 0 to run until interrupted')
+    parser.add_argument('--from-start', default=False, action='store_true', help='also read events written before')
+    parser.add_argument('--output', default='', help='file to append the samples to as JSON lines')
+    parser.add_argument('-q', '--quiet', default=False, action='store_true', help='do not print the samples')
+    ns = vars(parser.parse_args())
+
+    output = open(ns['output'], 'a') if ns['output'] != '' else None
+
+    def on_sample(sample):
+        if len(ns['metrics']) > 0 and sample.metric not in ns['metrics']:
+            return
+        if not ns['quiet']:
+            print '%.3f %-28s count=%d avg=%.1f p50=%s p99=%s max=%s' % (sample.time, sample.metric, sample.count,
+                                                                         sample.avg, sample.percentiles.get('p50'),
+                                                                         sample.percentiles.get('p99'), sample.max)
+            sys.stdout.flush()
+        if output is not None:
+            output.write(json.dumps(sample.to_dict()) + '\n')
+            output.flush()
+
+    collector = MetricsCollector(ns['trace_dir'], from_start=ns['from_start'], on_sample=on_sample)
+    collector.start()
+    try:
+        end_time = time.time() + ns['duration'] if ns['duration'] > 0 else None
+        while end_time is None or time.time() < end_time:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    collector.stop()
+    if output is not None:
+        output.close()
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+#
+# cursor_bench.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Sweep of client batch sizes, document sizes and result set sizes of cursors. Document Layer fills a reply until it
+# holds more than MAX_RETURNABLE_DOCUMENTS (101) documents and more than DEFAULT_RETURNABLE_DATA_SIZE (4 MB), or more
+# than MAX_RETURNABLE_DATA_SIZE (16 MB), or the batch size of the client is reached. The rest is fetched with getMore
+# round trips. For every combination this measures the time to the first document, the throughput of reading the
+# whole result and the number of getMore round trips, counted with pymongo command monitoring.
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+from collections import OrderedDict
+
+import pymongo
+from pymongo import monitoring
+
+import bulk_loader
+import stats
+
+
+class GetMoreCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.get_mores = 0
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name == 'getMore':
+            self.get_mores += 1
+
+    def failed(self, event):
+        pass
+
+
+def generate_documents(number, doc_size):
+    padding = 'x' * doc_size
+    for i in range(0, number):
+        yield {'_id': i, 'pad': padding}
+
+
+def load_collection(ns, collection, doc_size):
+    number = max(ns['result_sizes'])
+    collection.drop()
+    # batches stay well below the 48 MB message limit
+    loader = bulk_loader.BulkLoader(collection, batch_size=1000, batch_bytes=8 * (1 << 20), ordered=False)
+    start = time.time()
+    loader.load(generate_documents(number, doc_size))
+    print 'Loaded %d documents of %d bytes in %.2f s' % (number, doc_size, time.time() - start)
+
+
+def read_result(collection, result_size, batch_size):
+    """Reads a result of result_size documents, returns (seconds to the first document, seconds in total, docs)."""
+    start = time.time()
+    cursor = collection.find({'_id': {'$lt': result_size}}, batch_size=batch_size)
+    first = None
+    docs = 0
+    for _ in cursor:
+        if first is None:
+            first = time.time() - start
+        docs += 1
+    return (first if first is not None else 0.0, time.time() - start, docs)
+
+
+def run_point(ns, collection, counter, doc_size, result_size, batch_size):
+    first_latency = stats.LatencyHistogram()
+    total_latency = stats.LatencyHistogram()
+    (docs, seconds) = (0, 0.0)
+    for _ in range(0, ns['warmup']):
+        read_result(collection, result_size, batch_size)
+    get_mores = counter.get_mores
+    for _ in range(0, ns['iterations']):
+        (first, total, returned) = read_result(collection, result_size, batch_size)
+        first_latency.record(first)
+        total_latency.record(total)
+        docs += returned
+        seconds += total
+    return OrderedDict([
+        ('doc_size', doc_size),
+        ('result_size', result_size),
+        ('batch_size', batch_size),
+        ('first_doc', first_latency.to_dict()),
+        ('total', total_latency.to_dict()),
+        ('docs_per_s', docs / seconds if seconds > 0 else 0.0),
+        ('mb_per_s', docs * doc_size / seconds / (1 << 20) if seconds > 0 else 0.0),
+        ('get_mores', float(counter.get_mores - get_mores) / ns['iterations']),
+    ])
+
+
+def print_header():
+    print '{:>9} {:>9} {:>7} {:>12} {:>12} {:>12} {:>10} {:>9}'.format('doc size', 'result', 'batch', 'first p50 us',
+                                                                       'first p99 us', 'docs/s', 'MB/s', 'getMores')
+
+
+def print_point(point):
+    print '{:>9} {:>9} {:>7} {:>12} {:>12} {:>12.1f} {:>10.2f} {:>9.1f}'.format(
+        point['doc_size'], point['result_size'], point['batch_size'] if point['batch_size'] > 0 else 'default',
+        point['first_doc']['p50_us'], point['first_doc']['p99_us'], point['docs_per_s'], point['mb_per_s'],
+        point['get_mores'])
+
+
+def run_sweep(ns):
+    counter = GetMoreCounter()
+    client = pymongo.MongoClient(ns['host'], ns['port'], event_listeners=[counter])
+    collection_name = ns['collection'] if ns['collection'] != '' else 'cursor' + str(random.random())[2:]
+    collection = client['test'][collection_name]
+
+    points = []
+    for doc_size in ns['doc_sizes']:
+        load_collection(ns, collection, doc_size)
+        print_header()
+        for (result_size, batch_size) in itertools.product(ns['result_sizes'], ns['batch_sizes']):
+            point = run_point(ns, collection, counter, doc_size, result_size, batch_size)
+            print_point(point)
+            points.append(point)
+
+    collection.drop()
+    client.close()
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump(points, f, indent=2)
+    return True
+
+
+def int_list(s):
+    return [int(n) for n in s.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep of cursor batch sizes, document sizes and result sizes')
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument(
+        '--batch-sizes',
+        type=int_list,
+        default=[0, 10, 101, 1000, 10000],
+        help='comma separated client batch sizes, 0 for the default of the server')
+    parser.add_argument(
+        '--doc-sizes', type=int_list, default=[100, 1000, 10000], help='comma separated document sizes in bytes')
+    parser.add_argument(
+        '--result-sizes',
+        type=int_list,
+        default=[100, 1000, 10000],
+        help='comma separated numbers of documents per result, the largest one is loaded')
+    parser.add_argument('--iterations', type=int, default=10, help='number of measured reads of every result')
+    parser.add_argument('--warmup', type=int, default=1, help='number of unmeasured reads of every result')
+    parser.add_argument('-c', '--collection', default='', help='collection in database test, generated by default')
+    parser.add_argument('--output', default='', help='JSON file to write the results to')
+    ns = vars(parser.parse_args())
+    sys.exit(not run_sweep(ns))
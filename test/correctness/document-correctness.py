@@ -23,15 +23,25 @@
 
 import argparse
 import copy
+import json
 import os.path
 import random
+import re
 import sys
+import time
 import pprint
+from collections import OrderedDict
 
 import pymongo
+from bson.son import SON
 
 import gen
+import op_trace
+import slow_queries
+import stats
 import util
+from bulk_loader import BulkLoader
+from collection_pool import CollectionPool
 from mongo_model import MongoCollection
 from mongo_model import MongoModel
 from mongo_model import SortedDict
@@ -39,20 +49,34 @@ from gen import HashableOrderedDict
 from util import MongoModelException
 
 
-def get_clients(str1, str2, ns):
-    client_dict = {
-        "mongo": lambda: pymongo.MongoClient(ns['mongo_host'], ns['mongo_port'], maxPoolSize=1),
-        "mm": lambda: MongoModel("DocLayer"),
-        "doclayer": lambda: pymongo.MongoClient(ns['doclayer_host'], ns['doclayer_port'], maxPoolSize=1)
-    }
-    if 'mongo' in [ns['1'], ns['2']] and 'mm' in [ns['1'], ns['2']]:
-        client_dict['mm'] = lambda: MongoModel("MongoDB")
-
+def get_client(tester, ns, testers):
+    """
+    Returns the client of a tester, which is one of mongo, doclayer or mm. mongo and doclayer may be followed by
+    @host:port, mm by :DocLayer or :MongoDB to choose the flavour of the model.
+    """
+    kind = util.tester_kind(tester)
+    if kind == 'mm':
+        if ':' in tester:
+            return MongoModel(tester.split(':', 1)[1])
+        kinds = [util.tester_kind(t) for t in testers]
+        return MongoModel("MongoDB" if 'mongo' in kinds else "DocLayer")
+    if '@' in tester:
+        (host, port) = tester.split('@', 1)[1].rsplit(':', 1)
+        return pymongo.MongoClient(host, int(port), maxPoolSize=1)
+    return pymongo.MongoClient(ns[kind + '_host'], ns[kind + '_port'], maxPoolSize=1)
+
+
+def get_instance_id(ns):
     instance_id = str(random.random())[2:] if ns['instance_id'] == 0 else str(ns['instance_id'])
     print 'Instance: ' + instance_id
+    return instance_id
+
+
+def get_clients(str1, str2, ns):
+    instance_id = get_instance_id(ns)
 
-    client1 = client_dict[str1]()
-    client2 = client_dict[str2]()
+    client1 = get_client(str1, ns, [str1, str2])
+    client2 = get_client(str2, ns, [str1, str2])
     return (client1, client2, instance_id)
 
 
@@ -72,32 +96,46 @@ def get_collections(ns):
     return (collection1, collection2)
 
 
-def get_result(query, collection, projection, sort, limit, skip, exception_msg):
+def get_result(query, collection, projection, sort, limit, skip, exception_msg, backend=None):
+    """
+    Returns the normalized result of the query and the seconds it took to fetch it. Only draining the cursor is timed
+    as "find", normalizing the documents for the comparison is timed as "normalize".
+    """
+    start = time.time()
+    find_seconds = None
     try:
         if gen.global_prng.random() < 0.10:
             cur = collection.find(query, projection, batch_size=gen.global_prng.randint(2, 10))
         else:
             cur = collection.find(query, projection)
 
-        if sort is None:
-            ret = [util.deep_convert_to_unordered(i) for i in cur]
-            ret.sort(cmp=util.mongo_compare_unordered_dict_items)
-        elif isinstance(collection, MongoCollection):
-            ret = copy.deepcopy([i for i in cur])
-            for i, val in enumerate(ret):
-                if '_id' in val:
-                    val['_id'] = 0
-
-            ret = util.MongoModelNondeterministicList(ret, sort, limit, skip, query, projection, collection.options)
-            # print ret
+        if sort is None or isinstance(collection, MongoCollection):
+            docs = [i for i in cur]
         else:
-            ret = [i for i in cur.sort(sort).skip(skip).limit(limit)]
-            for i, val in enumerate(ret):
-                if '_id' in val:
-                    val['_id'] = 0
-                # print '1====', i, ret[i]
+            docs = [i for i in cur.sort(sort).skip(skip).limit(limit)]
+        find_seconds = time.time() - start
+        timings.record('find', find_seconds, backend)
+
+        with timings.timer('normalize', backend):
+            if sort is None:
+                ret = [util.deep_convert_to_unordered(i) for i in docs]
+                ret.sort(cmp=util.mongo_compare_unordered_dict_items)
+            elif isinstance(collection, MongoCollection):
+                ret = copy.deepcopy(docs)
+                for i, val in enumerate(ret):
+                    if '_id' in val:
+                        val['_id'] = 0
+
+                ret = util.MongoModelNondeterministicList(ret, sort, limit, skip, query, projection, collection.options)
+                # print ret
+            else:
+                ret = docs
+                for i, val in enumerate(ret):
+                    if '_id' in val:
+                        val['_id'] = 0
+                    # print '1====', i, ret[i]
 
-        return ret
+        return (ret, find_seconds)
 
     except pymongo.errors.OperationFailure as e:
         exception_msg.append('Caught PyMongo error:\n\n'
@@ -110,7 +148,11 @@ def get_result(query, collection, projection, sort, limit, skip, exception_msg):
                              '  Query: %s\n' % str(query) + '  Projection: %s\n' % str(projection) +
                              '  Sort: %s\n' % str(sort) + '  Limit: %r\n' % limit + '  Skip: %r\n' % skip)
 
-    return list()
+    if find_seconds is None:
+        # the find itself failed
+        find_seconds = time.time() - start
+        timings.record('find', find_seconds, backend)
+    return (list(), find_seconds)
 
 
 def format_result(collection, result, index):
@@ -152,30 +194,74 @@ def diff_results(cA, rA, cB, rB):
 zero_resp_queries = 0
 total_queries = 0
 
+# timings of the current iteration, replaced by one_iteration()
+timings = stats.Timings(['1', '2'])
+
+# keeps the operations slower than --slow-query-ms, set by run_iterations()
+slow_log = None
+
+
+def observe_slow(collection, backend, seconds, op, args, before=None):
+    # only the servers are held to the threshold, not the model
+    if slow_log is not None and not isinstance(collection, MongoCollection):
+        slow_log.observe(collection, timings.backends[backend], seconds, op, args, before)
+
 
-def check_query(query, collection1, collection2, projection=None, sort=None, limit=0, skip=0):
+def capture_before_write(collection):
+    """The documents of the collection to keep an operation that writes with, if it turns out to be slow."""
+    if slow_log is not None and not isinstance(collection, MongoCollection):
+        return slow_log.capture(collection)
+    return None
+
+
+def check_query(query, collections, projection=None, sort=None, limit=0, skip=0, reference=0):
     util.trace('debug', '\n==================================================')
-    util.trace('debug', 'checking consistency bettwen the two collections...')
+    util.trace('debug', 'checking consistency bettwen the collections...')
     util.trace('debug', 'query:', query)
     util.trace('debug', 'sort:', sort)
     util.trace('debug', 'limit:', limit)
     util.trace('debug', 'skip:', skip)
 
-    exception_msg = list()
-
-    ret1 = get_result(query, collection1, projection, sort, limit, skip, exception_msg)
-    ret2 = get_result(query, collection2, projection, sort, limit, skip, exception_msg)
-    if len(exception_msg) == 1:
-        print '\033[91m\n', exception_msg[0], '\033[0m'
+    results = []
+    exception_msgs = []
+    for (ii, collection) in enumerate(collections):
+        exception_msg = list()
+        (result, find_seconds) = get_result(query, collection, projection, sort, limit, skip, exception_msg, ii)
+        results.append(result)
+        observe_slow(collection, ii, find_seconds, 'find',
+                     SON([('filter', query), ('projection', projection), ('sort', op_trace.as_pairs(sort)),
+                          ('skip', skip), ('limit', limit)]))
+        exception_msgs.append(exception_msg)
+
+    # every collection is compared with the reference, and all differences are reported
+    okay = True
+    for ii in range(0, len(collections)):
+        if ii == reference:
+            continue
+        if len(exception_msgs[reference]) + len(exception_msgs[ii]) == 1:
+            print '\033[91m\n', (exception_msgs[reference] + exception_msgs[ii])[0], '\033[0m'
+            okay = False
+    if not okay:
         return False
 
     global total_queries
     total_queries += 1
-    if len(ret1) == 0 and len(ret2) == 0:
+    if all([len(ret) == 0 for ret in results]):
         global zero_resp_queries
         zero_resp_queries += 1
         # print 'Zero responses so far: {}/{}'.format(zero_resp_queries, total_queries)
 
+    with timings.timer('compare'):
+        for ii in range(0, len(collections)):
+            if ii == reference:
+                continue
+            if not compare_results(query, collections[reference], collections[ii], results[reference], results[ii],
+                                   projection):
+                okay = False
+    return okay
+
+
+def compare_results(query, collection1, collection2, ret1, ret2, projection):
     if isinstance(ret1, util.MongoModelNondeterministicList):
         return ret1.compare(ret2)
     elif isinstance(ret2, util.MongoModelNondeterministicList):
@@ -217,62 +303,57 @@ def check_query(query, collection1, collection2, projection=None, sort=None, lim
         return False
 
 
-def test_update(collection1, collection2, verbose=False):
+def test_update(collections, verbose=False, reference=0):
     for i in range(1, 10):
-        exceptionOne = None
-        exceptionTwo = None
-        update = gen.random_update(collection1)
+        update = gen.random_update(collections[reference])
 
         util.trace('debug', '\n========== Update No.', i, '==========')
         util.trace('debug', 'Query:', update['query'])
         util.trace('debug', 'Update:', str(update['update']))
         util.trace('debug', 'Number results from collection: ', gen.count_query_results(
-            collection1, update['query']))
-        for item in collection1.find(update['query']):
-            util.trace('debug', 'Find Result1:', item)
-        for item in collection2.find(update['query']):
-            util.trace('debug', 'Find Result2:', item)
-
-        try:
-            if verbose:
-                all = [x for x in collection1.find(dict())]
-                for item in collection1.find(update['query']):
-                    print '[{}] Before update doc:{}'.format(type(collection1), item)
-                print 'Before update collection1 size: ', len(all)
-            collection1.update(update['query'], update['update'], upsert=update['upsert'], multi=update['multi'])
-        except pymongo.errors.OperationFailure as e:
-            exceptionOne = e
-        except MongoModelException as e:
-            exceptionOne = e
-        try:
-            if verbose:
-                all = [x for x in collection2.find(dict())]
-                for item in collection2.find(update['query']):
-                    print '[{}]Before update doc:{}'.format(type(collection2), item)
-                print 'Before update collection2 size: ', len(all)
-            collection2.update(update['query'], update['update'], upsert=update['upsert'], multi=update['multi'])
-        except pymongo.errors.OperationFailure as e:
-            exceptionTwo = e
-        except MongoModelException as e:
-            exceptionTwo = e
-
-        if (exceptionOne is None and exceptionTwo is None):
+            collections[reference], update['query']))
+        for (ii, collection) in enumerate(collections):
+            for item in collection.find(update['query']):
+                util.trace('debug', 'Find Result%d:' % (ii + 1), item)
+
+        exceptions = []
+        for (ii, collection) in enumerate(collections):
+            exception = None
+            try:
+                if verbose:
+                    all_docs = [x for x in collection.find(dict())]
+                    for item in collection.find(update['query']):
+                        print '[{}] Before update doc:{}'.format(type(collection), item)
+                    print 'Before update collection%d size: ' % (ii + 1), len(all_docs)
+                before = capture_before_write(collection)
+                start = time.time()
+                with timings.timer('update', ii):
+                    collection.update(update['query'], update['update'], upsert=update['upsert'], multi=update['multi'])
+                observe_slow(collection, ii, time.time() - start, 'update',
+                             SON([('query', update['query']), ('update', update['update']),
+                                  ('upsert', update['upsert']), ('multi', update['multi'])]), before)
+            except pymongo.errors.OperationFailure as e:
+                exception = e
+            except MongoModelException as e:
+                exception = e
+            exceptions.append(exception)
+
+        if all([x is None for x in exceptions]):
             # happy case, proceed to consistency check
             pass
-        elif exceptionOne is not None and exceptionTwo is not None:
-            # or (exceptionOne is not None and exceptionTwo is not None and exceptionOne.code == exceptionTwo.code)):
+        elif all([x is not None for x in exceptions]):
             # TODO re-enable the exact error check.
             # TODO re-enable consistency check when failure happened
             return (True, True)
         else:
             print 'Unmatched result: '
-            print type(exceptionOne), ': ', str(exceptionOne)
-            print type(exceptionTwo), ': ', str(exceptionTwo)
-            ignored_exception_check(exceptionOne)
-            ignored_exception_check(exceptionTwo)
+            for e in exceptions:
+                print type(e), ': ', str(e)
+            for e in exceptions:
+                ignored_exception_check(e)
             return (False, False)
 
-        if not check_query(dict(), collection1, collection2):
+        if not check_query(dict(), collections, reference=reference):
             return (False, False)
 
     return (True, False)
@@ -288,7 +369,8 @@ def ignored_exception_check(e):
         raise IgnoredException(str(e))
 
 
-def one_iteration(collection1, collection2, ns, seed):
+def one_iteration(collections, ns, seed, collection_pool=None):
+    reference = ns['reference_index']
     update_tests_enabled = ns['no_updates']
     sorting_tests_enabled = gen.generator_options.allow_sorts
     indexes_enabled = ns['no_indexes']
@@ -297,44 +379,42 @@ def one_iteration(collection1, collection2, ns, seed):
     num_doc = ns['num_doc']
     fname = "unknown"
 
-    def _run_operation_(op1, op2):
-        okay = True
-        exceptionOne = None
-        exceptionTwo = None
-        func1, args1, kwargs1 = op1
-        func2, args2, kwargs2 = op2
-        try:
-            func1(*args1, **kwargs1)
-        except pymongo.errors.OperationFailure as e:
-            if verbose:
-                print "Failed func1 with " + str(e)
-            exceptionOne = e
-        except MongoModelException as e:
-            if verbose:
-                print "Failed func1 with " + str(e)
-            exceptionOne = e
-        try:
-            func2(*args2, **kwargs2)
-        except pymongo.errors.OperationFailure as e:
-            if verbose:
-                print "Failed func2 with " + str(e)
-            exceptionTwo = e
-        except MongoModelException as e:
-            if verbose:
-                print "Failed func2 with " + str(e)
-            exceptionTwo = e
-
-        if ((exceptionOne is None and exceptionTwo is None)
-            or (exceptionOne is not None and exceptionTwo is not None and exceptionOne.code == exceptionTwo.code)):
-            pass
-        else:
-            print 'Unmatched result: '
-            print type(exceptionOne), ': ', str(exceptionOne)
-            print type(exceptionTwo), ': ', str(exceptionTwo)
-            okay = False
-            ignored_exception_check(exceptionOne)
-            ignored_exception_check(exceptionTwo)
-        return okay
+    global timings
+    timings = stats.Timings(ns['testers'])
+
+    def _run_operation_(ops, name):
+        # ops holds a (func, args, kwargs) per collection, the outcome of each is compared with the reference
+        exceptions = []
+        for (ii, (func, args, kwargs)) in enumerate(ops):
+            exception = None
+            try:
+                with timings.timer(name, ii):
+                    func(*args, **kwargs)
+            except pymongo.errors.OperationFailure as e:
+                if verbose:
+                    print "Failed func%d with %s" % (ii + 1, str(e))
+                exception = e
+            except MongoModelException as e:
+                if verbose:
+                    print "Failed func%d with %s" % (ii + 1, str(e))
+                exception = e
+            exceptions.append(exception)
+
+        exceptionOne = exceptions[reference]
+        unmatched = [x for (ii, x) in enumerate(exceptions) if ii != reference and not (
+            (exceptionOne is None and x is None) or
+            (exceptionOne is not None and x is not None and exceptionOne.code == x.code))]
+        if len(unmatched) == 0:
+            return True
+
+        print 'Unmatched result: '
+        print type(exceptionOne), ': ', str(exceptionOne)
+        for x in unmatched:
+            print type(x), ': ', str(x)
+        ignored_exception_check(exceptionOne)
+        for x in unmatched:
+            ignored_exception_check(x)
+        return False
 
     try:
         okay = True
@@ -344,8 +424,11 @@ def one_iteration(collection1, collection2, ns, seed):
 
         fname = util.save_cmd_line(util.command_line_str(ns, seed))
 
-        collection1.drop()
-        collection2.drop()
+        # pooled collections are handed out empty
+        if collection_pool is None:
+            timings.phase('reset')
+            for collection in collections:
+                collection.drop()
 
         indexes = []
         num_of_indexes = 5
@@ -359,55 +442,74 @@ def one_iteration(collection1, collection2, ns, seed):
         useUnique = (gen.global_prng.randint(1,200) == 1)
         # only allow one out of $num_of_indexes to be unique.
         allowed_ii = gen.global_prng.randint(1,num_of_indexes)
+        if slow_log is not None:
+            slow_log.begin(seed, [(index, useUnique and n == allowed_ii) for (n, index) in enumerate(indexes, 1)],
+                           {'command_line': util.command_line_str(ns, seed)})
         if indexes_first:
+            timings.phase('indexes')
             ii = 1
             for i in indexes:
                 if ii == allowed_ii:
                     uniqueIndex = useUnique
                 else:
                     uniqueIndex = False
+                if collection_pool is not None:
+                    collection_pool.note_index(i)
                 okay = _run_operation_(
-                    (collection1.ensure_index, (i,), {"unique": uniqueIndex}),
-                    (collection2.ensure_index, (i,), {"unique": uniqueIndex})
+                    [(collection.ensure_index, (i,), {"unique": uniqueIndex}) for collection in collections],
+                    'ensure_index'
                 )
                 if not okay:
                     return (okay, fname, None)
                 ii += 1
+        timings.phase('generate')
         docs = []
         for i in range(0, num_doc):
             doc = gen.random_document(True)
             docs.append(doc)
 
+        def print_batch(result):
+            if verbose:
+                print "Inserted " + str(result)
+
+        timings.phase('insert')
+        loaders = [BulkLoader(collection, ns['insert_batch_size'], ns['insert_batch_bytes'], report=print_batch)
+                   for collection in collections]
         okay = _run_operation_(
-            (collection1.insert, (docs,), {}),
-            (collection2.insert, (docs,), {})
+            [(loader.load, (docs,), {}) for loader in loaders],
+            'insert'
         )
         if not okay:
             print "Failed when doing inserts"
             return (okay, fname, None)
 
         if not indexes_first:
+            timings.phase('indexes')
             ii = 1
             for i in indexes:
                 if ii == allowed_ii:
                     uniqueIndex = useUnique
                 else:
                     uniqueIndex = False
+                if collection_pool is not None:
+                    collection_pool.note_index(i)
                 okay = _run_operation_(
-                    (collection1.ensure_index, (i,), {"unique": uniqueIndex}),
-                    (collection2.ensure_index, (i,), {"unique": uniqueIndex})
+                    [(collection.ensure_index, (i,), {"unique": uniqueIndex}) for collection in collections],
+                    'ensure_index'
                     )
                 if not okay:
                     print "Failed when adding index after insert"
                     return (okay, fname, None)
                 ii += 1
 
-        okay = check_query(dict(), collection1, collection2)
+        timings.phase('check')
+        okay = check_query(dict(), collections, reference=reference)
         if not okay:
             return (okay, fname, None)
 
         if update_tests_enabled:
-            okay, skip_current_iteration = test_update(collection1, collection2, verbose)
+            timings.phase('updates')
+            okay, skip_current_iteration = test_update(collections, verbose, reference)
             if skip_current_iteration:
                 if verbose:
                     print "Skipping current iteration due to the failure from update."
@@ -415,6 +517,7 @@ def one_iteration(collection1, collection2, ns, seed):
             if not okay:
                 return (okay, fname, None)
 
+        timings.phase('queries')
         for ii in range(1, 30):
             query = gen.random_query()
             if not sorting_tests_enabled:
@@ -434,7 +537,8 @@ def one_iteration(collection1, collection2, ns, seed):
             else:
                 projection = temp_projection
 
-            okay = check_query(query, collection1, collection2, projection, sort=sort, limit=limit, skip=skip)
+            okay = check_query(
+                query, collections, projection, sort=sort, limit=limit, skip=skip, reference=reference)
             if not okay:
                 return (okay, fname, None)
 
@@ -448,6 +552,8 @@ def one_iteration(collection1, collection2, ns, seed):
         import traceback
         traceback.print_exc()
         return (False, fname, e)
+    finally:
+        timings.phase(None)
 
     return (okay, fname, None)
 
@@ -466,33 +572,106 @@ ignored_exceptions = [
 def test_forever(ns):
     seed = ns['seed']
     bgf_enabled = ns['buggify']
+
+    gen.global_prng = random.Random(seed)
+
+    instance = get_instance_id(ns)
+    clients = [get_client(tester, ns, ns['testers']) for tester in ns['testers']]
+    # this assumes that the database name we use for testing is "test"
+    for (tester, client) in zip(ns['testers'], clients):
+        if util.tester_kind(tester) == 'doclayer':
+            client.test.command("buggifyknobs", bgf_enabled)
+
+    dbName = 'test-' + instance + '-' + str(gen.global_prng.randint(100000,100000000))
+    try:
+        okay = run_iterations(clients, dbName, instance, ns, seed)
+    finally:
+        # the clients are not reused once the test is over, e.g. by a long-lived test-automation pool worker
+        for client in clients:
+            if isinstance(client, pymongo.MongoClient):
+                client.close()
+
+    return okay
+
+
+def write_timings(fp, instance, iteration, seed, okay, seconds, iteration_timings):
+    # iteration is None for the summary of all iterations of a run
+    record = OrderedDict([
+        ('instance', instance),
+        ('pid', os.getpid()),
+        ('iteration', iteration),
+        ('seed', seed),
+        ('okay', okay),
+        ('seconds', seconds),
+        ('backends', iteration_timings.backends),
+        ('timings', iteration_timings.to_dict()),
+    ])
+    fp.write(json.dumps(record) + '\n')
+    fp.flush()
+
+
+def run_iterations(clients, dbName, instance, ns, seed):
     num_iter = ns['num_iter']
 
     jj = 0
     okay = True
 
-    gen.global_prng = random.Random(seed)
+    timing_log = None
+    total_timings = stats.Timings(ns['testers'])
+    if ns['timing_log'] is not None:
+        timing_log = open(ns['timing_log'], 'a')
 
-    (client1, client2, instance) = get_clients(ns['1'], ns['2'], ns)
-    # this assumes that the database name we use for testing is "test"
-    client = client1 if "doclayer" == ns['1'] else (client2 if "doclayer" == ns['2'] else None)
-    if client is not None:
-        client.test.command("buggifyknobs", bgf_enabled)
+    # only the operations sent to one server are recorded, preferably Document Layer
+    trace_writer = None
+    traced = None
+    if ns['record_trace'] is not None:
+        kinds = [util.tester_kind(tester) for tester in ns['testers']]
+        traced = kinds.index('doclayer' if 'doclayer' in kinds else 'mongo')
+        trace_writer = op_trace.TraceWriter(ns['record_trace'])
+
+    global slow_log
+    slow_log = slow_queries.open_log(ns, 'document-correctness')
+
+    collection_pool = None
+    if ns['reset_mode'] == 'pool':
+        collection_pool = CollectionPool(clients, dbName, 'correctness-' + instance + '-pool-',
+                                         ns['pool_size'])
 
-    dbName = 'test-' + instance + '-' + str(gen.global_prng.randint(100000,100000000))
     while okay:
         jj += 1
         if num_iter != 0 and jj > num_iter:
             break
 
+        # the name is generated in both modes, to keep the PRNG sequence of an iteration the same
         collName = 'correctness-' + instance + '-' + str(gen.global_prng.randint(100000,100000000))
-        collection1 = client1[dbName][collName]
-        collection2 = client2[dbName][collName]
+        if collection_pool is None:
+            collections = [client[dbName][collName] for client in clients]
+        else:
+            collections = list(collection_pool.acquire())
+            collName = collection_pool.current_name()
+            if trace_writer is not None:
+                # pooled collections are handed out empty, replay that as a drop
+                trace_writer.write(time.time(), 'drop', collName, {})
+        if trace_writer is not None:
+            collections[traced] = op_trace.RecordingCollection(trace_writer, collections[traced])
 
         print '========================================================'
         print 'PID : ' + str(os.getpid()) + ' iteration : ' + str(jj) + ' DB : ' + dbName + ' Collection: ' + collName
         print '========================================================'
-        (okay, fname, e) = one_iteration(collection1, collection2, ns, seed)
+        start = time.time()
+        (okay, fname, e) = one_iteration(collections, ns, seed, collection_pool)
+        if okay:
+            # house keeping, timed with the iteration so that the reset modes can be compared
+            timings.phase('reset')
+            if collection_pool is None:
+                for collection in collections:
+                    collection.drop()
+            else:
+                collection_pool.release()
+            timings.phase(None)
+        total_timings.merge(timings)
+        if timing_log is not None:
+            write_timings(timing_log, instance, jj, seed, okay, time.time() - start, timings)
 
         if not okay:
             # print 'Seed for failing iteration: ', seed
@@ -507,14 +686,27 @@ def test_forever(ns):
         seed = random.randint(0, sys.maxint)
         gen.global_prng = random.Random(seed)
 
-        # house keeping
-        collection1.drop()
-        collection2.drop()
+    # leave the data of a failed iteration around for investigation
+    if collection_pool is not None and okay:
+        collection_pool.drop()
+
+    if timing_log is not None:
+        write_timings(timing_log, instance, None, None, okay, None, total_timings)
+        timing_log.close()
+
+    if trace_writer is not None:
+        print 'Recorded ' + str(trace_writer.count) + ' operations to ' + ns['record_trace']
+        trace_writer.close()
+
+    if slow_log is not None:
+        print 'Kept ' + str(slow_log.count) + ' slow operations in ' + ns['slow_query_corpus']
+        slow_log.close()
+        slow_log = None
 
     return okay
 
 
-def start_forever_test(ns):
+def start_test(ns):
     gen.generator_options.test_nulls = ns['no_nulls']
     gen.generator_options.upserts_enabled = ns['no_upserts']
     gen.generator_options.numeric_fieldnames = ns['no_numeric_fieldnames']
@@ -522,9 +714,34 @@ def start_forever_test(ns):
 
     util.weaken_tests(ns)
 
+    kinds = [util.tester_kind(tester) for tester in ns['testers']]
+    if ns['record_trace'] is not None and 'doclayer' not in kinds and 'mongo' not in kinds:
+        print 'Nothing to record, --record-trace needs doclayer or mongo as one of the testers'
+        return False
+
     return test_forever(ns)
 
 
+def start_forever_test(ns):
+    ns['testers'] = [ns['1'], ns['2']]
+    ns['reference_index'] = 0
+    return start_test(ns)
+
+
+def start_fanout_test(ns):
+    ns['testers'] = ns['backend']
+    if len(ns['testers']) < 2:
+        print 'At least two backends are needed'
+        return False
+    if ns['reference'] is None:
+        ns['reference'] = ns['testers'][0]
+    if ns['reference'] not in ns['testers']:
+        print 'The reference ' + ns['reference'] + ' is not one of the backends'
+        return False
+    ns['reference_index'] = ns['testers'].index(ns['reference'])
+    return start_test(ns)
+
+
 def start_self_test(ns):
     from threading import Thread
     import time
@@ -591,7 +808,15 @@ def start_self_test(ns):
     print 'SUCCESS: Model was consistent with itself'
 
 
-if __name__ == '__main__':
+def backend_spec(spec):
+    kind = util.tester_kind(spec)
+    if kind not in ['mongo', 'mm', 'doclayer'] or (kind == 'mm' and spec not in ['mm', 'mm:DocLayer', 'mm:MongoDB']) or (
+            kind != 'mm' and spec != kind and not re.match(r'^\w+@[^:]+:\d+$', spec)):
+        raise argparse.ArgumentTypeError('invalid backend ' + spec)
+    return spec
+
+
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', default=False, action='store_true', help='verbose')
     parser.add_argument('--mongo-host', type=str, default='localhost', help='hostname of MongoDB server')
@@ -604,40 +829,88 @@ if __name__ == '__main__':
     parser_forever = subparsers.add_parser('forever', help='run comparison test until failure')
     parser_forever.add_argument('1', choices=['mongo', 'mm', 'doclayer'], help='first tester')
     parser_forever.add_argument('2', choices=['mongo', 'mm', 'doclayer'], help='second tester')
-    parser_forever.add_argument(
-        '-s', '--seed', type=int, default=random.randint(0, sys.maxint), help='random seed to use')
-    parser_forever.add_argument('--no-updates', default=True, action='store_false', help='disable update tests')
-    parser_forever.add_argument(
-        '--no-sort', default=True, action='store_false', help='disable non-deterministic sort tests')
-    parser_forever.add_argument(
-        '--no-numeric-fieldnames',
-        default=True,
-        action='store_false',
-        help='disable use of numeric fieldnames in subobjects')
-    parser_forever.add_argument(
-        '--no-nulls', default=True, action='store_false', help='disable generation of null values')
-    parser_forever.add_argument(
-        '--no-upserts', default=True, action='store_false', help='disable operator-operator upserts in update tests')
-    parser_forever.add_argument(
-        '--no-indexes', default=True, action='store_false', help='disable generation of random indexes')
-    parser_forever.add_argument(
-        '--no-projections', default=True, action='store_false', help='disable generation of random query projections')
-    parser_forever.add_argument('--num-doc', type=int, default=300, help='number of documents in the collection')
-    parser_forever.add_argument('--buggify', default=False, action='store_true', help='enable buggification')
-    parser_forever.add_argument('--num-iter', type=int, default=0, help='number of iterations of this type of test')
-    parser_forever.add_argument(
-        '--instance-id',
-        type=int,
-        default=0,
-        help='the instance that we would like to test with, default is 0 which means '
-        'autogenerate it randomly')
+
+    parser_fanout = subparsers.add_parser(
+        'fanout', help='run comparison test until failure, with every operation generated once and run on all backends')
+    parser_fanout.add_argument(
+        '--backend',
+        type=backend_spec,
+        action='append',
+        required=True,
+        help='backend to test, given multiple times: doclayer[@host:port], mongo[@host:port], mm:DocLayer or mm:MongoDB')
+    parser_fanout.add_argument(
+        '--reference', type=backend_spec, default=None, help='backend the others are compared with, the first by default')
+
+    for subparser in [parser_forever, parser_fanout]:
+        subparser.add_argument(
+            '-s', '--seed', type=int, default=random.randint(0, sys.maxint), help='random seed to use')
+        subparser.add_argument('--no-updates', default=True, action='store_false', help='disable update tests')
+        subparser.add_argument(
+            '--no-sort', default=True, action='store_false', help='disable non-deterministic sort tests')
+        subparser.add_argument(
+            '--no-numeric-fieldnames',
+            default=True,
+            action='store_false',
+            help='disable use of numeric fieldnames in subobjects')
+        subparser.add_argument(
+            '--no-nulls', default=True, action='store_false', help='disable generation of null values')
+        subparser.add_argument(
+            '--no-upserts', default=True, action='store_false', help='disable operator-operator upserts in update tests')
+        subparser.add_argument(
+            '--no-indexes', default=True, action='store_false', help='disable generation of random indexes')
+        subparser.add_argument(
+            '--no-projections', default=True, action='store_false', help='disable generation of random query projections')
+        subparser.add_argument('--num-doc', type=int, default=300, help='number of documents in the collection')
+        subparser.add_argument('--buggify', default=False, action='store_true', help='enable buggification')
+        subparser.add_argument('--num-iter', type=int, default=0, help='number of iterations of this type of test')
+        subparser.add_argument(
+            '--reset-mode',
+            choices=['drop', 'pool'],
+            default='drop',
+            help='drop: use a new collection for every iteration and drop it afterwards, pool: reuse a pool of collections '
+            'which are cleared between iterations. Both are timed as the reset phase of --timing-log')
+        subparser.add_argument(
+            '--timing-log',
+            type=str,
+            default=None,
+            help='append the timings of the phases and operations of every iteration to this file as JSON lines')
+        subparser.add_argument(
+            '--record-trace',
+            type=str,
+            default=None,
+            help='record the operations sent to Document Layer (or MongoDB if not tested) with digests of their responses '
+            'to this file, which can be replayed by replay_trace.py')
+        slow_queries.add_arguments(subparser)
+        subparser.add_argument(
+            '--insert-batch-size',
+            type=int,
+            default=0,
+            help='maximum number of documents per insert_many() batch, 0 inserts all documents in one batch')
+        subparser.add_argument(
+            '--insert-batch-bytes',
+            type=int,
+            default=0,
+            help='maximum BSON size of an insert_many() batch in bytes, 0 for no limit')
+        subparser.add_argument(
+            '--pool-size', type=int, default=1, help='number of collections in the pool when --reset-mode is pool')
+        subparser.add_argument(
+            '--instance-id',
+            type=int,
+            default=0,
+            help='the instance that we would like to test with, default is 0 which means '
+            'autogenerate it randomly')
 
     parser_self_test = subparsers.add_parser('self_test', help='test the test harness')
 
     parser_forever.set_defaults(func=start_forever_test)
+    parser_fanout.set_defaults(func=start_fanout_test)
     parser_self_test.set_defaults(func=start_self_test)
 
-    ns = vars(parser.parse_args())
+    return parser
+
+
+if __name__ == '__main__':
+    ns = vars(get_parser().parse_args())
 
     okay = ns['func'](ns)
     sys.exit(not okay)
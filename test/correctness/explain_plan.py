@@ -0,0 +1,386 @@
+#!/usr/bin/python
+#
+# explain_plan.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Parses the explanation of Document Layer query plans, as returned by find(...).explain()['explanation'], into
+# typed nodes. The node types and their fields mirror the describe() methods of the plans in src/QLPlan.actor.h.
+#
+#   plan = explain_plan.parse(collection.find(query).explain()['explanation'])
+#   assert not plan.has(explain_plan.TABLE_SCAN)
+#   assert plan.uses_only_index('compound')
+
+import math
+import re
+
+TABLE_SCAN = 'table scan'
+INDEX_SCAN = 'index scan'
+PK_LOOKUP = 'PK lookup'
+UNION = 'union'
+EMPTY = 'EMPTY'
+FILTER = 'filter'
+PROJECTION = 'projection'
+SORT = 'sort'
+SKIP = 'skip'
+NON_ISOLATED = 'non-isolated'
+RETRY = 'retry'
+FLUSH_CHANGES = 'flush changes'
+UPDATE = 'update'
+PROJECT_AND_UPDATE = 'projectAndUpdate'
+FIND_AND_MODIFY = 'findAndModify'
+INSERT = 'insert'
+
+# plans reading documents from the collection, the leaves of a query plan
+SCAN_TYPES = [TABLE_SCAN, INDEX_SCAN, PK_LOOKUP, EMPTY]
+
+UNBOUNDED_BEGIN = '-inf'
+UNBOUNDED_END = '+inf'
+
+
+# a PK lookup prints a bound that is only the type code of a value, e.g. "\x1e" for numbers, as its bytes
+# DVTypeCode of src/QLTypes.h
+TYPE_CODES = [0, 20, 30, 40, 50, 51, 60, 61, 70, 80, 90, 100, 110, 255]
+TYPE_CODE_BOUND = re.compile(r'^\\x[0-9a-f]{2}$')
+PRINTABLE_ESCAPE = re.compile(r'\\x([0-9a-f]{2})|\\\\')
+
+
+def unprintable(key):
+    """The bytes of a key printed by FDB::printable, which escapes "\\" and non printable bytes as "\\xNN"."""
+    return PRINTABLE_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)) if m.group(1) is not None else "\\", str(key))
+
+
+def type_bounded_index_sides(begin, end):
+    """
+    Returns whether the begin and the end of an index scan are only bounded by the type of the value. Ranges of $gt,
+    $gte, $lt and $lte end at the first value of the type of their operand or of the type after it, whose encoding is
+    the type code alone: the begin of "$lt: 5" is a prefix of its end, the end of "$gt: 1" is the first byte where it
+    differs from its begin plus one.
+    """
+    (begin, end) = (unprintable(begin), unprintable(end))
+    common = 0
+    while common < min(len(begin), len(end)) and begin[common] == end[common]:
+        common += 1
+    (begin, end) = (begin[common:], end[common:])
+    begin_of_type = len(begin) == 0 and len(end) > 0
+    end_of_type = len(end) == 1 and len(begin) > 1 and ord(begin[0]) in TYPE_CODES and ord(end) == ord(begin[0]) + 1
+    return (begin_of_type, end_of_type)
+
+
+class Bounds(object):
+    """
+    Key range of an index scan or PK lookup, None standing for an unbounded side. Document Layer bounds both sides of
+    ranges, a side bounded only by the type of the value, e.g. the end of "$gt: 1", is flagged in begin_of_type or
+    end_of_type and does not count as bounded.
+    """
+
+    def __init__(self, explanation, index_keys=True):
+        begin = explanation.get('begin', UNBOUNDED_BEGIN)
+        end = explanation.get('end', UNBOUNDED_END)
+        self.begin = None if begin == UNBOUNDED_BEGIN else begin
+        self.end = None if end == UNBOUNDED_END else end
+        (self.begin_of_type, self.end_of_type) = (False, False)
+        if index_keys and self.begin is not None and self.end is not None:
+            (self.begin_of_type, self.end_of_type) = type_bounded_index_sides(self.begin, self.end)
+        elif not index_keys:
+            self.begin_of_type = self.begin is not None and TYPE_CODE_BOUND.match(self.begin) is not None
+            self.end_of_type = self.end is not None and TYPE_CODE_BOUND.match(self.end) is not None
+
+    def is_point(self):
+        return self.begin is not None and self.begin == self.end
+
+    def has_begin(self):
+        return self.begin is not None and not self.begin_of_type
+
+    def has_end(self):
+        return self.end is not None and not self.end_of_type
+
+    def is_bounded(self):
+        return self.has_begin() and self.has_end()
+
+    def is_unbounded(self):
+        return not self.has_begin() and not self.has_end()
+
+    def __eq__(self, other):
+        return isinstance(other, Bounds) and (self.begin, self.end) == (other.begin, other.end)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return '[%s, %s]' % (UNBOUNDED_BEGIN if self.begin is None else self.begin,
+                             UNBOUNDED_END if self.end is None else self.end)
+
+
+class PlanNode(object):
+    """
+    A node of a query plan. Plans with a "source_plan" have it as their only child, unions have their "plans" as
+    children, scans have none. Node types without a subclass, e.g. plans added to Document Layer later, are parsed as
+    plain PlanNodes and still take part in the generic properties.
+    """
+
+    def __init__(self, explanation, children):
+        self.type = explanation['type']
+        self.explanation = explanation
+        self.children = children
+        # set by CostModel.estimate()
+        self.estimated_rows = None
+        self.estimated_cost = None
+
+    def nodes(self):
+        """All nodes of the plan, this one first."""
+        yield self
+        for child in self.children:
+            for node in child.nodes():
+                yield node
+
+    def leaves(self):
+        return [node for node in self.nodes() if len(node.children) == 0]
+
+    def has(self, node_type):
+        return any([node.type == node_type for node in self.nodes()])
+
+    def all_leaves(self, predicate):
+        return all([predicate(leaf) for leaf in self.leaves()])
+
+    def uses_only_index(self, index_name):
+        return self.all_leaves(lambda leaf: leaf.type == INDEX_SCAN and leaf.index_name == index_name)
+
+    def uses_index(self, index_name):
+        return any([node.type == INDEX_SCAN and node.index_name == index_name for node in self.nodes()])
+
+    def index_names(self):
+        return sorted(set([node.index_name for node in self.nodes() if node.type == INDEX_SCAN]))
+
+    def has_tight_bounds(self):
+        """True if every scan is bounded on both sides and no filter has to recheck what the scans return."""
+        return not self.has(FILTER) and self.all_leaves(
+            lambda leaf: leaf.type == EMPTY or (leaf.type in [INDEX_SCAN, PK_LOOKUP] and leaf.bounds.is_bounded()))
+
+    def attributes(self):
+        """Attributes of this node compared by diff(), children excluded."""
+        return {}
+
+    def summary(self):
+        """The plan as a compact string, e.g. "filter(union(index scan[index1], index scan[index2]))"."""
+        if len(self.children) == 0:
+            return self.label()
+        return '%s(%s)' % (self.label(), ', '.join([child.summary() for child in self.children]))
+
+    def label(self):
+        return self.type
+
+    def __str__(self):
+        return self.summary()
+
+
+class TableScanNode(PlanNode):
+    pass
+
+
+class IndexScanNode(PlanNode):
+    def __init__(self, explanation, children):
+        super(IndexScanNode, self).__init__(explanation, children)
+        self.index_name = explanation['index name']
+        self.bounds = Bounds(explanation.get('bounds', {}))
+
+    def attributes(self):
+        return {'index name': self.index_name, 'bounds': str(self.bounds)}
+
+    def label(self):
+        return '%s[%s]' % (self.type, self.index_name)
+
+
+class PKLookupNode(PlanNode):
+    def __init__(self, explanation, children):
+        super(PKLookupNode, self).__init__(explanation, children)
+        self.bounds = Bounds(explanation.get('bounds', {}), index_keys=False)
+
+    def attributes(self):
+        return {'bounds': str(self.bounds)}
+
+
+class UnionNode(PlanNode):
+    pass
+
+
+class EmptyNode(PlanNode):
+    pass
+
+
+class FilterNode(PlanNode):
+    def __init__(self, explanation, children):
+        super(FilterNode, self).__init__(explanation, children)
+        self.filter = explanation.get('filter')
+
+    def attributes(self):
+        return {'filter': self.filter}
+
+
+class ProjectionNode(PlanNode):
+    def __init__(self, explanation, children):
+        super(ProjectionNode, self).__init__(explanation, children)
+        self.projection = explanation.get('projection')
+
+    def attributes(self):
+        return {'projection': self.projection}
+
+
+class SortNode(PlanNode):
+    pass
+
+
+class SkipNode(PlanNode):
+    def __init__(self, explanation, children):
+        super(SkipNode, self).__init__(explanation, children)
+        self.number = explanation.get('number', 0)
+
+    def attributes(self):
+        return {'number': self.number}
+
+
+class UpdateNode(PlanNode):
+    """Update, projectAndUpdate and findAndModify plans."""
+
+    def __init__(self, explanation, children):
+        super(UpdateNode, self).__init__(explanation, children)
+        self.update_op = explanation.get('updateOp')
+        self.upsert_op = explanation.get('upsertOp')
+        self.projection = explanation.get('projection')
+
+    def attributes(self):
+        return {'updateOp': self.update_op, 'upsertOp': self.upsert_op, 'projection': self.projection}
+
+
+NODE_CLASSES = {
+    TABLE_SCAN: TableScanNode,
+    INDEX_SCAN: IndexScanNode,
+    PK_LOOKUP: PKLookupNode,
+    UNION: UnionNode,
+    EMPTY: EmptyNode,
+    FILTER: FilterNode,
+    PROJECTION: ProjectionNode,
+    SORT: SortNode,
+    SKIP: SkipNode,
+    UPDATE: UpdateNode,
+    PROJECT_AND_UPDATE: UpdateNode,
+    FIND_AND_MODIFY: UpdateNode,
+}
+
+
+def parse(explanation):
+    """Returns the PlanNode of an explanation, which is the 'explanation' field of the result of explain()."""
+    if 'source_plan' in explanation:
+        children = [parse(explanation['source_plan'])]
+    elif 'plans' in explanation:
+        children = [parse(p) for p in explanation['plans']]
+    else:
+        children = []
+    return NODE_CLASSES.get(explanation['type'], PlanNode)(explanation, children)
+
+
+def explain(collection, query, **kwargs):
+    """Runs explain for a find() on a pymongo collection and returns the parsed plan."""
+    return parse(collection.find(query, **kwargs).explain()['explanation'])
+
+
+class CostModel(object):
+    """
+    Rough cost estimate of a plan, in documents read, for a collection of a given size. It knows nothing about the
+    data, so the number of documents returned by a scan only depends on the shape of its bounds: a point or a bounded
+    range returns a fraction point_selectivity or range_selectivity of the collection, a range bounded on one side
+    half_range_selectivity of it. It is meant to rank plans of the same query, not to predict latencies.
+    """
+
+    def __init__(self,
+                 collection_size,
+                 point_selectivity=0.01,
+                 range_selectivity=0.1,
+                 half_range_selectivity=0.3,
+                 filter_selectivity=0.5,
+                 filter_cost=0.1,
+                 projection_cost=0.05):
+        self.collection_size = collection_size
+        self.point_selectivity = point_selectivity
+        self.range_selectivity = range_selectivity
+        self.half_range_selectivity = half_range_selectivity
+        self.filter_selectivity = filter_selectivity
+        self.filter_cost = filter_cost
+        self.projection_cost = projection_cost
+
+    def scan_rows(self, bounds, is_primary_key):
+        if bounds.is_point():
+            return 1.0 if is_primary_key else self.collection_size * self.point_selectivity
+        elif bounds.is_bounded():
+            return self.collection_size * self.range_selectivity
+        elif bounds.is_unbounded():
+            return float(self.collection_size)
+        return self.collection_size * self.half_range_selectivity
+
+    def estimate(self, node):
+        """Sets estimated_rows and estimated_cost of the node and all nodes below, returns the estimated cost."""
+        for child in node.children:
+            self.estimate(child)
+        child_rows = sum([child.estimated_rows for child in node.children])
+        child_cost = sum([child.estimated_cost for child in node.children])
+
+        if node.type == TABLE_SCAN:
+            (rows, cost) = (float(self.collection_size), float(self.collection_size))
+        elif node.type in [INDEX_SCAN, PK_LOOKUP]:
+            rows = self.scan_rows(node.bounds, node.type == PK_LOOKUP)
+            # index entries are read, and then the documents they point to
+            cost = rows * (2 if node.type == INDEX_SCAN else 1)
+        elif node.type == EMPTY:
+            (rows, cost) = (0.0, 0.0)
+        elif node.type == FILTER:
+            (rows, cost) = (child_rows * self.filter_selectivity, child_cost + child_rows * self.filter_cost)
+        elif node.type == SORT:
+            (rows, cost) = (child_rows, child_cost + child_rows * math.log(max(child_rows, 2), 2))
+        elif node.type == SKIP:
+            (rows, cost) = (max(0.0, child_rows - node.number), child_cost)
+        elif node.type in [PROJECTION, PROJECT_AND_UPDATE, FIND_AND_MODIFY]:
+            (rows, cost) = (child_rows, child_cost + child_rows * self.projection_cost)
+        else:
+            (rows, cost) = (child_rows, child_cost)
+
+        node.estimated_rows = rows
+        node.estimated_cost = cost
+        return cost
+
+
+def diff(plan1, plan2, path='plan'):
+    """
+    Returns the differences between two plans as a list of (path, value in plan1, value in plan2), empty if they are
+    the same. Paths name nodes by their position, e.g. "plan.0.1" is the second child of the child of the root.
+    """
+    if plan1.type != plan2.type:
+        return [(path, plan1.summary(), plan2.summary())]
+    differences = []
+    attributes1 = plan1.attributes()
+    attributes2 = plan2.attributes()
+    for name in sorted(set(attributes1.keys()) | set(attributes2.keys())):
+        if attributes1.get(name) != attributes2.get(name):
+            differences.append((path + '.' + name, attributes1.get(name), attributes2.get(name)))
+    if len(plan1.children) != len(plan2.children):
+        differences.append((path + '.children', plan1.summary(), plan2.summary()))
+        return differences
+    for (ii, (child1, child2)) in enumerate(zip(plan1.children, plan2.children)):
+        differences.extend(diff(child1, child2, path + '.' + str(ii)))
+    return differences
@@ -56,6 +56,15 @@ class generator_options:
     nested_elemmatch = True
 
 
+_default_generator_options = dict((k, v) for (k, v) in vars(generator_options).items() if not k.startswith('_'))
+
+
+def reset_generator_options():
+    # Processes that run more than one test (e.g. test-automation pool workers) start every test from the defaults
+    for (k, v) in _default_generator_options.items():
+        setattr(generator_options, k, v)
+
+
 def random_string(length):
     if length == 0:
         return ''
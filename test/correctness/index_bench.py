@@ -0,0 +1,307 @@
+#!/usr/bin/python
+#
+# index_bench.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Index build benchmark. Loads collections of the given sizes and times building simple, compound, multikey and
+# unique indexes on them, optionally while a concurrent workload of point reads and updates runs against the same
+# collection, whose latency during the build is compared with its latency before.
+#
+# Document Layer builds an index with a table scan inside the create_index request, or, with background set, in a
+# background task after create_index returned. Background builds are followed by polling the index document in
+# system.indexes until its status goes from "building" to "ready" or "error". While building, the index document has
+# the _id of the document the build is at, which every poll records with its time as the progress of the build.
+# Unique indexes can not be built in the background.
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pymongo
+
+import bulk_loader
+import stats
+
+# name -> (keys, options)
+INDEX_KINDS = OrderedDict([
+    ('simple', ([('a', pymongo.ASCENDING)], {})),
+    ('compound', ([('a', pymongo.ASCENDING), ('b', pymongo.ASCENDING)], {})),
+    ('multikey', ([('tags', pymongo.ASCENDING)], {})),
+    ('unique', ([('u', pymongo.ASCENDING)], {'unique': True})),
+])
+
+MODES = ['foreground', 'background']
+
+STATUS_READY = 'ready'
+STATUS_BUILDING = 'building'
+STATUS_ERROR = 'error'
+CURRENTLY_PROCESSING_DOC = 'currently processing document'
+
+
+def generate_documents(number, ns, prng):
+    padding = 'x' * ns['padding']
+    for i in range(0, number):
+        yield {
+            '_id': i,
+            'a': prng.randint(0, 1000),
+            'b': 'b%d' % prng.randint(0, 1000),
+            'tags': [prng.randint(0, 10000) for _ in range(0, ns['tags_per_doc'])],
+            'u': i,
+            'pad': padding,
+        }
+
+
+def load_collection(ns, collection, size):
+    collection.drop()
+    loader = bulk_loader.BulkLoader(collection, batch_size=ns['batch_size'], ordered=False)
+    start = time.time()
+    loader.load(generate_documents(size, ns, random.Random(ns['seed'])))
+    print 'Loaded %d documents in %.2f s' % (size, time.time() - start)
+
+
+class ConcurrentWorkload(object):
+    """
+    Point reads and updates of the indexed field a on random documents from several threads. Latencies are recorded
+    per phase, the phase being switched from the outside.
+    """
+
+    def __init__(self, collection, size, threads, write_fraction, seed):
+        self.collection = collection
+        self.size = size
+        self.write_fraction = write_fraction
+        self.seed = seed
+        self.phase = None
+        self.phase_times = OrderedDict()
+        self.histograms = [dict() for _ in range(0, threads)]
+        self.errors = [dict() for _ in range(0, threads)]
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def start(self, phase):
+        self.set_phase(phase)
+        for ii in range(0, len(self.histograms)):
+            thread = threading.Thread(target=self.run, args=(ii, ))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def set_phase(self, phase):
+        now = time.time()
+        if self.phase is not None:
+            self.phase_times[self.phase] = now - self.phase_times[self.phase]
+        self.phase = phase
+        self.phase_times[phase] = now
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.set_phase(None)
+        del self.phase_times[None]
+
+    def run(self, thread_id):
+        prng = random.Random(self.seed + thread_id)
+        (histograms, errors) = (self.histograms[thread_id], self.errors[thread_id])
+        while not self.stopping.is_set():
+            phase = self.phase
+            key = prng.randint(0, self.size - 1)
+            start = time.time()
+            try:
+                if prng.random() < self.write_fraction:
+                    self.collection.update_one({'_id': key}, {'$set': {'a': prng.randint(0, 1000)}})
+                else:
+                    self.collection.find_one({'_id': key})
+            except pymongo.errors.PyMongoError:
+                errors[phase] = errors.get(phase, 0) + 1
+                continue
+            histograms.setdefault(phase, stats.LatencyHistogram()).record(time.time() - start)
+
+    def phase_results(self, phase):
+        latency = stats.LatencyHistogram()
+        for histograms in self.histograms:
+            if phase in histograms:
+                latency.merge(histograms[phase])
+        seconds = self.phase_times.get(phase, 0)
+        return OrderedDict([
+            ('ops_per_s', latency.count / seconds if seconds > 0 else 0.0),
+            ('latency', latency.to_dict()),
+            ('errors', sum([errors.get(phase, 0) for errors in self.errors])),
+        ])
+
+
+def wait_for_index(collection, name, poll_interval, timeout):
+    """
+    Polls the status of a background index build, returns (status, seconds, number of polls, progress), progress being
+    the [seconds, _id of the document being processed] of the polls which found one.
+    """
+    start = time.time()
+    polls = 0
+    progress = []
+    while True:
+        polls += 1
+        index = collection.database['system.indexes'].find_one({'ns': collection.full_name, 'name': name})
+        # indexes without a status, e.g. on MongoDB, are ready once listed
+        status = index.get('status', STATUS_READY) if index is not None else STATUS_BUILDING
+        if status in [STATUS_READY, STATUS_ERROR]:
+            return (status, time.time() - start, polls, progress)
+        if index is not None and CURRENTLY_PROCESSING_DOC in index:
+            progress.append([time.time() - start, index[CURRENTLY_PROCESSING_DOC]])
+        if time.time() - start > timeout:
+            return ('timeout', time.time() - start, polls, progress)
+        time.sleep(poll_interval)
+
+
+def build_index(ns, collection, kind, mode):
+    """Builds an index of the kind, returns a dict with how it went."""
+    (keys, options) = INDEX_KINDS[kind]
+    options = dict(options, name='bench_' + kind)
+    result = OrderedDict([('status', STATUS_READY), ('polls', 0)])
+    start = time.time()
+    try:
+        if mode == 'background':
+            collection.create_index(keys, background=True, **options)
+            result['returned_s'] = time.time() - start
+            (result['status'], _, result['polls'], result['progress']) = wait_for_index(
+                collection, options['name'], ns['poll_interval'], ns['timeout'])
+        else:
+            collection.create_index(keys, **options)
+    except pymongo.errors.OperationFailure as e:
+        result['status'] = STATUS_ERROR
+        result['error'] = str(e)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def run_build(ns, collection, size, kind, mode):
+    workload = None
+    if ns['concurrent_threads'] > 0:
+        workload = ConcurrentWorkload(collection, size, ns['concurrent_threads'], ns['write_fraction'], ns['seed'])
+        workload.start('before')
+        time.sleep(ns['baseline_seconds'])
+        workload.set_phase('during')
+
+    build = build_index(ns, collection, kind, mode)
+
+    if workload is not None:
+        workload.stop()
+    result = OrderedDict([('size', size), ('kind', kind), ('mode', mode)])
+    result.update(build)
+    result['docs_per_s'] = size / build['seconds'] if build['status'] == STATUS_READY else 0.0
+    if workload is not None:
+        result['before'] = workload.phase_results('before')
+        result['during'] = workload.phase_results('during')
+    try:
+        collection.drop_index('bench_' + kind)
+    except pymongo.errors.OperationFailure:
+        pass
+    return result
+
+
+def print_header(ns):
+    line = '{:>9} {:<10} {:<11} {:>8} {:>10} {:>12} {:>6}'.format('docs', 'index', 'mode', 'status', 'seconds', 'docs/s',
+                                                                'polls')
+    if ns['concurrent_threads'] > 0:
+        line += ' {:>11} {:>11} {:>11} {:>11} {:>7}'.format('ops/s pre', 'ops/s build', 'p99 us pre', 'p99 us build',
+                                                            'errors')
+    print line
+
+
+def print_result(ns, result):
+    line = '{:>9} {:<10} {:<11} {:>8} {:>10.2f} {:>12.1f} {:>6}'.format(
+        result['size'], result['kind'], result['mode'], result['status'], result['seconds'], result['docs_per_s'],
+        result['polls'] if result['mode'] == 'background' else '-')
+    if ns['concurrent_threads'] > 0:
+        (before, during) = (result['before'], result['during'])
+        line += ' {:>11.1f} {:>11.1f} {:>11} {:>11} {:>7}'.format(
+            before['ops_per_s'], during['ops_per_s'], before['latency']['p99_us'], during['latency']['p99_us'],
+            during['errors'])
+    print line
+    if 'error' in result:
+        print '  ' + result['error']
+
+
+def run_index_bench(ns):
+    client = pymongo.MongoClient(ns['host'], ns['port'], maxPoolSize=ns['concurrent_threads'] + 1)
+    collection_name = ns['collection'] if ns['collection'] != '' else 'index' + str(random.random())[2:]
+    collection = client['test'][collection_name]
+
+    results = []
+    for size in ns['sizes']:
+        load_collection(ns, collection, size)
+        print_header(ns)
+        for kind in ns['kinds']:
+            for mode in ns['modes']:
+                if mode == 'background' and INDEX_KINDS[kind][1].get('unique', False):
+                    continue
+                result = run_build(ns, collection, size, kind, mode)
+                print_result(ns, result)
+                sys.stdout.flush()
+                results.append(result)
+
+    collection.drop()
+    client.close()
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+    return all([r['status'] == STATUS_READY for r in results])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index build benchmark on large collections')
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument(
+        '--sizes',
+        type=lambda s: [int(n) for n in s.split(',')],
+        default=[10000, 100000, 1000000],
+        help='comma separated numbers of documents to build the indexes on')
+    parser.add_argument(
+        '--kinds',
+        type=lambda s: s.split(','),
+        default=list(INDEX_KINDS.keys()),
+        help='comma separated kinds of indexes out of ' + ', '.join(INDEX_KINDS.keys()))
+    parser.add_argument(
+        '--modes', type=lambda s: s.split(','), default=MODES, help='comma separated build modes out of ' + ', '.join(MODES))
+    parser.add_argument('--tags-per-doc', type=int, default=5, help='array elements per document for multikey indexes')
+    parser.add_argument('--padding', type=int, default=100, help='bytes of padding per document')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of documents per insert when loading')
+    parser.add_argument(
+        '--concurrent-threads', type=int, default=0, help='number of threads running reads and updates during builds')
+    parser.add_argument('--write-fraction', type=float, default=0.5, help='fraction of updates in the concurrent workload')
+    parser.add_argument(
+        '--baseline-seconds', type=float, default=10, help='seconds the concurrent workload runs before every build')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='seconds between polls of background builds')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds to wait for a background build')
+    parser.add_argument('-c', '--collection', default='', help='collection in database test, generated by default')
+    parser.add_argument('--seed', type=int, default=random.randint(0, sys.maxint), help='random seed to use')
+    parser.add_argument('--output', default='', help='JSON file to write the results to')
+    ns = vars(parser.parse_args())
+    for kind in ns['kinds']:
+        if kind not in INDEX_KINDS:
+            parser.error('unknown index kind ' + kind)
+    for mode in ns['modes']:
+        if mode not in MODES:
+            parser.error('unknown build mode ' + mode)
+    sys.exit(not run_index_bench(ns))
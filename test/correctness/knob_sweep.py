@@ -0,0 +1,322 @@
+#!/usr/bin/python
+#
+# knob_sweep.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Knob sweep. Launches fdbdoc with one configuration of knob values after the other, runs YCSB workloads against each
+# for --repeats measurements of --duration seconds, and reports the throughput of every configuration per workload with
+# its 95% confidence interval, next to the defaults. The data lives in FoundationDB, so the records are loaded once,
+# by the first configuration, and fdbdoc restarts in between configurations do not lose them.
+#
+#   knob_sweep.py --fdbdoc build/bin/fdbdoc --knob FLOW_CONTROL_LOCK_PERMITS=10,50,200 \
+#       --knob MAX_RETURNABLE_DOCUMENTS=101,1000 --workloads A,C,E
+#
+# The grid search runs every combination of the given values. The adaptive search starts from the defaults and tries
+# the values of one knob at a time, keeping the best, until a round over all knobs improves nothing. It ranks
+# configurations by the geometric mean over the workloads of their throughput relative to the defaults.
+
+import argparse
+import itertools
+import json
+import math
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import pymongo
+
+import ycsb
+from model_bench import Result
+
+DEFAULT = 'default'
+
+
+class ServerError(Exception):
+    pass
+
+
+def config_label(config):
+    if len(config) == 0:
+        return DEFAULT
+    return ' '.join(['%s=%s' % (name, value) for (name, value) in config])
+
+
+class Server(object):
+    """An fdbdoc process started with a configuration of knobs, logging into its own directory."""
+
+    def __init__(self, ns, config):
+        self.ns = ns
+        self.config = config
+        self.logdir = tempfile.mkdtemp(prefix='knob_sweep')
+        self.process = None
+        self.output = None
+
+    def command(self):
+        # fdbdoc only takes [IP_ADDRESS:]PORT
+        listen_address = '%s:%d' % (socket.gethostbyname(self.ns['host']), self.ns['port'])
+        cmd = [self.ns['fdbdoc'], '--listen_address', listen_address, '--logdir', self.logdir]
+        if self.ns['cluster_file'] != '':
+            cmd.extend(['--cluster_file', self.ns['cluster_file']])
+        for (name, value) in self.config:
+            cmd.extend(['--knob_' + name.lower(), str(value)])
+        return cmd + shlex.split(self.ns['fdbdoc_args'])
+
+    def start(self):
+        self.output = open(os.path.join(self.logdir, 'fdbdoc.out'), 'w')
+        self.process = subprocess.Popen(self.command(), stdout=self.output, stderr=subprocess.STDOUT)
+        deadline = time.time() + self.ns['startup_timeout']
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise ServerError('fdbdoc exited with %d: %s' % (self.process.returncode, self.read_output()))
+            try:
+                client = pymongo.MongoClient(self.ns['host'], self.ns['port'], serverSelectionTimeoutMS=500)
+                client.admin.command('ismaster')
+                client.close()
+                return
+            except pymongo.errors.PyMongoError:
+                time.sleep(0.5)
+        self.stop()
+        raise ServerError('fdbdoc did not accept connections within %d s' % self.ns['startup_timeout'])
+
+    def read_output(self):
+        self.output.flush()
+        with open(os.path.join(self.logdir, 'fdbdoc.out')) as f:
+            return f.read().strip()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            for _ in range(0, 100):
+                if self.process.poll() is not None:
+                    break
+                time.sleep(0.1)
+            else:
+                self.process.kill()
+                self.process.wait()
+        if self.output is not None:
+            self.output.close()
+
+
+def measure(ns, workload_name, collection_name):
+    """Runs a workload for --duration seconds, returns (operations per second, errors, number of records after)."""
+    workload_ns = dict(ns, workload=workload_name)
+    client = pymongo.MongoClient(ns['host'], ns['port'], maxPoolSize=ns['threads'])
+    workload = ycsb.Workload(workload_ns, client['test'][collection_name])
+    stop_time = time.time() + ns['duration']
+    (results, errors) = ({}, [])
+    threads = [
+        threading.Thread(target=ycsb.run_thread, args=(workload, workload_ns, t, stop_time, 0, results, errors))
+        for t in range(0, ns['threads'])
+    ]
+    start = time.time()
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    client.close()
+    total = sum([h.count for histograms in results.values() for h in histograms.values()])
+    return (total / elapsed, len(errors), workload.count)
+
+
+class Sweep(object):
+    def __init__(self, ns):
+        # the record count grows with the inserts of the workloads
+        self.ns = dict(ns)
+        self.collection_name = None
+        # label -> {workload -> Result}, None for configurations fdbdoc did not start with
+        self.results = OrderedDict()
+        self.errors = {}
+
+    def evaluate(self, config):
+        label = config_label(config)
+        if label in self.results:
+            return self.results[label]
+        print 'Configuration: ' + label
+        server = Server(self.ns, config)
+        try:
+            server.start()
+        except ServerError as e:
+            print '  ' + str(e)
+            self.results[label] = None
+            return None
+        try:
+            if self.collection_name is None:
+                self.collection_name = ycsb.load_records(self.ns)
+                if self.collection_name is None:
+                    raise ServerError('loading the records failed')
+            results = OrderedDict()
+            for workload_name in self.ns['workloads']:
+                rates = []
+                for _ in range(0, self.ns['repeats']):
+                    (rate, errors, self.ns['record_count']) = measure(self.ns, workload_name, self.collection_name)
+                    rates.append(rate)
+                    self.errors[label] = self.errors.get(label, 0) + errors
+                results[workload_name] = Result(workload_name, rates)
+                print '  workload %s: %.1f +- %.1f ops/s' % (workload_name, results[workload_name].mean,
+                                                             results[workload_name].ci)
+        finally:
+            server.stop()
+        self.results[label] = results
+        return results
+
+    def score(self, results):
+        """Geometric mean over the workloads of the throughput relative to the defaults."""
+        default = self.results[DEFAULT]
+        if results is None or default is None:
+            return 0.0
+        ratios = [float(results[w].mean) / default[w].mean for w in self.ns['workloads'] if default[w].mean > 0]
+        return math.exp(sum([math.log(max(r, 1e-9)) for r in ratios]) / len(ratios)) if len(ratios) > 0 else 0.0
+
+    def grid(self):
+        self.evaluate([])
+        names = [name for (name, _) in self.ns['knobs']]
+        for values in itertools.product(*[values for (_, values) in self.ns['knobs']]):
+            self.evaluate(list(zip(names, values)))
+
+    def adaptive(self):
+        self.evaluate([])
+        best = OrderedDict()
+        best_score = 1.0
+        for _ in range(0, self.ns['rounds']):
+            improved = False
+            for (name, values) in self.ns['knobs']:
+                for value in values:
+                    config = OrderedDict(best)
+                    config[name] = value
+                    score = self.score(self.evaluate(list(config.items())))
+                    if score > best_score:
+                        (best, best_score, improved) = (config, score, True)
+            if not improved:
+                break
+
+    def drop(self):
+        server = Server(self.ns, [])
+        server.start()
+        try:
+            client = pymongo.MongoClient(self.ns['host'], self.ns['port'])
+            client['test'].drop_collection(self.collection_name)
+            client.close()
+        finally:
+            server.stop()
+
+
+def print_report(sweep):
+    default = sweep.results[DEFAULT]
+    best = OrderedDict()
+    for workload_name in sweep.ns['workloads']:
+        rows = [(label, results[workload_name]) for (label, results) in sweep.results.items() if results is not None]
+        rows.sort(key=lambda row: -row[1].mean)
+        print
+        print 'Workload %s' % workload_name
+        print '{:>12} {:>10} {:>9} {:>7}  {}'.format('ops/s', '+- 95%', 'vs dflt', 'errors', 'configuration')
+        for (label, result) in rows:
+            relative = ('%+.1f%%' % (100 * (float(result.mean) / default[workload_name].mean - 1))
+                        if default is not None and default[workload_name].mean > 0 else '-')
+            print '{:>12.1f} {:>10.1f} {:>9} {:>7}  {}'.format(result.mean, result.ci, relative,
+                                                               sweep.errors.get(label, 0), label)
+        if len(rows) > 0:
+            (label, result) = rows[0]
+            significant = (default is not None and label != DEFAULT and
+                           result.mean - result.ci > default[workload_name].mean + default[workload_name].ci)
+            best[workload_name] = OrderedDict([('configuration', label), ('result', result.to_dict()),
+                                               ('significant', significant)])
+            print 'Best: %s%s' % (label, '' if significant or label == DEFAULT else
+                                  ' (confidence intervals overlap with the defaults)')
+    return best
+
+
+def parse_knob(s):
+    if '=' not in s:
+        raise argparse.ArgumentTypeError('expected NAME=value,value,... instead of ' + s)
+    (name, values) = s.split('=', 1)
+    return (name.upper(), values.split(','))
+
+
+def run_sweep(ns):
+    sweep = Sweep(ns)
+    try:
+        if ns['search'] == 'grid':
+            sweep.grid()
+        else:
+            sweep.adaptive()
+        if ns['drop'] and sweep.collection_name is not None:
+            sweep.drop()
+    except ServerError as e:
+        print str(e)
+        return False
+    if sweep.results[DEFAULT] is None:
+        print 'fdbdoc did not start with the default knobs'
+        return False
+
+    best = print_report(sweep)
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump({
+                'configurations': OrderedDict([(label, None if results is None else OrderedDict(
+                    [(w, r.to_dict()) for (w, r) in results.items()])) for (label, results) in sweep.results.items()]),
+                'best': best,
+            }, f, indent=2)
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs fdbdoc with knob configurations and compares their throughput')
+    ycsb.add_workload_arguments(parser)
+    parser.add_argument('--fdbdoc', default='fdbdoc', help='fdbdoc binary to launch, listening on --host and --port')
+    parser.add_argument('--cluster-file', default='', help='cluster file of FoundationDB for fdbdoc')
+    parser.add_argument('--fdbdoc-args', default='', help='further arguments to pass to fdbdoc')
+    parser.add_argument('--startup-timeout', type=int, default=30, help='seconds to wait for fdbdoc to accept connections')
+    parser.add_argument(
+        '--knob',
+        dest='knobs',
+        type=parse_knob,
+        action='append',
+        default=[],
+        help='knob and comma separated values to try, e.g. FLOW_CONTROL_LOCK_PERMITS=10,50,200, given once per knob')
+    parser.add_argument('--search', choices=['grid', 'adaptive'], default='grid', help='how to pick configurations')
+    parser.add_argument('--rounds', type=int, default=3, help='maximum rounds over all knobs of the adaptive search')
+    parser.add_argument(
+        '--workloads',
+        type=lambda s: s.split(','),
+        default=['A', 'B', 'C'],
+        help='comma separated YCSB workloads to run on every configuration')
+    parser.add_argument('-t', '--threads', type=int, default=8, help='number of client threads')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of every measurement')
+    parser.add_argument('--repeats', type=int, default=5, help='measurements per workload and configuration')
+    parser.add_argument('--output', default='', help='JSON file to write the results to')
+
+    ns = vars(parser.parse_args())
+    if len(ns['knobs']) == 0:
+        parser.error('at least one --knob is needed')
+    for workload_name in ns['workloads']:
+        if workload_name not in ycsb.WORKLOADS:
+            parser.error('unknown workload ' + workload_name)
+    if ns['skip_load'] and ns['collection'] == '':
+        parser.error('--skip-load needs --collection')
+    sys.exit(not run_sweep(ns))
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+#
+# memory_monitor.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Memory trend leak detector for long fuzz or benchmark runs. A background thread polls the getmemoryusage and
+# serverstatus commands, and the RSS of the fdbdoc processes, at intervals. At the end a trend line is fitted through
+# the memory samples, and the memory growth between samples is correlated with the operations run and the cursors
+# open in the meantime.
+#
+# Document Layer answers serverstatus with only {ok: 1}, so its operation counts and open cursors come from the
+# ConsoleMetric events in its trace files if a trace directory is given, see console_metrics.py. Against MongoDB they
+# come from the opcounters and metrics.cursor.open.total of serverstatus.
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pymongo
+
+import console_metrics
+
+# a cursor which is not exhausted nor killed is only freed by Document Layer after CURSOR_EXPIRY seconds (Knobs.cpp)
+CURSOR_EXPIRY = 600
+
+PROCESS_NAMES = ['fdbdoc', 'bigdoc']
+
+
+def process_memory_mb(names=PROCESS_NAMES):
+    """Returns the resident and virtual memory in MB of all processes whose name contains one of names."""
+    import psutil
+    (rss, vms) = (0.0, 0.0)
+    for proc in psutil.process_iter():
+        try:
+            if any([name in proc.name() for name in names]):
+                info = proc.memory_info()
+                rss += float(info.rss) / (1024 * 1024)
+                vms += float(info.vms) / (1024 * 1024)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return (rss, vms)
+
+
+class MemorySample(object):
+    def __init__(self, t):
+        self.time = t
+        # MB, from getmemoryusage
+        self.process_mb = None
+        self.resident_mb = None
+        # MB, from psutil
+        self.rss_mb = None
+        self.active_cursors = None
+        # operations of every type since the previous sample
+        self.ops = {}
+
+    def to_dict(self):
+        return OrderedDict([
+            ('time', self.time),
+            ('process_mb', self.process_mb),
+            ('resident_mb', self.resident_mb),
+            ('rss_mb', self.rss_mb),
+            ('active_cursors', self.active_cursors),
+            ('ops', self.ops),
+        ])
+
+
+class MemoryMonitor(object):
+    def __init__(self, host, port, interval=10.0, trace_dir='', use_psutil=True):
+        self.client = pymongo.MongoClient(host, port, maxPoolSize=1)
+        self.interval = interval
+        self.use_psutil = use_psutil
+        self.collector = console_metrics.MetricsCollector(trace_dir) if trace_dir != '' else None
+        self.samples = []
+        self.errors = 0
+        self.last_opcounters = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.collector is not None:
+            self.collector.start()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.collector is not None:
+            self.collector.stop()
+        self.client.close()
+
+    def run(self):
+        while True:
+            try:
+                self.take_sample()
+            except pymongo.errors.PyMongoError:
+                # the server may be restarting, the sample is skipped
+                self.errors += 1
+            if self.stopping.wait(self.interval):
+                break
+
+    def take_sample(self):
+        sample = MemorySample(time.time())
+        try:
+            usage = self.client.test.command('getmemoryusage')
+            sample.process_mb = float(usage['process memory usage'])
+            sample.resident_mb = float(usage['resident memory usage'])
+        except pymongo.errors.OperationFailure:
+            # not Document Layer
+            pass
+        status = self.client.test.command('serverstatus')
+        if 'opcounters' in status:
+            opcounters = dict([(op, int(n)) for (op, n) in status['opcounters'].items()])
+            if self.last_opcounters is not None:
+                sample.ops = dict([(op, n - self.last_opcounters.get(op, 0)) for (op, n) in opcounters.items()])
+            self.last_opcounters = opcounters
+        cursors = status.get('metrics', {}).get('cursor', {}).get('open', {}).get('total')
+        if cursors is not None:
+            sample.active_cursors = int(cursors)
+        if self.use_psutil:
+            (sample.rss_mb, _) = process_memory_mb()
+        if self.collector is not None:
+            self.add_console_metrics(sample)
+        self.samples.append(sample)
+
+    def add_console_metrics(self, sample):
+        previous = self.samples[-1].time if len(self.samples) > 0 else None
+        for (op, metric) in [('query', console_metrics.QUERY_LATENCY), ('insert', console_metrics.INSERT_LATENCY)]:
+            if previous is not None:
+                sample.ops[op] = sum([s.count for s in self.collector.series(metric, previous, sample.time)])
+        # the gauge is only published when it changed, its last value still holds
+        cursors = self.collector.series(console_metrics.ACTIVE_CURSORS, None, sample.time)
+        if len(cursors) > 0:
+            sample.active_cursors = int(cursors[-1].avg)
+
+
+def fit_trend(xs, ys):
+    """Least squares line through the points, returns (slope, intercept, r^2)."""
+    n = len(xs)
+    if n < 2:
+        return (0.0, ys[0] if n == 1 else 0.0, 0.0)
+    mean_x = float(sum(xs)) / n
+    mean_y = float(sum(ys)) / n
+    sxx = sum([(x - mean_x)**2 for x in xs])
+    syy = sum([(y - mean_y)**2 for y in ys])
+    sxy = sum([(x - mean_x) * (y - mean_y) for (x, y) in zip(xs, ys)])
+    if sxx == 0:
+        return (0.0, mean_y, 0.0)
+    slope = sxy / sxx
+    r2 = (sxy * sxy) / (sxx * syy) if syy > 0 else 0.0
+    return (slope, mean_y - slope * mean_x, r2)
+
+
+def correlation(xs, ys):
+    """Pearson correlation coefficient, 0 if either series is constant."""
+    n = len(xs)
+    if n < 2:
+        return 0.0
+    mean_x = float(sum(xs)) / n
+    mean_y = float(sum(ys)) / n
+    sxx = sum([(x - mean_x)**2 for x in xs])
+    syy = sum([(y - mean_y)**2 for y in ys])
+    if sxx == 0 or syy == 0:
+        return 0.0
+    return sum([(x - mean_x) * (y - mean_y) for (x, y) in zip(xs, ys)]) / (sxx * syy)**0.5
+
+
+def analyze(samples, warmup=0.1, min_growth_mb_per_hour=10.0, min_r2=0.8, max_cursors=1000):
+    """
+    Returns a report on the samples. The first warmup fraction of the run is left out of the trends, as caches fill
+    up there. A memory series is flagged as a probable leak if it grows by more than min_growth_mb_per_hour on a
+    line fitting it with at least min_r2. Cursors are flagged as building up if they grow steadily for longer than
+    CURSOR_EXPIRY, after which abandoned cursors would have been freed, or exceed max_cursors.
+    """
+    report = OrderedDict([('samples', len(samples)), ('trends', OrderedDict()), ('correlations', OrderedDict()),
+                          ('flags', [])])
+    if len(samples) < 3:
+        return report
+    start = samples[0].time
+    duration = samples[-1].time - start
+    steady = [s for s in samples if s.time - start >= warmup * duration]
+    report['duration_s'] = duration
+
+    for series in ['process_mb', 'resident_mb', 'rss_mb', 'active_cursors']:
+        points = [(s.time - start, getattr(s, series)) for s in steady if getattr(s, series) is not None]
+        if len(points) < 3:
+            continue
+        (slope, intercept, r2) = fit_trend([p[0] for p in points], [p[1] for p in points])
+        report['trends'][series] = OrderedDict([
+            ('first', points[0][1]),
+            ('last', points[-1][1]),
+            ('max', max([p[1] for p in points])),
+            ('per_hour', slope * 3600),
+            ('r2', r2),
+        ])
+        if series.endswith('_mb') and slope * 3600 > min_growth_mb_per_hour and r2 >= min_r2:
+            report['flags'].append('probable leak: %s grows by %.1f MB/hour (r^2 %.2f)' % (series, slope * 3600, r2))
+
+    cursors = report['trends'].get('active_cursors')
+    if cursors is not None:
+        if cursors['max'] > max_cursors:
+            report['flags'].append('cursor buildup: up to %d open cursors' % cursors['max'])
+        elif cursors['per_hour'] > 0 and cursors['r2'] >= min_r2 and duration > CURSOR_EXPIRY:
+            report['flags'].append('cursor buildup: %.1f more open cursors per hour for longer than CURSOR_EXPIRY' %
+                                   cursors['per_hour'])
+
+    # memory growth between consecutive samples against what happened in between
+    memory = 'process_mb' if 'process_mb' in report['trends'] else 'rss_mb'
+    pairs = [(a, b) for (a, b) in zip(steady, steady[1:])
+             if getattr(a, memory) is not None and getattr(b, memory) is not None]
+    growth = [getattr(b, memory) - getattr(a, memory) for (a, b) in pairs]
+    for op in sorted(set([op for (_, b) in pairs for op in b.ops])):
+        report['correlations']['ops:' + op] = correlation([b.ops.get(op, 0) for (_, b) in pairs], growth)
+    if all([b.active_cursors is not None for (_, b) in pairs]):
+        report['correlations']['active_cursors'] = correlation([b.active_cursors for (_, b) in pairs], growth)
+    return report
+
+
+def print_report(report):
+    print 'Memory samples: %d over %.0f s' % (report['samples'], report.get('duration_s', 0))
+    for (series, trend) in report['trends'].items():
+        print '  %-16s first %10.1f  last %10.1f  max %10.1f  trend %+10.2f/hour  r^2 %.2f' % (
+            series, trend['first'], trend['last'], trend['max'], trend['per_hour'], trend['r2'])
+    for (name, r) in report['correlations'].items():
+        print '  memory growth vs %-16s correlation %+.2f' % (name, r)
+    for flag in report['flags']:
+        print 'WARNING: ' + flag
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Samples the memory of a server during a run and looks for leaks')
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument('--interval', type=float, default=10, help='seconds between samples')
+    parser.add_argument('--duration', type=float, default=0, help='seconds to sample for, 0 to run until interrupted')
+    parser.add_argument('--trace-dir', default='', help='trace directory of Document Layer for operations and cursors')
+    parser.add_argument('--no-psutil', default=False, action='store_true', help='do not sample the RSS of fdbdoc')
+    parser.add_argument(
+        '--min-growth', type=float, default=10, help='MB per hour of steady growth above which a leak is reported')
+    parser.add_argument('--output', default='', help='JSON file to write the samples and the report to')
+    ns = vars(parser.parse_args())
+
+    monitor = MemoryMonitor(ns['host'], ns['port'], ns['interval'], ns['trace_dir'], not ns['no_psutil'])
+    monitor.start()
+    try:
+        end_time = time.time() + ns['duration'] if ns['duration'] > 0 else None
+        while end_time is None or time.time() < end_time:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    monitor.stop()
+
+    report = analyze(monitor.samples, min_growth_mb_per_hour=ns['min_growth'])
+    print_report(report)
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump({'samples': [s.to_dict() for s in monitor.samples], 'report': report}, f, indent=2)
+    sys.exit(len(report['flags']) > 0)
@@ -0,0 +1,394 @@
+#!/usr/bin/python
+#
+# model_bench.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Microbenchmarks of the hot paths of mongo_model and util, the in-memory model the fuzzers compare against. The
+# datasets are generated by gen with a fixed seed and size, so two runs of the same benchmark do the same work. Every
+# benchmark is run in several samples, the throughput is reported as a mean with a 95% confidence interval.
+#
+#   model_bench.py --save-baseline baseline.json       # before a change
+#   model_bench.py --compare baseline.json             # after it, fails on regressions beyond --threshold
+
+import argparse
+import json
+import math
+import sys
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from random import Random
+
+import gen
+import mongo_model
+import util
+
+# two-sided 95% quantiles of Student's t distribution by degrees of freedom, the normal quantile beyond
+T_95 = {1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36, 8: 2.31, 9: 2.26, 10: 2.23, 15: 2.13, 20: 2.09,
+        30: 2.04}
+
+
+def t_quantile(degrees):
+    for d in sorted(T_95.keys()):
+        if degrees <= d:
+            return T_95[d]
+    return 1.96
+
+
+class Result(object):
+    def __init__(self, name, rates):
+        self.name = name
+        # operations per second of every sample
+        self.rates = rates
+        n = len(rates)
+        self.mean = sum(rates) / n
+        self.stdev = math.sqrt(sum([(r - self.mean)**2 for r in rates]) / (n - 1)) if n > 1 else 0.0
+        # half width of the 95% confidence interval of the mean
+        self.ci = t_quantile(n - 1) * self.stdev / math.sqrt(n) if n > 1 else 0.0
+
+    def to_dict(self):
+        return OrderedDict([('mean', self.mean), ('stdev', self.stdev), ('ci', self.ci), ('rates', self.rates)])
+
+
+class Benchmark(object):
+    """
+    setup() builds the dataset once. prepare() is called before every timed run and not timed, for benchmarks which
+    modify their data. run(state) does the timed work and returns the number of operations it did.
+    """
+
+    def __init__(self, name, setup, run, prepare=None):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.prepare = prepare
+
+    def measure(self, ns):
+        data = self.setup(ns)
+        # calibrate the number of runs per sample on a first, unmeasured run
+        state = self.prepare(data) if self.prepare is not None else data
+        start = time.time()
+        self.run(state)
+        runs = max(1, int(ns['min_sample_time'] / max(time.time() - start, 1e-6)))
+
+        rates = []
+        for _ in range(0, ns['samples']):
+            (operations, elapsed) = (0, 0.0)
+            for _ in range(0, runs):
+                state = self.prepare(data) if self.prepare is not None else data
+                start = time.time()
+                operations += self.run(state)
+                elapsed += time.time() - start
+            rates.append(operations / elapsed)
+        return Result(self.name, rates)
+
+
+def seeded(ns, offset):
+    """Resets the generator to a seed of its own for every dataset, so that datasets do not depend on each other."""
+    gen.reset_generator_options()
+    gen.global_prng = Random(ns['seed'] + offset)
+
+
+def documents(ns, offset=0, with_id=True):
+    seeded(ns, offset)
+    return [gen.random_document(with_id) for _ in range(0, ns['size'])]
+
+
+def model_collection(ns, docs):
+    collection = mongo_model.MongoModel('DocLayer')['test']['bench']
+    collection.insert(deepcopy(docs))
+    return collection
+
+
+def valid(items, check):
+    """The items for which check does not raise a MongoModelException, generated items can be invalid."""
+    ret = []
+    for item in items:
+        try:
+            check(item)
+            ret.append(item)
+        except util.MongoModelException:
+            pass
+    return ret
+
+
+def setup_evaluate(ns):
+    docs = documents(ns)
+    options = util.ModelOptions('DocLayer')
+    seeded(ns, 1)
+    queries = [gen.random_query() for _ in range(0, ns['queries'])]
+    queries = valid(queries,
+                    lambda q: [mongo_model.evaluate(q.keys()[0], q.values()[0], doc, options) for doc in docs[:10]])
+    return (docs, queries, options)
+
+
+def run_evaluate((docs, queries, options)):
+    for query in queries:
+        (field, predicate) = query.items()[0]
+        for doc in docs:
+            try:
+                mongo_model.evaluate(field, predicate, doc, options)
+            except util.MongoModelException:
+                pass
+    return len(queries) * len(docs)
+
+
+def setup_expand(ns):
+    docs = documents(ns)
+    seeded(ns, 2)
+    return (docs, [gen.random_compound_field_name(False) for _ in range(0, ns['queries'])])
+
+
+def run_expand((docs, fields)):
+    for field in fields:
+        for doc in docs:
+            mongo_model.expand(field, doc, True, True, False, True, True, False)
+    return len(fields) * len(docs)
+
+
+def setup_project(ns):
+    docs = documents(ns)
+    seeded(ns, 3)
+    projections = [p for p in [gen.random_projection() for _ in range(0, ns['queries'])] if p is not None]
+    return (docs, valid(projections, lambda p: mongo_model.project(docs[:10], p)))
+
+
+def run_project((docs, projections)):
+    for projection in projections:
+        mongo_model.project(docs, projection)
+    return len(projections) * len(docs)
+
+
+def setup_insert(ns):
+    return documents(ns)[:ns['writes']]
+
+
+def setup_sorted_dict(ns):
+    docs = documents(ns)
+    return [(doc['_id'], doc) for doc in docs]
+
+
+def run_sorted_dict(items):
+    d = mongo_model.SortedDict()
+    for (key, value) in items:
+        d[key] = value
+    return len(items)
+
+
+def prepare_insert(docs):
+    return (mongo_model.MongoModel('DocLayer')['test']['bench'], deepcopy(docs))
+
+
+def run_insert((collection, docs)):
+    for doc in docs:
+        try:
+            collection.insert(doc)
+        except util.MongoModelException:
+            pass
+    return len(docs)
+
+
+def setup_update(ns):
+    collection = model_collection(ns, documents(ns))
+    seeded(ns, 4)
+    updates = [gen.random_update(collection) for _ in range(0, ns['writes'])]
+    return (collection.data, updates)
+
+
+def prepare_update((data, updates)):
+    collection = mongo_model.MongoModel('DocLayer')['test']['bench']
+    collection.data = deepcopy(data)
+    return (collection, deepcopy(updates))
+
+
+def run_update((collection, updates)):
+    for u in updates:
+        try:
+            collection.update(u['query'], u['update'], u['upsert'], u['multi'])
+        except util.MongoModelException:
+            pass
+    return len(updates)
+
+
+def setup_find(ns):
+    collection = model_collection(ns, documents(ns))
+    seeded(ns, 5)
+    queries = valid([gen.random_query() for _ in range(0, ns['queries'])], lambda q: collection.find(q))
+    return (collection, queries)
+
+
+def run_find((collection, queries)):
+    for query in queries:
+        collection.find(query)
+    return len(queries)
+
+
+def setup_nondeterministic_list(ns):
+    docs = documents(ns)
+    options = util.ModelOptions('DocLayer')
+    seeded(ns, 6)
+    sorts = [gen.random_query_sort() for _ in range(0, ns['queries'])]
+    sorts = valid(sorts, lambda s: util.MongoModelNondeterministicList(docs, s, 0, 0, {}, None, options))
+    return (docs, sorts, options)
+
+
+def run_nondeterministic_list((docs, sorts, options)):
+    for sort in sorts:
+        util.MongoModelNondeterministicList(docs, sort, 0, 0, {}, None, options)
+    return len(sorts)
+
+
+def setup_compare_value(ns):
+    seeded(ns, 7)
+    values = [gen.random_value() for _ in range(0, ns['size'])]
+    return zip(values, values[1:] + values[:1])
+
+
+def run_compare_value(pairs):
+    for (vl, vr) in pairs:
+        util.mongo_compare_value(vl, vr)
+    return len(pairs)
+
+
+def setup_compare_ordered(ns):
+    # _id values are HashableOrderedDicts, which only the unordered comparison handles
+    docs = documents(ns, with_id=False)
+    return zip(docs, docs[1:] + docs[:1])
+
+
+def run_compare_ordered(pairs):
+    for (lhs, rhs) in pairs:
+        util.mongo_compare_ordered_dict_items(lhs, rhs)
+    return len(pairs)
+
+
+def setup_compare_unordered(ns):
+    docs = [util.deep_convert_to_unordered(doc) for doc in documents(ns)]
+    return zip(docs, docs[1:] + docs[:1])
+
+
+def run_compare_unordered(pairs):
+    for (lhs, rhs) in pairs:
+        util.mongo_compare_unordered_dict_items(lhs, rhs)
+    return len(pairs)
+
+
+def setup_compare_list(ns):
+    seeded(ns, 8)
+    arrays = [gen.random_array() for _ in range(0, ns['size'])]
+    return zip(arrays, arrays[1:] + arrays[:1])
+
+
+def run_compare_list(pairs):
+    for (lhs, rhs) in pairs:
+        util.mongo_compare_list_items(lhs, rhs)
+    return len(pairs)
+
+
+BENCHMARKS = [
+    Benchmark('evaluate', setup_evaluate, run_evaluate),
+    Benchmark('expand', setup_expand, run_expand),
+    Benchmark('project', setup_project, run_project),
+    Benchmark('sorted_dict_insert', setup_sorted_dict, run_sorted_dict),
+    Benchmark('collection_insert', setup_insert, run_insert, prepare_insert),
+    Benchmark('collection_update', setup_update, run_update, prepare_update),
+    Benchmark('collection_find', setup_find, run_find),
+    Benchmark('nondeterministic_list', setup_nondeterministic_list, run_nondeterministic_list),
+    Benchmark('compare_value', setup_compare_value, run_compare_value),
+    Benchmark('compare_ordered_dict', setup_compare_ordered, run_compare_ordered),
+    Benchmark('compare_unordered_dict', setup_compare_unordered, run_compare_unordered),
+    Benchmark('compare_list', setup_compare_list, run_compare_list),
+]
+
+
+def regressed(result, baseline, threshold):
+    """
+    A benchmark regressed if its mean dropped by more than threshold relative to the baseline, and the drop is
+    significant: the confidence intervals of the two means do not overlap.
+    """
+    drop = (baseline['mean'] - result.mean) / baseline['mean']
+    return drop > threshold and result.mean + result.ci < baseline['mean'] - baseline['ci']
+
+
+def run_benchmarks(ns, baseline):
+    print '{:<24} {:>14} {:>10} {:>10}'.format('benchmark', 'ops/s', '+/- 95%', 'change')
+    results = OrderedDict()
+    regressions = []
+    for benchmark in BENCHMARKS:
+        if len(ns['benchmarks']) > 0 and benchmark.name not in ns['benchmarks']:
+            continue
+        result = benchmark.measure(ns)
+        results[benchmark.name] = result
+        change = ''
+        if benchmark.name in baseline:
+            change = '%+.1f%%' % ((result.mean / baseline[benchmark.name]['mean'] - 1) * 100)
+            if regressed(result, baseline[benchmark.name], ns['threshold']):
+                regressions.append(benchmark.name)
+                change += ' REGRESSED'
+        print '{:<24} {:>14.1f} {:>9.1f}% {:>10}'.format(benchmark.name, result.mean,
+                                                        100 * result.ci / result.mean if result.mean else 0, change)
+        sys.stdout.flush()
+
+    if ns['save_baseline'] != '':
+        with open(ns['save_baseline'], 'w') as f:
+            json.dump({
+                'seed': ns['seed'],
+                'size': ns['size'],
+                'queries': ns['queries'],
+                'writes': ns['writes'],
+                'results': OrderedDict([(name, r.to_dict()) for (name, r) in results.items()])
+            }, f, indent=2)
+
+    if len(regressions) > 0:
+        print 'Regressions beyond %d%%: %s' % (ns['threshold'] * 100, ', '.join(regressions))
+    return len(regressions) == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks of mongo_model and util')
+    parser.add_argument(
+        '--benchmarks',
+        type=lambda s: s.split(','),
+        default=[],
+        help='comma separated benchmarks to run, all by default: ' + ', '.join([b.name for b in BENCHMARKS]))
+    parser.add_argument('--seed', type=int, default=1, help='seed of the generated datasets')
+    parser.add_argument('--size', type=int, default=100, help='number of documents or values of the datasets')
+    parser.add_argument('--queries', type=int, default=50, help='number of queries, projections or sorts')
+    parser.add_argument(
+        '--writes', type=int, default=20, help='number of inserts and updates, which copy the whole model collection')
+    parser.add_argument('--samples', type=int, default=10, help='number of measured samples of every benchmark')
+    parser.add_argument('--min-sample-time', type=float, default=0.2, help='minimum seconds of a sample')
+    parser.add_argument('--save-baseline', default='', help='JSON file to save the results to as a baseline')
+    parser.add_argument('--compare', default='', help='JSON file of a baseline to compare to')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1, help='relative slowdown from the baseline reported as a regression')
+    ns = vars(parser.parse_args())
+
+    unknown = [name for name in ns['benchmarks'] if name not in [b.name for b in BENCHMARKS]]
+    if len(unknown) > 0:
+        parser.error('unknown benchmarks: ' + ', '.join(unknown))
+    baseline = {}
+    if ns['compare'] != '':
+        with open(ns['compare']) as f:
+            saved = json.load(f)
+        baseline = saved['results']
+        if any([saved[k] != ns[k] for k in ['seed', 'size', 'queries', 'writes']]):
+            parser.error('the baseline was measured with another --seed, --size, --queries or --writes')
+    sys.exit(not run_benchmarks(ns, baseline))
@@ -568,7 +568,8 @@ class MongoCollection(object):
     def insert_one(self, dict):
         self.insert(dict)
 
-    def insert_many(self, list):
+    def insert_many(self, list, ordered=True):
+        # every call is all or nothing on the model, so ordering makes no difference
         self.insert(list)
 
     def find(self, query, fields=None, batch_size=None):
@@ -584,6 +585,17 @@ class MongoCollection(object):
         else:
             return project(results, fields)
 
+    def find_many(self, queries):
+        """Evaluates the queries in a single pass over the documents, returns the results of each."""
+        for query in queries:
+            assert len(query) <= 1  # FIXME: test weakness
+        results = [[] for _ in queries]
+        for item in self.data.values():
+            for (ii, query) in enumerate(queries):
+                if len(query) == 0 or evaluate(query.keys()[0], query.values()[0], item, self.options):
+                    results[ii].append(item)
+        return results
+
     def distinct(self, field, filter=None):
         distinct_values = set()
         if filter is None:
@@ -1192,6 +1204,61 @@ class MongoCollection(object):
     def update_many(self, query, update, upsert):
         self.update(query, update, upsert, multi=True)
 
+    def snapshot(self):
+        """Returns a copy of the collection, which shares the documents and indexes with it until it is written to."""
+        return CopyOnWriteCollection(self)
+
+
+class CopyOnWriteCollection(MongoCollection):
+    """
+    Shares the documents and indexes of its source until it is written to. The documents found while they are shared
+    are copies, so that changing a result changes neither the source nor the other snapshots.
+    """
+
+    def __init__(self, source):
+        MongoCollection.__init__(self, source.options, source.collectionname)
+        self.data = source.data
+        self.indexes = source.indexes
+        self.shared = True
+
+    def _own(self):
+        if self.shared:
+            self.data = deepcopy(self.data)
+            self.indexes = deepcopy(self.indexes)
+            self.shared = False
+
+    def find(self, query, fields=None, batch_size=None):
+        results = MongoCollection.find(self, query, fields, batch_size)
+        return deepcopy(results) if self.shared else results
+
+    def find_many(self, queries):
+        results = MongoCollection.find_many(self, queries)
+        return deepcopy(results) if self.shared else results
+
+    def remove(self):
+        self._own()
+        MongoCollection.remove(self)
+
+    def insert(self, input):
+        self._own()
+        MongoCollection.insert(self, input)
+
+    def replace(self, key, new_value):
+        self._own()
+        MongoCollection.replace(self, key, new_value)
+
+    def drop_indexes(self):
+        self._own()
+        MongoCollection.drop_indexes(self)
+
+    def _create_index(self, keys, kwargs):
+        self._own()
+        return MongoCollection._create_index(self, keys, kwargs)
+
+    def update(self, query, update, upsert, multi):
+        self._own()
+        return MongoCollection.update(self, query, update, upsert, multi)
+
 
 class MongoIndex(object):
     def __init__(self, indexKeys, kwargs):
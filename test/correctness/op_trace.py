@@ -0,0 +1,191 @@
+#!/usr/bin/python
+#
+# op_trace.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Recording of the operations issued to a server into a trace file, which is a gzip'ed sequence of BSON records:
+#
+#   {t: seconds since the start of the trace, op: operation, coll: collection name, args: {...},
+#    error: error code or None, digest: digest of the response or None}
+#
+# The _id the server generates for an upsert without one differs on every run, the args of such an update keep it as
+# upserted, for replays to give the document the same _id.
+
+import gzip
+import hashlib
+import time
+
+import bson
+import pymongo
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+
+# Results are digested in the BSON they were received as, decoding into dictionaries would lose the field order.
+RAW_BSON = CodecOptions(document_class=RawBSONDocument)
+
+
+def result_digest(raw_docs):
+    """Digest of a list of RawBSONDocuments which does not depend on their order."""
+    digests = sorted([hashlib.md5(doc.raw).hexdigest() for doc in raw_docs])
+    return hashlib.md5(''.join(digests)).hexdigest()
+
+
+def write_result_digest(result):
+    if not isinstance(result, dict):
+        return None
+    return hashlib.md5(repr([(k, result.get(k)) for k in ['n', 'nModified', 'updatedExisting']])).hexdigest()
+
+
+def as_pairs(spec):
+    # keeps the order of index and sort specifications, which a decoded dictionary would lose
+    if spec is None or isinstance(spec, basestring):
+        return spec
+    return [list(item) for item in spec]
+
+
+class TraceWriter(object):
+    def __init__(self, path):
+        self.fp = gzip.open(path, 'wb')
+        self.start = time.time()
+        self.count = 0
+
+    def write(self, start, op, coll, args, error=None, digest=None):
+        record = SON([('t', start - self.start), ('op', op), ('coll', coll), ('args', args), ('error', error),
+                      ('digest', digest)])
+        self.fp.write(bson.BSON.encode(record))
+        self.count += 1
+
+    def close(self):
+        self.fp.close()
+
+
+def read_trace(path):
+    with gzip.open(path, 'rb') as fp:
+        for record in bson.decode_file_iter(fp, codec_options=CodecOptions(document_class=SON)):
+            yield record
+
+
+def error_code(e):
+    return e.code if e.code is not None else -1
+
+
+class RecordingCursor(object):
+    """Cursor which records the find, with its final sort/skip/limit, once it has been fully iterated."""
+
+    def __init__(self, writer, collection, args):
+        self.writer = writer
+        self.collection = collection
+        self.args = args
+        self.cursor = collection.with_options(codec_options=RAW_BSON).find(
+            args['filter'], args['projection'], batch_size=args['batch_size'])
+        self.start = time.time()
+
+    def sort(self, key_or_list, direction=None):
+        self.cursor.sort(key_or_list, direction)
+        self.args['sort'] = as_pairs(key_or_list if direction is None else [(key_or_list, direction)])
+        return self
+
+    def skip(self, skip):
+        self.cursor.skip(skip)
+        self.args['skip'] = skip
+        return self
+
+    def limit(self, limit):
+        self.cursor.limit(limit)
+        self.args['limit'] = limit
+        return self
+
+    def count(self, with_limit_and_skip=False):
+        start = time.time()
+        try:
+            n = self.cursor.count(with_limit_and_skip)
+        except pymongo.errors.OperationFailure as e:
+            self.writer.write(start, 'count', self.collection.name, self.args, error=error_code(e))
+            raise
+        self.writer.write(start, 'count', self.collection.name, self.args, digest=str(n))
+        return n
+
+    def __iter__(self):
+        docs = []
+        try:
+            for doc in self.cursor:
+                docs.append(doc)
+                yield bson.BSON(doc.raw).decode(self.collection.codec_options)
+        except pymongo.errors.OperationFailure as e:
+            self.writer.write(self.start, 'find', self.collection.name, self.args, error=error_code(e))
+            raise
+        self.writer.write(self.start, 'find', self.collection.name, self.args, digest=result_digest(docs))
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class RecordingCollection(object):
+    """Wraps a PyMongo collection and records the operations the correctness test issues to it."""
+
+    def __init__(self, writer, collection):
+        self.writer = writer
+        self.collection = collection
+        # test output labels collections by module
+        self.__module__ = collection.__module__
+
+    def _record(self, op, args, func, digest_func=None):
+        start = time.time()
+        try:
+            result = func()
+        except pymongo.errors.OperationFailure as e:
+            self.writer.write(start, op, self.collection.name, args, error=error_code(e))
+            raise
+        digest = digest_func(result) if digest_func is not None else None
+        self.writer.write(start, op, self.collection.name, args, digest=digest)
+        return result
+
+    def drop(self):
+        return self._record('drop', {}, self.collection.drop)
+
+    def insert_many(self, docs, ordered=True):
+        # the _id's are only known after the insert, so the arguments are recorded afterwards
+        args = SON([('docs', docs), ('ordered', ordered)])
+        return self._record('insert_many', args, lambda: self.collection.insert_many(docs, ordered=ordered))
+
+    def ensure_index(self, keys, unique=False):
+        args = SON([('keys', as_pairs(keys)), ('unique', unique)])
+        return self._record('ensure_index', args, lambda: self.collection.ensure_index(keys, unique=unique))
+
+    def update(self, query, update, upsert=False, multi=False):
+        args = SON([('query', query), ('update', update), ('upsert', upsert), ('multi', multi)])
+
+        def run():
+            result = self.collection.update(query, update, upsert=upsert, multi=multi)
+            if isinstance(result, dict) and 'upserted' in result:
+                args['upserted'] = result['upserted']
+            return result
+
+        return self._record('update', args, run, write_result_digest)
+
+    def find(self, filter=None, projection=None, batch_size=0):
+        args = SON([('filter', filter), ('projection', projection), ('batch_size', batch_size), ('sort', None),
+                    ('skip', 0), ('limit', 0)])
+        return RecordingCursor(self.writer, self.collection, args)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+#
+# open_loop.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Open-loop load generator. Operations are issued at a fixed target rate following a schedule that does not depend
+# on how fast the server responds, and their latency is measured from the time they were scheduled to be sent. An
+# operation that has to wait for a client thread, because the server is falling behind, has that wait counted in its
+# latency, instead of the wait being hidden by the client slowing down (coordinated omission).
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+import pymongo
+
+import stats
+import ycsb
+
+# fraction of the operations that may be late, or the issue rate may fall behind the target, before the schedule counts
+# as not kept
+SCHEDULE_TOLERANCE = 0.05
+
+
+class Schedule(object):
+    """Hands out the intended send times of the operations, at a fixed rate or with exponential inter-arrival times."""
+
+    def __init__(self, rate, duration, poisson, seed):
+        self.rate = rate
+        self.poisson = poisson
+        self.prng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.end = self.start + duration
+        self.next_time = self.start
+        self.issued = 0
+
+    def next(self):
+        """Returns the intended send time of the next operation, None once the duration is over."""
+        with self.lock:
+            intended = self.next_time
+            if intended >= self.end:
+                return None
+            self.next_time += self.prng.expovariate(self.rate) if self.poisson else 1.0 / self.rate
+            self.issued += 1
+            return intended
+
+
+class Results(object):
+    def __init__(self, mix):
+        self.lock = threading.Lock()
+        # latency from the intended send time, and service time from the actual send time
+        self.latency = dict([(op, stats.LatencyHistogram()) for op in mix])
+        self.service = dict([(op, stats.LatencyHistogram()) for op in mix])
+        self.all_latency = stats.LatencyHistogram()
+        self.late = 0
+        self.errors = 0
+
+    def merge(self, latency, service, late, errors):
+        with self.lock:
+            for op in latency:
+                self.latency[op].merge(latency[op])
+                self.service[op].merge(service[op])
+                self.all_latency.merge(latency[op])
+            self.late += late
+            self.errors += errors
+
+
+def run_thread(workload, schedule, results, seed, late_threshold):
+    prng = random.Random(seed)
+    keys = workload.key_chooser(prng)
+    latency = dict([(op, stats.LatencyHistogram()) for op in workload.mix])
+    service = dict([(op, stats.LatencyHistogram()) for op in workload.mix])
+    late = 0
+    errors = 0
+    while True:
+        intended = schedule.next()
+        if intended is None:
+            break
+        delay = intended - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        elif -delay > late_threshold:
+            late += 1
+
+        op = workload.choose_operation(prng)
+        start = time.time()
+        try:
+            workload.run_operation(op, keys, prng)
+        except pymongo.errors.PyMongoError:
+            # e.g. AutoReconnect, which would otherwise end the thread and lose its samples
+            errors += 1
+        end = time.time()
+        latency[op].record(end - intended)
+        service[op].record(end - start)
+    results.merge(latency, service, late, errors)
+
+
+def run_rate(ns, workload, rate):
+    schedule = Schedule(rate, ns['duration'], ns['poisson'], ns['seed'])
+    results = Results(workload.mix)
+    threads = [
+        threading.Thread(
+            target=run_thread, args=(workload, schedule, results, ns['seed'] + t, ns['late_threshold_ms'] / 1000.0))
+        for t in range(0, ns['threads'])
+    ]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - schedule.start
+    return (results, schedule.issued / elapsed)
+
+
+def print_rate(rate, achieved, results):
+    h = results.all_latency
+    print '{:>10.1f} {:>10.1f} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        rate, achieved, h.count, h.percentile(50), h.percentile(90), h.percentile(99), h.percentile(99.9), results.late,
+        results.errors)
+
+
+def print_operations(results):
+    print '{:<18} {:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'operation', 'count', 'p50 us', 'p99 us', 'svc p50 us', 'svc p99 us')
+    for op in ycsb.OPERATIONS:
+        if op not in results.latency:
+            continue
+        (latency, service) = (results.latency[op], results.service[op])
+        print '{:<18} {:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+            op, latency.count, latency.percentile(50), latency.percentile(99), service.percentile(50),
+            service.percentile(99))
+
+
+def run_open_loop(ns):
+    collection_name = ycsb.load_records(ns)
+    if collection_name is None:
+        return False
+
+    client = pymongo.MongoClient(ns['host'], ns['port'], maxPoolSize=ns['threads'])
+    workload = ycsb.Workload(ns, client['test'][collection_name])
+    print 'Running %s open-loop with %d threads, %s arrivals' % (
+        ycsb.describe_workload(ns, workload), ns['threads'], 'poisson' if ns['poisson'] else 'uniform')
+
+    print '{:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        'target/s', 'issued/s', 'ops', 'p50 us', 'p90 us', 'p99 us', 'p99.9 us', 'late', 'errors')
+    saturation = None
+    collector = ycsb.start_collector(ns)
+    for rate in ns['rates']:
+        start = time.time()
+        (results, achieved) = run_rate(ns, workload, rate)
+        print_rate(rate, achieved, results)
+        if ns['verbose']:
+            print_operations(results)
+        if collector is not None:
+            # the server side latency excludes the time operations were queued in front of Document Layer
+            ycsb.print_server_comparison(collector, [results.all_latency], start)
+        # The server is saturated once the schedule can not be kept, or the latency goes beyond the limit. Late
+        # operations still run, so the schedule shows in how many were sent late and in the rate they were issued at.
+        schedule_missed = (results.late > SCHEDULE_TOLERANCE * results.all_latency.count or
+                           achieved < (1 - SCHEDULE_TOLERANCE) * rate)
+        if saturation is None and (schedule_missed or results.all_latency.percentile(99) > ns['max_p99_ms'] * 1000):
+            saturation = rate
+            if ns['stop_at_saturation']:
+                break
+
+    if collector is not None:
+        collector.stop()
+    if saturation is not None:
+        print 'Saturated at a target rate of %.1f/s' % saturation
+    else:
+        print 'Not saturated up to a target rate of %.1f/s' % ns['rates'][-1]
+
+    if ns['drop']:
+        client['test'][collection_name].drop()
+    client.close()
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Open-loop load generator measuring latency from the intended send time')
+    ycsb.add_workload_arguments(parser)
+    parser.add_argument(
+        '--rates',
+        type=lambda s: [float(r) for r in s.split(',')],
+        default=[100.0],
+        help='comma separated target rates in operations per second, each run for --duration seconds')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run every rate for')
+    parser.add_argument(
+        '-t',
+        '--threads',
+        type=int,
+        default=32,
+        help='number of client threads, needs to be well above rate times latency to keep the schedule')
+    parser.add_argument('--poisson', default=False, action='store_true', help='exponential inter-arrival times')
+    parser.add_argument(
+        '--max-p99-ms', type=float, default=100, help='p99 latency in ms above which the server counts as saturated')
+    parser.add_argument(
+        '--late-threshold-ms',
+        type=float,
+        default=1,
+        help='an operation sent this much later than scheduled counts as late')
+    parser.add_argument(
+        '--stop-at-saturation', default=False, action='store_true', help='skip the rates after the saturation point')
+    parser.add_argument('-v', '--verbose', default=False, action='store_true', help='print latencies per operation')
+
+    ns = vars(parser.parse_args())
+    if ns['skip_load'] and ns['collection'] == '':
+        parser.error('--skip-load needs --collection')
+    sys.exit(not run_open_loop(ns))
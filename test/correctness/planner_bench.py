@@ -0,0 +1,358 @@
+#!/usr/bin/python
+#
+# planner_bench.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Benchmark of the planner scenarios of smoke/test_planner.py on loaded collections. The smoke tests only check the
+# shape of the plans on empty collections, here every scenario runs against 10^4 to 10^6 documents with controlled
+# selectivity, to catch plans which are correct but slow.
+#
+# Every field a to g, and n.b, is uniform in [0, 1 / selectivity), so an equality on 0 matches a fraction selectivity
+# of the documents and a range "$lt <range bound>" a fraction range-selectivity of them. Explain only describes a plan
+# without running it, so the number of scanned documents and transactions per request come from the ConsoleMetric
+# events Document Layer writes to its trace files, if --trace-dir is given.
+#
+# Every scenario expects its plan to scan a number of documents per returned one that follows from the selectivities,
+# e.g. 1 for an exact index scan but 1 / selectivity for the table scan of no_index. A plan is reported as slow if it
+# scans more than --scan-ratio-tolerance times what its scenario expects.
+
+import argparse
+import json
+import random
+import sys
+import time
+from collections import OrderedDict
+
+import pymongo
+from bson.son import SON
+
+import bulk_loader
+import console_metrics
+import explain_plan
+import slow_queries
+import stats
+
+FIELDS = ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+
+
+class Scenario(object):
+    def __init__(self, name, indexes, query, check, scan_ratio=lambda s, r: 1.0):
+        self.name = name
+        # list of (name, keys)
+        self.indexes = indexes
+        # function of the equality value, the range bound of a field and the range bound of _id returning the query
+        self.query = query
+        # function of the explain_plan.PlanNode returning whether the plan has the expected shape
+        self.check = check
+        # function of the selectivity of an equality and of a range returning the documents the expected plan scans
+        # per returned document
+        self.scan_ratio = scan_ratio
+
+
+def eq(field):
+    return lambda v, r, pk: {field: v}
+
+
+def index_named(name):
+    return lambda plan: plan.uses_only_index(name)
+
+
+def no_table_scan(plan):
+    return not plan.has(explain_plan.TABLE_SCAN)
+
+
+def no_table_scan_no_filter(plan):
+    return no_table_scan(plan) and not plan.has(explain_plan.FILTER)
+
+
+def pk_lookup(plan):
+    return plan.all_leaves(lambda leaf: leaf.type == explain_plan.PK_LOOKUP)
+
+
+def union_scan_ratio(selectivities):
+    """Documents scanned per returned one by a union of scans of independent fields with the given selectivities."""
+    missed = 1.0
+    for selectivity in selectivities:
+        missed *= 1 - selectivity
+    return sum(selectivities) / (1 - missed)
+
+
+RANGE_SCENARIO_INDEXES = [('compound', [('d', 1), ('b', 1), ('c', 1)]), ('simple', [('d', 1)])]
+
+SCENARIOS = [
+    Scenario('pk_lookup', [], lambda v, r, pk: {'_id': 1}, lambda plan: pk_lookup(plan) and plan.has_tight_bounds()),
+    Scenario('pk_range', [], lambda v, r, pk: {'_id': {'$lt': pk}}, pk_lookup),
+    Scenario('no_index', [], eq('a'), lambda plan: True, lambda s, r: 1 / s),
+    Scenario('simple', [('index', [('a', 1)])], eq('a'), no_table_scan_no_filter),
+    Scenario('simple_range', [('index', [('a', 1)])], lambda v, r, pk: {'a': {'$lt': r}}, no_table_scan),
+    Scenario('dotted_path', [('simple', [('n.b', 1)])], eq('n.b'), no_table_scan),
+    Scenario('compound', [('compound', [('a', 1), ('b', 1)])], lambda v, r, pk: {'$and': [{
+        'a': v
+    }, {
+        'b': v
+    }]}, no_table_scan_no_filter),
+    Scenario('compound_out_of_order', [('compound', [('a', 1), ('b', 1)])], lambda v, r, pk: {'$and': [{
+        'b': v
+    }, {
+        'a': v
+    }]}, no_table_scan),
+    Scenario('range_at_start', RANGE_SCENARIO_INDEXES, lambda v, r, pk: {'$and': [{
+        'd': {
+            '$lt': r
+        }
+    }, {
+        'b': v
+    }, {
+        'c': v
+    }]}, index_named('simple'), lambda s, r: 1 / (s * s)),
+    Scenario('range_at_middle', RANGE_SCENARIO_INDEXES, lambda v, r, pk: {'$and': [{
+        'b': {
+            '$lt': r
+        }
+    }, {
+        'd': v
+    }, {
+        'c': v
+    }]}, index_named('compound'), lambda s, r: 1 / s),
+    Scenario('range_at_end', RANGE_SCENARIO_INDEXES, lambda v, r, pk: {'$and': [{
+        'c': {
+            '$lt': r
+        }
+    }, {
+        'b': v
+    }, {
+        'd': v
+    }]}, index_named('compound')),
+    Scenario('or_union', [('index1', [('a', 1)]), ('index2', [('b', 1)])],
+             lambda v, r, pk: {'$or': [{
+                 'a': v
+             }, {
+                 'b': v
+             }]}, no_table_scan, lambda s, r: union_scan_ratio([s, s])),
+    Scenario('or_multi_union', [('index1', [('d', 1)]), ('index2', [('c', 1)]), ('index3', [('b', 1)]),
+                                ('index4', [('a', 1)])],
+             lambda v, r, pk: {'$or': [{
+                 'a': {
+                     '$lt': r
+                 }
+             }, {
+                 'b': v
+             }, {
+                 'c': {
+                     '$lt': r
+                 }
+             }, {
+                 'd': v
+             }]}, no_table_scan, lambda s, r: union_scan_ratio([r, s, r, s])),
+    Scenario('or_compound_union', [('compound', [('a', 1), ('b', 1)]), ('compound2', [('d', 1), ('c', 1)])],
+             lambda v, r, pk: {'$or': [{
+                 '$and': [{
+                     'b': v
+                 }, {
+                     'a': v
+                 }]
+             }, {
+                 '$and': [{
+                     'd': v
+                 }, {
+                     'c': v
+                 }]
+             }]}, no_table_scan, lambda s, r: union_scan_ratio([s * s, s * s])),
+]
+
+
+def generate_documents(number, cardinality, prng):
+    for i in range(0, number):
+        doc = {'_id': i}
+        for field in FIELDS:
+            doc[field] = prng.randrange(cardinality)
+        doc['n'] = {'b': prng.randrange(cardinality)}
+        yield doc
+
+
+def load_collection(ns, collection, number, cardinality):
+    collection.drop()
+    loader = bulk_loader.BulkLoader(collection, batch_size=ns['batch_size'], ordered=False)
+    start = time.time()
+    loader.load(generate_documents(number, cardinality, random.Random(ns['seed'])))
+    elapsed = time.time() - start
+    print 'Loaded %d documents in %.2f s (%.1f docs/s)' % (number, elapsed, number / elapsed if elapsed > 0 else 0)
+
+
+def run_scenario(ns, collection, scenario, number, cardinality, collector, slow_log):
+    for (name, keys) in scenario.indexes:
+        collection.create_index(keys=keys, name=name)
+
+    range_bound = max(1, int(round(ns['range_selectivity'] * cardinality)))
+    query = scenario.query(0, range_bound, max(1, int(round(ns['range_selectivity'] * number))))
+    plan = explain_plan.explain(collection, query)
+    for _ in range(0, ns['warmup']):
+        list(collection.find(query))
+
+    if collector is not None:
+        # the metrics published from now on only cover the measured runs
+        collector.wait_for_flush(ns['metric_flush_interval'])
+    window_start = time.time()
+    latency = stats.LatencyHistogram()
+    returned = 0
+    times = []
+    for _ in range(0, ns['iterations']):
+        start = time.time()
+        returned = len(list(collection.find(query)))
+        times.append(time.time() - start)
+        latency.record(times[-1])
+    if collector is not None:
+        collector.wait_for_flush(ns['metric_flush_interval'])
+    window_end = time.time()
+    if slow_log is not None and len(times) > 0:
+        # observed after the window, the snapshot of a slow query scans the whole collection
+        slow_log.begin(ns['seed'], [(keys, False) for (_, keys) in scenario.indexes],
+                       {'scenario': scenario.name, 'documents': number, 'selectivity': ns['selectivity']})
+        slow_log.observe(collection, 'doclayer', max(times), 'find', SON([('filter', query)]))
+
+    for (name, _) in scenario.indexes:
+        collection.drop_index(name)
+
+    result = OrderedDict([
+        ('scenario', scenario.name),
+        ('documents', number),
+        ('query', query),
+        ('plan', plan.summary()),
+        ('plan_ok', scenario.check(plan)),
+        ('returned', returned),
+        ('latency', latency.to_dict()),
+    ])
+    if collector is not None:
+        summaries = dict([(metric, console_metrics.summarize(collector.series(metric, window_start, window_end)))
+                          for metric in [console_metrics.INDEX_SCAN_DOCS, console_metrics.TABLE_SCAN_DOCS,
+                                         console_metrics.TR_PER_REQUEST, console_metrics.QUERY_LATENCY]])
+        transactions = summaries[console_metrics.TR_PER_REQUEST]
+        result['index_scanned'] = float(summaries[console_metrics.INDEX_SCAN_DOCS]['sum']) / ns['iterations']
+        result['table_scanned'] = float(summaries[console_metrics.TABLE_SCAN_DOCS]['sum']) / ns['iterations']
+        result['tr_per_request'] = transactions['mean']
+        result['tr_per_request_max'] = transactions['max']
+        result['server_latency'] = summaries[console_metrics.QUERY_LATENCY]
+        scanned = result['index_scanned'] + result['table_scanned']
+        # a correct plan is still too slow if it reads many more documents than the scenario expects it to
+        expected = scenario.scan_ratio(1.0 / cardinality, min(1.0, float(range_bound) / cardinality))
+        result['allowed_scan_ratio'] = ns['scan_ratio_tolerance'] * expected
+        result['slow'] = scanned > result['allowed_scan_ratio'] * max(returned, 1)
+    return result
+
+
+def print_header(with_metrics):
+    line = '{:<22} {:>9} {:>9} {:>10} {:>10}'.format('scenario', 'docs', 'returned', 'p50 us', 'p99 us')
+    if with_metrics:
+        line += ' {:>11} {:>11} {:>7}'.format('idx scanned', 'tbl scanned', 'tr/req')
+    print line + '  plan'
+
+
+def print_result(result):
+    line = '{:<22} {:>9} {:>9} {:>10} {:>10}'.format(result['scenario'], result['documents'], result['returned'],
+                                                       result['latency']['p50_us'], result['latency']['p99_us'])
+    if 'index_scanned' in result:
+        line += ' {:>11.1f} {:>11.1f} {:>7.2f}'.format(result['index_scanned'], result['table_scanned'],
+                                                       result['tr_per_request'])
+    line += '  ' + result['plan']
+    if not result['plan_ok']:
+        line += '  UNEXPECTED PLAN'
+    if result.get('slow', False):
+        line += '  SLOW'
+    print line
+
+
+def run_benchmark(ns):
+    client = pymongo.MongoClient(ns['host'], ns['port'])
+    collection_name = ns['collection'] if ns['collection'] != '' else 'planner' + str(random.random())[2:]
+    collection = client['test'][collection_name]
+    collector = console_metrics.MetricsCollector(ns['trace_dir']) if ns['trace_dir'] else None
+    if collector is not None:
+        collector.start()
+    cardinality = max(1, int(round(1 / ns['selectivity'])))
+    scenarios = [s for s in SCENARIOS if len(ns['scenarios']) == 0 or s.name in ns['scenarios']]
+    slow_log = slow_queries.open_log(ns, 'planner_bench')
+
+    results = []
+    okay = True
+    for number in ns['sizes']:
+        load_collection(ns, collection, number, cardinality)
+        print_header(collector is not None)
+        for scenario in scenarios:
+            result = run_scenario(ns, collection, scenario, number, cardinality, collector, slow_log)
+            print_result(result)
+            results.append(result)
+            okay = okay and result['plan_ok'] and not result.get('slow', False)
+
+    if collector is not None:
+        collector.stop()
+    if slow_log is not None:
+        print 'Kept %d slow operations in %s' % (slow_log.count, ns['slow_query_corpus'])
+        slow_log.close()
+    collection.drop()
+    client.close()
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+    return okay
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Planner scenarios of the smoke tests on loaded collections')
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument(
+        '--sizes',
+        type=lambda s: [int(n) for n in s.split(',')],
+        default=[10000, 100000, 1000000],
+        help='comma separated numbers of documents to run all scenarios on')
+    parser.add_argument(
+        '--scenarios',
+        type=lambda s: s.split(','),
+        default=[],
+        help='comma separated scenarios to run, all by default: ' + ', '.join([s.name for s in SCENARIOS]))
+    parser.add_argument(
+        '--selectivity', type=float, default=0.01, help='fraction of the documents matching an equality on a field')
+    parser.add_argument(
+        '--range-selectivity', type=float, default=0.1, help='fraction of the documents matching a range on a field')
+    parser.add_argument('--iterations', type=int, default=20, help='number of measured runs of every query')
+    parser.add_argument('--warmup', type=int, default=2, help='number of unmeasured runs of every query')
+    parser.add_argument('--batch-size', type=int, default=1000, help='documents per insert batch when loading')
+    parser.add_argument(
+        '--trace-dir', default='', help='trace directory of Document Layer to read scan and transaction metrics from')
+    parser.add_argument(
+        '--metric-flush-interval', type=float, default=console_metrics.FLUSH_INTERVAL,
+        help='seconds between ConsoleMetric flushes of Document Layer')
+    parser.add_argument(
+        '--scan-ratio-tolerance',
+        type=float,
+        default=3,
+        help='factor of the scanned documents per returned document a scenario expects above which its plan is '
+        'reported as slow')
+    parser.add_argument('-c', '--collection', default='', help='collection in database test, generated by default')
+    parser.add_argument('--output', default='', help='JSON file to write the results to')
+    parser.add_argument('--seed', type=int, default=random.randint(0, sys.maxint), help='random seed to use')
+    slow_queries.add_arguments(parser)
+
+    ns = vars(parser.parse_args())
+    unknown = [name for name in ns['scenarios'] if name not in [s.name for s in SCENARIOS]]
+    if len(unknown) > 0:
+        parser.error('unknown scenarios: ' + ', '.join(unknown))
+    sys.exit(not run_benchmark(ns))
@@ -1,5 +1,5 @@
 #!/usr/bin/python
-#
+# -*- coding: utf-8 -*-
 # preload_database.py
 #
 # This source file is part of the FoundationDB open source project
@@ -21,15 +21,22 @@
 # MongoDB is a registered trademark of MongoDB, Inc.
 #
 
-# -*- coding: utf-8 -*-
-
 import pymongo
 import argparse
 import gen
+import json
+import multiprocessing
+import os
+import Queue
 import random
+import sys
+import time
 import bson.objectid
 import datetime
 
+import stats
+from bulk_loader import BulkLoader
+
 d = {
     "name":
     "Alcybiades",
@@ -189,41 +196,160 @@ d = {
 }
 
 
-def preload_database(ns):
-    gen.generator_options.numeric_fieldnames = ns['no_numeric_fieldnames']
-    gen.generator_options.test_nulls = ns['no_nulls']
+def generate_document(i, big_documents):
+    if big_documents:
+        doc = d.copy()
+    else:
+        doc = gen.random_document(False)
+        doc["boo"] = i
+    doc["_id"] = str(i)
+    return doc
 
-    instance = random.random()
 
+def load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def save_checkpoint(path, state):
+    # written to a temporary file first, so that an interrupted write never leaves a broken checkpoint behind
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(state, fp)
+    os.rename(tmp, path)
+
+
+def load_range(ns, state, worker_id, progress, resumed):
+    """
+    Inserts the documents with _id's from state['next'][worker_id] up to the end of the range of the worker, and puts
+    a (worker_id, next, docs, bytes, seconds) tuple to the progress queue after every batch. resumed tells whether the
+    state was read from a checkpoint.
+    """
     client = pymongo.MongoClient(ns['host'], ns['port'])
-    if (ns['collection'] == ''):
-        collection = client['test']['performance' + str(instance)[2:]]
+    collection = client['test'][state['collection']]
+    # The checkpoint may lag behind what has been inserted before an interruption, even for a worker whose next _id
+    # is still the begin of its range. Every batch has its own seed, so such documents are generated again exactly the
+    # same, and every worker of a resumed load inserts unordered and skips them.
+    # callers such as setup_mongo.py only pass the options that define the data, the others keep their defaults
+    loader = BulkLoader(
+        collection, 0, ns.get('batch_bytes', 0), ordered=not ns.get('unordered', False) and not resumed,
+        measure_bytes=True)
+
+    i = state['next'][worker_id]
+    end = state['ranges'][worker_id][1]
+    batch_size = ns.get('batch_size', 100)
+    batch_size = batch_size if batch_size > 0 else end - i
+    while i < end:
+        batch_end = min(end, i + batch_size)
+        gen.global_prng = random.Random(state['seed'] * (state['number'] + 1) + i)
+        docs = [generate_document(j, state['big_documents']) for j in range(i, batch_end)]
+
+        loader.results = []
+        # every insert batch of a resumed load may hold documents inserted before, not just the first one
+        loader.load(docs, skip_duplicates=resumed)
+        progress.put((worker_id, batch_end, len(docs), sum([r.bytes for r in loader.results]),
+                      loader.total_seconds()))
+        i = batch_end
+    client.close()
+
+
+def preload_database(ns):
+    # callers such as setup_mongo.py only pass the options that define the data, the others keep their defaults
+    checkpoint = ns.get('checkpoint')
+    state = load_checkpoint(checkpoint)
+    resumed = state is not None
+    if resumed:
+        print "Resuming from checkpoint " + checkpoint
     else:
-        collection = client['test'][ns['collection']]
-
-    collection.remove()
-
-    i = 0
-    while i < ns['number']:
-        docs = []
-        for j in range(0, min(100, ns['number'] - i)):
-            i += 1
-            if ns['big_documents']:
-                doc = d.copy()
-            else:
-                doc = gen.random_document(False)
-                doc["boo"] = i
-            doc["_id"] = str(i)
-            docs.append(doc)
-        collection.insert(docs, safe=False)
-        print "Inserted " + str(i)
-
-    # collection.insert(docs)
-
-    # print [i for i in collection.find()]
-    print "Inserted " + str(ns['number']) + " documents"
+        instance = random.random()
+        number = ns['number']
+        processes = max(1, min(ns.get('processes', 1), number))
+        # disjoint ranges of _id's [begin, end) per process
+        bounds = [1 + number * w / processes for w in range(0, processes + 1)]
+        state = {
+            'collection': 'performance' + str(instance)[2:] if ns['collection'] == '' else ns['collection'],
+            'number': number,
+            'seed': ns.get('seed', random.randint(0, sys.maxint)),
+            'big_documents': ns['big_documents'],
+            'numeric_fieldnames': ns['no_numeric_fieldnames'],
+            'test_nulls': ns['no_nulls'],
+            'ranges': [[bounds[w], bounds[w + 1]] for w in range(0, processes)],
+            'next': bounds[:-1],
+        }
+        client = pymongo.MongoClient(ns['host'], ns['port'])
+        client['test'][state['collection']].delete_many({})
+        client.close()
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, state)
+
+    gen.generator_options.numeric_fieldnames = state['numeric_fieldnames']
+    gen.generator_options.test_nulls = state['test_nulls']
+
+    progress = multiprocessing.Queue()
+    workers = []
+    for worker_id in range(0, len(state['ranges'])):
+        worker = multiprocessing.Process(target=load_range, args=(ns, state, worker_id, progress, resumed))
+        worker.start()
+        workers.append(worker)
+
+    latencies = stats.LatencyHistogram()
+    inserted = sum([state['next'][w] - state['ranges'][w][0] for w in range(0, len(workers))])
+    docs = 0
+    size = 0
+    start = time.time()
+    last_checkpoint = start
+    last_report = start
+
+    def report():
+        elapsed = max(time.time() - start, 0.000001)
+        print "Inserted %d/%d documents, %.1f docs/s, %.2f MB/s, batch latency p50: %.2f ms, p99: %.2f ms" % (
+            inserted, state['number'], docs / elapsed, size / elapsed / 1024 / 1024,
+            latencies.percentile(50) / 1000.0, latencies.percentile(99) / 1000.0)
+
+    okay = True
+    while True:
+        try:
+            (worker_id, next_id, batch_docs, batch_bytes, seconds) = progress.get(timeout=1)
+            state['next'][worker_id] = next_id
+            inserted += batch_docs
+            docs += batch_docs
+            size += batch_bytes
+            latencies.record(seconds)
+        except Queue.Empty:
+            if not any([w.is_alive() for w in workers]) and progress.empty():
+                break
+        if any([w.exitcode not in [None, 0] for w in workers]):
+            okay = False
+            break
+
+        now = time.time()
+        if checkpoint is not None and now - last_checkpoint >= 1:
+            save_checkpoint(checkpoint, state)
+            last_checkpoint = now
+        if now - last_report >= ns.get('report_interval', 5):
+            report()
+            last_report = now
+
+    for worker in workers:
+        if not okay:
+            worker.terminate()
+        worker.join()
+
+    report()
+    if not okay:
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, state)
+            print "Load failed, resume it with --checkpoint " + checkpoint
+        return False
+
+    if checkpoint is not None:
+        os.remove(checkpoint)
+    print "Inserted " + str(state['number']) + " documents"
     print "Database: test"
-    print "Collection: " + ('performance' + str(instance)[2:] if ns['collection'] == '' else ns['collection'])
+    print "Collection: " + state['collection']
+    return True
 
 
 if __name__ == "__main__":
@@ -233,6 +359,23 @@ if __name__ == "__main__":
     parser.add_argument('-n', '--number', type=int, default=300)
     parser.add_argument('-c', '--collection', default='')
     parser.add_argument('-b', '--big-documents', default=False, action="store_true")
+    parser.add_argument('--batch-size', type=int, default=100, help="maximum number of documents per batch, 0 for no limit")
+    parser.add_argument(
+        '--batch-bytes',
+        type=int,
+        default=0,
+        help="maximum BSON size of a batch in bytes, 0 for no limit. Should stay below the message size limit "
+        "and can be tuned against the NONISOLATED_RW_INTERNAL_BUFFER_MAX knob of Document Layer")
+    parser.add_argument('--unordered', default=False, action="store_true", help="do unordered inserts")
+    parser.add_argument(
+        '--processes', type=int, default=1, help="number of processes, each loading a disjoint range of _id's")
+    parser.add_argument(
+        '--checkpoint',
+        default=None,
+        help="file to keep the progress in. If it exists the load it describes is resumed, the other options that "
+        "define the data are then ignored. It is removed once the load is complete")
+    parser.add_argument('--seed', type=int, default=random.randint(0, sys.maxint), help="random seed to use")
+    parser.add_argument('--report-interval', type=float, default=5, help="seconds between progress reports")
     parser.add_argument(
         '--no-numeric-fieldnames',
         default=True,
@@ -241,4 +384,4 @@ if __name__ == "__main__":
     parser.add_argument('--no-nulls', default=True, action="store_false", help="disable generation of null values")
 
     ns = vars(parser.parse_args())
-    preload_database(ns)
+    sys.exit(not preload_database(ns))
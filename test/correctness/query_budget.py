@@ -0,0 +1,131 @@
+#!/usr/bin/python
+#
+# query_budget.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Cost budgets of queries for the smoke tests. Document Layer does not return execution statistics with explain, the
+# documents a query scanned and the transactions it took are taken from the ConsoleMetric events of its trace files
+# instead: dl_index_scan_rate and dl_table_scan_rate sum the documents read by the scans, dl_tr_per_request has the
+# transactions of every request. These are server wide and published every flush interval, so a measurement waits for
+# the metrics of what ran before to be published, runs the query alone and waits for its metrics. This takes two flush
+# intervals and only holds if nothing else runs on the server, tests with budgets therefore run serially:
+#
+#   @pytest.mark.query_budget
+#   def test_range(fixture_collection, fixture_query_budget):
+#       ...
+#       fixture_query_budget.check(fixture_collection, {'a': {'$gt': 1}}, scanned_per_match=2, transactions=1)
+#
+#   pytest -m query_budget --doclayer-trace-dir /path/to/fdbdoc/logdir smoke/
+
+import os
+import time
+
+import pytest
+
+import console_metrics
+import explain_plan
+
+
+class QueryCost(object):
+    """The plan of a query, the documents it returned and, if metrics were collected, what it read to do so."""
+
+    def __init__(self, query, plan, matched, index_scanned=None, table_scanned=None, transactions=None):
+        self.query = query
+        self.plan = plan
+        self.matched = matched
+        self.index_scanned = index_scanned
+        self.table_scanned = table_scanned
+        self.transactions = transactions
+
+    @property
+    def scanned(self):
+        if self.index_scanned is None:
+            return None
+        return self.index_scanned + self.table_scanned
+
+    def __str__(self):
+        return 'query %s: matched %d, scanned %s (index %s, table %s), transactions %s, plan %s' % (
+            self.query, self.matched, self.scanned, self.index_scanned, self.table_scanned, self.transactions,
+            self.plan.summary())
+
+
+def metrics_shared():
+    """Whether other pytest-xdist workers may run queries on the server at the same time."""
+    return int(os.environ.get('PYTEST_XDIST_WORKER_COUNT', '1')) > 1
+
+
+class QueryBudget(object):
+    def __init__(self, collector, flush_interval=console_metrics.FLUSH_INTERVAL):
+        self.collector = collector
+        self.flush_interval = flush_interval
+
+    def measure(self, collection, query, **kwargs):
+        """Runs a find() with explain and, given a collector, with the metrics of its run, returns its QueryCost."""
+        plan = explain_plan.explain(collection, query, **kwargs)
+        if self.collector is None:
+            return QueryCost(query, plan, len(list(collection.find(query, **kwargs))))
+
+        # the scans of the test so far, e.g. building indexes, must be published before the query runs
+        self.collector.wait_for_flush(self.flush_interval)
+        start = time.time()
+        matched = len(list(collection.find(query, **kwargs)))
+        self.collector.wait_for_flush(self.flush_interval)
+        end = time.time()
+
+        def total(metric):
+            return sum([s.sum for s in self.collector.series(metric, start, end)])
+
+        transactions = [s.max for s in self.collector.series(console_metrics.TR_PER_REQUEST, start, end)]
+        return QueryCost(query, plan, matched, total(console_metrics.INDEX_SCAN_DOCS),
+                         total(console_metrics.TABLE_SCAN_DOCS), max(transactions) if len(transactions) > 0 else None)
+
+    def check(self,
+              collection,
+              query,
+              scanned=None,
+              scanned_per_match=None,
+              transactions=None,
+              no_table_scan=False,
+              **kwargs):
+        """
+        Runs the query and asserts its budget: at most scanned documents read, or scanned_per_match times the number
+        of documents returned, at most transactions per request and, with no_table_scan, a plan without table scans.
+        Tests with metric budgets are skipped if the metrics are not available or shared with other workers.
+        Returns the QueryCost.
+        """
+        needs_metrics = scanned is not None or scanned_per_match is not None or transactions is not None
+        if needs_metrics and self.collector is None:
+            pytest.skip('query budgets need the metrics of --doclayer-trace-dir')
+        if needs_metrics and metrics_shared():
+            pytest.skip('query budgets need the server to themselves, run them without pytest-xdist')
+
+        cost = self.measure(collection, query, **kwargs)
+        if no_table_scan:
+            assert not cost.plan.has(explain_plan.TABLE_SCAN), 'table scan in %s' % cost
+        if scanned is not None:
+            assert cost.scanned <= scanned, 'scanned more than %d documents in %s' % (scanned, cost)
+        if scanned_per_match is not None:
+            limit = scanned_per_match * max(cost.matched, 1)
+            assert cost.scanned <= limit, 'scanned more than %s documents in %s' % (limit, cost)
+        if transactions is not None:
+            assert cost.transactions is not None, 'no transactions per request published for %s' % cost
+            assert cost.transactions <= transactions, 'more than %d transactions in %s' % (transactions, cost)
+        return cost
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+#
+# replay_trace.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+import argparse
+import random
+import sys
+import time
+
+import pymongo
+from bson.codec_options import CodecOptions
+from bson.son import SON
+
+import op_trace
+import stats
+
+
+def as_tuples(spec):
+    if spec is None or isinstance(spec, basestring):
+        return spec
+    return [tuple(item) for item in spec]
+
+
+def run_find(collection, args):
+    cursor = collection.with_options(codec_options=op_trace.RAW_BSON).find(
+        args['filter'], args['projection'], batch_size=args['batch_size'])
+    if args['sort'] is not None:
+        cursor = cursor.sort(as_tuples(args['sort']))
+    return cursor.skip(args['skip']).limit(args['limit'])
+
+
+def restore_upserted_id(collection, replayed_id, recorded_id):
+    """Gives the document an upsert generated an _id for the _id it got when the trace was recorded."""
+    collection = collection.with_options(codec_options=CodecOptions(document_class=SON))
+    doc = collection.find_one({'_id': replayed_id})
+    collection.delete_one({'_id': replayed_id})
+    doc['_id'] = recorded_id
+    collection.insert_one(doc)
+
+
+def run_operation(collection, op, args):
+    """Runs one operation of the trace and returns the digest of its response."""
+    if op == 'drop':
+        collection.drop()
+    elif op == 'insert_many':
+        collection.insert_many(args['docs'], ordered=args['ordered'])
+    elif op == 'ensure_index':
+        collection.ensure_index(as_tuples(args['keys']), unique=args['unique'])
+    elif op == 'update':
+        result = collection.update(args['query'], args['update'], upsert=args['upsert'], multi=args['multi'])
+        upserted = result.get('upserted') if isinstance(result, dict) else None
+        if 'upserted' in args and upserted is not None and upserted != args['upserted']:
+            restore_upserted_id(collection, upserted, args['upserted'])
+        return op_trace.write_result_digest(result)
+    elif op == 'find':
+        return op_trace.result_digest(list(run_find(collection, args)))
+    elif op == 'count':
+        return str(collection.find(args['filter'], args['projection']).count(False))
+    else:
+        raise Exception('Unknown operation in trace: ' + op)
+    return None
+
+
+def replay(ns):
+    client = pymongo.MongoClient(ns['host'], ns['port'])
+    db_name = ns['db'] if ns['db'] is not None else 'replay-' + str(random.random())[2:]
+    db = client[db_name]
+    print 'Replaying ' + ns['trace'] + ' into database ' + db_name
+
+    timings = stats.Timings([])
+    total = 0
+    divergences = 0
+    start = time.time()
+    try:
+        for record in op_trace.read_trace(ns['trace']):
+            if ns['speed'] > 0:
+                delay = start + record['t'] / ns['speed'] - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            error = None
+            digest = None
+            op_start = time.time()
+            try:
+                digest = run_operation(db[record['coll']], record['op'], record['args'])
+            except pymongo.errors.OperationFailure as e:
+                error = op_trace.error_code(e)
+            timings.record(record['op'], time.time() - op_start)
+            total += 1
+
+            if error != record['error'] or digest != record['digest']:
+                divergences += 1
+                if divergences <= ns['max_divergences']:
+                    print 'Divergence at operation %d (%s on %s):' % (total, record['op'], record['coll'])
+                    print '  Arguments: %r' % record['args']
+                    print '  Recorded error: %r, digest: %r' % (record['error'], record['digest'])
+                    print '  Replayed error: %r, digest: %r' % (error, digest)
+    finally:
+        if ns['db'] is None:
+            client.drop_database(db_name)
+        client.close()
+
+    elapsed = time.time() - start
+    print 'Replayed %d operations in %.2f s (%.1f ops/s)' % (total, elapsed, total / elapsed if elapsed > 0 else 0.0)
+    print '{:<14} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('operation', 'count', 'mean us', 'p50 us', 'p99 us', 'max us')
+    for (op, histogram) in timings.histograms.items():
+        print '{:<14} {:>8} {:>10.1f} {:>10} {:>10} {:>10}'.format(
+            op, histogram.count, histogram.mean(), histogram.percentile(50), histogram.percentile(99), histogram.max)
+    print 'Divergences: ' + str(divergences)
+    return divergences == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Replay an operation trace recorded by document-correctness.py --record-trace against one server')
+    parser.add_argument('trace', help='trace file')
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument(
+        '--db', default=None, help='database to replay into, by default a new database which is dropped afterwards')
+    parser.add_argument(
+        '--speed',
+        type=float,
+        default=0,
+        help='pace relative to the recording, e.g. 1 for the original pace or 10 for 10 times faster. '
+        '0 replays as fast as possible')
+    parser.add_argument(
+        '--max-divergences', type=int, default=10, help='maximum number of divergences which are printed')
+
+    ns = vars(parser.parse_args())
+    sys.exit(not replay(ns))
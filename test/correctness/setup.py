@@ -33,6 +33,7 @@ setup(
 
     install_requires=[
         'pytest',
+        'pytest-xdist',
         'pymongo==3.6.1',
         'python-dateutil',
         'PyYAML==4.2b4',
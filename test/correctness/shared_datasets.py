@@ -0,0 +1,84 @@
+#!/usr/bin/python
+#
+# shared_datasets.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Read-only data sets shared by the smoke tests of a session. A data set is loaded into a Document Layer collection
+# and a model collection the first time a test asks for it, later tests asking for the same documents and indexes get
+# the loaded ones. Tests must not write to the Document Layer collection of a data set, the model collection they
+# get is a copy-on-write snapshot though, whose finds return copies of the shared documents.
+#
+#   dataset = fixture_datasets.get([{'a': 1}, {'a': 2}], indexes=[[('a', 1)]])
+#   dl_collection = dataset.collection
+#   mm_collection = dataset.model_snapshot()
+
+import hashlib
+
+import util
+from mongo_model import MongoModel
+
+
+class Dataset(object):
+    def __init__(self, name, collection, model_collection):
+        self.name = name
+        self.collection = collection
+        self.model_collection = model_collection
+
+    def model_snapshot(self):
+        return self.model_collection.snapshot()
+
+
+class DatasetCache(object):
+    def __init__(self, db):
+        self.db = db
+        self.model = MongoModel('DocLayer')
+        self.datasets = {}
+
+    def get(self, documents, indexes=(), name=None):
+        """
+        Returns the Dataset of the documents and indexes, given as lists of (key, direction), loading it unless it
+        has been loaded before. Data sets are named after a digest of their contents unless a name is given.
+        """
+        documents = [util.deep_convert_to_ordered(doc) for doc in documents]
+        indexes = [list(keys) for keys in indexes]
+        if name is None:
+            name = hashlib.md5(repr((documents, indexes))).hexdigest()
+        if name not in self.datasets:
+            self.datasets[name] = self.load(name, documents, indexes)
+        return self.datasets[name]
+
+    def load(self, name, documents, indexes):
+        collection = self.db['ds_' + name]
+        model_collection = self.model['test']['ds_' + name]
+        collection.drop()
+        for keys in indexes:
+            collection.create_index(keys)
+            model_collection.create_index(keys)
+        if len(documents) > 0:
+            # the model gives documents without one an _id, which Document Layer then gets as well
+            model_collection.insert_many(documents)
+            collection.insert_many(documents)
+        return Dataset(name, collection, model_collection)
+
+    def drop(self):
+        for dataset in self.datasets.values():
+            dataset.collection.drop()
+        self.datasets = {}
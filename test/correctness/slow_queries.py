@@ -0,0 +1,277 @@
+#!/usr/bin/python
+#
+# slow_queries.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Corpus of slow operations. Test and benchmark runners hand every operation they time to a SlowQueryLog, which keeps
+# those slower than a threshold, with the indexes of the collection, the seed the data was generated from and a
+# snapshot of the documents the collection held. A corpus is a directory:
+#
+#   queries.bson          the slow operations, a sequence of BSON records:
+#                         {time, source, backend, op: find or update, args: {...}, latency_us, threshold_us,
+#                          dataset, seed, indexes: [{key, unique}], extra: {...}}
+#   datasets/<md5>.bson   the documents of a collection, named by their digest so that each is stored once
+#
+# A find is snapshotted when it is seen to be slow. An update changes the documents, so runners capture the collection
+# before every timed update while a corpus is kept, and a slow one is stored with the documents it ran on. Run on its
+# own, this replays a corpus against a server: every operation runs on its data set and indexes, is explained and
+# timed, and is reported as still slow if its median latency is above the threshold it was captured with. Slow queries
+# found by the fuzzer so become performance tests:
+#
+#   slow_queries.py --corpus slow --port 27019
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+
+import bson
+import pymongo
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+
+import explain_plan
+import op_trace
+import stats
+from bulk_loader import BulkLoader
+
+QUERIES_FILE = 'queries.bson'
+DATASETS_DIR = 'datasets'
+
+RAW_BSON = CodecOptions(document_class=RawBSONDocument)
+ORDERED = CodecOptions(document_class=SON)
+
+
+class SlowQueryLog(object):
+    def __init__(self, corpus, threshold_ms, source):
+        self.corpus = corpus
+        self.threshold = threshold_ms / 1000.0
+        self.source = source
+        if not os.path.isdir(os.path.join(corpus, DATASETS_DIR)):
+            os.makedirs(os.path.join(corpus, DATASETS_DIR))
+        # every record goes out in a single write, so processes can share a corpus
+        self.fd = os.open(os.path.join(corpus, QUERIES_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        self.seed = None
+        self.indexes = []
+        self.extra = {}
+        self.seen = set()
+        self.count = 0
+
+    def begin(self, seed, indexes, extra=None):
+        """Sets the seed and the indexes, given as (keys, unique), of the collections of the next operations."""
+        self.seed = seed
+        self.indexes = [SON([('key', op_trace.as_pairs(keys)), ('unique', unique)]) for (keys, unique) in indexes]
+        self.extra = extra if extra is not None else {}
+
+    def observe(self, collection, backend, seconds, op, args, before=None):
+        """
+        Keeps the operation if it took longer than the threshold, returns whether it did. Operations that write need
+        before, the documents capture() read from the collection before they ran.
+        """
+        if op != 'find' and before is None:
+            raise ValueError('%s needs the documents of the collection from before it ran' % op)
+        if seconds < self.threshold:
+            return False
+        key = (backend, op, repr(args), repr(self.indexes), self.seed, repr(self.extra))
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        record = SON([
+            ('time', time.time()),
+            ('source', self.source),
+            ('backend', backend),
+            ('op', op),
+            ('args', args),
+            ('latency_us', int(seconds * 1000000)),
+            ('threshold_us', int(self.threshold * 1000000)),
+            ('dataset', self.store(self.capture(collection) if before is None else before)),
+            ('seed', self.seed),
+            ('indexes', self.indexes),
+            ('extra', self.extra),
+        ])
+        os.write(self.fd, bson.BSON.encode(record))
+        self.count += 1
+        return True
+
+    def capture(self, collection):
+        """Returns the documents of the collection as raw BSON, to store() as a data set."""
+        if isinstance(collection, op_trace.RecordingCollection):
+            # reading through the wrapper would add the read to the trace
+            collection = collection.collection
+        return ''.join([doc.raw for doc in collection.with_options(codec_options=RAW_BSON).find()])
+
+    def store(self, data):
+        """Stores the documents of capture() as a data set, returns its name."""
+        name = hashlib.md5(data).hexdigest()
+        path = dataset_path(self.corpus, name)
+        if not os.path.exists(path):
+            with open(path + '.' + str(os.getpid()), 'wb') as fp:
+                fp.write(data)
+            os.rename(path + '.' + str(os.getpid()), path)
+        return name
+
+    def close(self):
+        os.close(self.fd)
+
+
+def dataset_path(corpus, name):
+    return os.path.join(corpus, DATASETS_DIR, name + '.bson')
+
+
+def read_corpus(corpus):
+    path = os.path.join(corpus, QUERIES_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as fp:
+        for record in bson.decode_file_iter(fp, codec_options=ORDERED):
+            yield record
+
+
+def read_dataset(corpus, name):
+    with open(dataset_path(corpus, name), 'rb') as fp:
+        for doc in bson.decode_file_iter(fp, codec_options=ORDERED):
+            yield doc
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--slow-query-corpus',
+        type=str,
+        default=None,
+        help='directory to keep the operations slower than --slow-query-ms in, which slow_queries.py replays')
+    parser.add_argument(
+        '--slow-query-ms', type=float, default=100, help='latency in ms above which an operation goes to the corpus')
+
+
+def open_log(ns, source):
+    """Returns the SlowQueryLog of the --slow-query-corpus of a runner, None if not given."""
+    if ns['slow_query_corpus'] is None:
+        return None
+    return SlowQueryLog(ns['slow_query_corpus'], ns['slow_query_ms'], source)
+
+
+class Replayer(object):
+    def __init__(self, corpus, collection):
+        self.corpus = corpus
+        self.collection = collection
+        self.loaded = None
+
+    def prepare(self, record):
+        """Loads the data set and indexes of the record, unless the collection still holds them."""
+        if self.loaded == (record['dataset'], repr(record['indexes'])):
+            return
+        self.collection.drop()
+        BulkLoader(self.collection, batch_size=1000, ordered=False).load(read_dataset(self.corpus, record['dataset']))
+        for index in record['indexes']:
+            self.collection.create_index(index['key'], unique=index['unique'])
+        self.loaded = (record['dataset'], repr(record['indexes']))
+
+    def run(self, record):
+        args = record['args']
+        if record['op'] == 'find':
+            cursor = self.collection.find(args['filter'], args.get('projection'))
+            if args.get('sort'):
+                cursor = cursor.sort(args['sort'])
+            list(cursor.skip(args.get('skip', 0)).limit(args.get('limit', 0)))
+        else:
+            self.collection.update(args['query'], args['update'], upsert=args['upsert'], multi=args['multi'])
+            # the data set has changed
+            self.loaded = None
+
+    def explain(self, record):
+        args = record['args']
+        query = args['filter'] if record['op'] == 'find' else args['query']
+        explanation = self.collection.find(query).explain()
+        if 'explanation' in explanation:
+            return explain_plan.parse(explanation['explanation']).summary()
+        return str(explanation.get('queryPlanner', {}).get('winningPlan'))
+
+    def replay(self, record, warmup, repeat):
+        latency = stats.LatencyHistogram()
+        result = OrderedDict([('source', record['source']), ('backend', record['backend']), ('op', record['op']),
+                              ('dataset', record['dataset']), ('seed', record['seed']),
+                              ('recorded_us', record['latency_us']), ('threshold_us', record['threshold_us'])])
+        try:
+            self.prepare(record)
+            result['plan'] = self.explain(record)
+            for ii in range(0, warmup + repeat):
+                self.prepare(record)
+                start = time.time()
+                self.run(record)
+                if ii >= warmup:
+                    latency.record(time.time() - start)
+        except pymongo.errors.OperationFailure as e:
+            result['error'] = str(e)
+            self.loaded = None
+        result['latency'] = latency.to_dict()
+        result['still_slow'] = latency.count > 0 and latency.percentile(50) >= record['threshold_us']
+        return result
+
+
+def run_replay(ns):
+    client = pymongo.MongoClient(ns['host'], ns['port'])
+    collection = client['test']['slowreplay' + str(random.random())[2:]]
+    replayer = Replayer(ns['corpus'], collection)
+
+    records = [r for r in read_corpus(ns['corpus']) if ns['source'] is None or r['source'] == ns['source']]
+    # operations on the same data set and indexes run one after the other, which saves reloading it
+    records.sort(key=lambda r: (r['dataset'], repr(r['indexes']), r['op'] != 'find'))
+    print '{:>4} {:<20} {:<8} {:<7} {:>12} {:>12} {:>12}  {}'.format('#', 'source', 'backend', 'op', 'recorded us',
+                                                                   'p50 us', 'p99 us', 'plan')
+    results = []
+    for (ii, record) in enumerate(records):
+        result = replayer.replay(record, ns['warmup'], ns['repeat'])
+        results.append(result)
+        print '{:>4} {:<20} {:<8} {:<7} {:>12} {:>12} {:>12}  {}{}'.format(
+            ii, result['source'], result['backend'], result['op'], result['recorded_us'], result['latency']['p50_us'],
+            result['latency']['p99_us'], result.get('plan', result.get('error')),
+            '  STILL SLOW' if result['still_slow'] else '')
+        if ns['verbose']:
+            print '     args: %s' % record['args']
+            print '     indexes: %s' % [index['key'] for index in record['indexes']]
+
+    collection.drop()
+    client.close()
+    still_slow = len([r for r in results if r['still_slow']])
+    print '%d of %d operations are still slower than the threshold they were captured with' % (still_slow, len(results))
+    if ns['output'] != '':
+        with open(ns['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+    return still_slow == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays a corpus of slow operations with explain and timing')
+    parser.add_argument('--corpus', required=True, help='corpus directory written by the runners')
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument('--source', default=None, help='only replay the operations captured by this runner')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured runs of every operation')
+    parser.add_argument('--repeat', type=int, default=5, help='measured runs of every operation')
+    parser.add_argument('-v', '--verbose', default=False, action='store_true', help='print the operations')
+    parser.add_argument('--output', default='', help='JSON file to write the results to')
+    ns = vars(parser.parse_args())
+    sys.exit(not run_replay(ns))
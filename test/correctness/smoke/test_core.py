@@ -24,9 +24,9 @@ from collections import OrderedDict
 
 import pytest
 
+import batch_query
 import util
 from gen import value_operators
-from mongo_model import MongoModel
 
 
 def operator_queries(base_query):
@@ -35,76 +35,74 @@ def operator_queries(base_query):
     return q_list
 
 
-def run_and_match(dl_collection, test):
-    mm = MongoModel('DocLayer')
-    mm_collection = mm['test']['test']
-
-    dl_collection.delete_many({})
-
+def run_and_match(datasets, test):
     (doc, queries) = test
 
-    doc = util.deep_convert_to_ordered(doc)
-
-    mm_collection.insert_one(doc)
-    dl_collection.insert_one(doc)
+    dataset = datasets.get([doc])
+    mm_results = dataset.model_snapshot().find_many(queries)
+    dl_results = batch_query.find_many(dataset.collection, queries)
 
-    for query in queries:
-        ret1 = [util.deep_convert_to_unordered(i) for i in mm_collection.find(query)]
+    for (query, mm_ret, dl_ret) in zip(queries, mm_results, dl_results):
+        if batch_query.canonical_digest(mm_ret) == batch_query.canonical_digest(dl_ret):
+            continue
+        # compare the documents to tell which ones differ
+        ret1 = [util.deep_convert_to_unordered(i) for i in mm_ret]
         ret1.sort()
-        ret2 = [util.deep_convert_to_unordered(i) for i in dl_collection.find(query)]
+        ret2 = [util.deep_convert_to_unordered(i) for i in dl_ret]
         ret2.sort()
 
-        assert len(ret1) == len(ret2), "Number returned docs don't match, mm: {}, dl: {}".format(len(ret1), len(ret2))
+        assert len(ret1) == len(ret2), "Number returned docs don't match for {}, mm: {}, dl: {}".format(
+            query, len(ret1), len(ret2))
         for i in range(0, len(ret1)):
-            assert ret1[i] == ret2[i], "Mismatch at {}, mm: {}, dl: {}".format(i, ret1[i], ret2[i])
+            assert ret1[i] == ret2[i], "Mismatch at {} for {}, mm: {}, dl: {}".format(i, query, ret1[i], ret2[i])
 
 
-def test_array1(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [{'b': 1}]}, operator_queries({"a.b": 1})))
+def test_array1(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [{'b': 1}]}, operator_queries({"a.b": 1})))
 
 
-def test_array2(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [3, 'b', {'b': 1}]}, operator_queries({"a.b": 1})))
+def test_array2(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [3, 'b', {'b': 1}]}, operator_queries({"a.b": 1})))
 
 
-def test_array3a(fixture_collection):
-    run_and_match(fixture_collection, ({'_id': 'Bhaskar', 'a': [[1]]}, operator_queries({"a.0": 1})))
+def test_array3a(fixture_datasets):
+    run_and_match(fixture_datasets, ({'_id': 'Bhaskar', 'a': [[1]]}, operator_queries({"a.0": 1})))
 
 
-def test_array3b(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [{'0': 1}]}, operator_queries({"a.0": 1})))
+def test_array3b(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [{'0': 1}]}, operator_queries({"a.0": 1})))
 
 
-def test_array3c(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [[{'b': 1}]]}, operator_queries({"a.0.b": 1})))
+def test_array3c(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [[{'b': 1}]]}, operator_queries({"a.0.b": 1})))
 
 
-def test_array3d(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [['h', {'b': 1}]]}, operator_queries({"a.0.b": 1})))
+def test_array3d(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [['h', {'b': 1}]]}, operator_queries({"a.0.b": 1})))
 
 
-def test_array3e(fixture_collection):
-    run_and_match(fixture_collection, ({'a': ['h', [{'b': 1}]]}, operator_queries({"a.0.b": 1})))
+def test_array3e(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': ['h', [{'b': 1}]]}, operator_queries({"a.0.b": 1})))
 
 
-def test_array4(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [1, {'b': [2, {'c': 1}]}]}, operator_queries({"a.b.c": 1})))
+def test_array4(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [1, {'b': [2, {'c': 1}]}]}, operator_queries({"a.b.c": 1})))
 
 
-def test_array5(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [1, {'0': 2}]}, operator_queries({"a.0": 1})))
+def test_array5(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [1, {'0': 2}]}, operator_queries({"a.0": 1})))
 
 
-def test_array5a(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [1, {'0': 2}]}, operator_queries({"a": 1})))
+def test_array5a(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [1, {'0': 2}]}, operator_queries({"a": 1})))
 
 
-def test_array5b(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [1, {'0': 2}]}, operator_queries({"a.0": 2})))
+def test_array5b(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [1, {'0': 2}]}, operator_queries({"a.0": 2})))
 
 
-def test_array5c(fixture_collection):
-    run_and_match(fixture_collection, ({
+def test_array5c(fixture_datasets):
+    run_and_match(fixture_datasets, ({
         'a': [1, {
             '0': 'hello',
             '1': [3, {
@@ -116,28 +114,28 @@ def test_array5c(fixture_collection):
     })))
 
 
-def test_array6(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [2, {'0': 1}]}, operator_queries({"a.0": 1})))
+def test_array6(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [2, {'0': 1}]}, operator_queries({"a.0": 1})))
 
 
-def test_array7(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [[1]]}, operator_queries({"a": 1})))
+def test_array7(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [[1]]}, operator_queries({"a": 1})))
 
 
-def test_array8(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [2, {"1": ['e']}]}, operator_queries({"a.1": 'e'})))
+def test_array8(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [2, {"1": ['e']}]}, operator_queries({"a.1": 'e'})))
 
 
-def test_array9(fixture_collection):
-    run_and_match(fixture_collection, ({'a': [2, {"1": ['e']}]}, operator_queries({"a.1.0": 'e'})))
+def test_array9(fixture_datasets):
+    run_and_match(fixture_datasets, ({'a': [2, {"1": ['e']}]}, operator_queries({"a.1.0": 'e'})))
 
 
-def test_array10(fixture_collection):
-    run_and_match(fixture_collection, ({u'B': [1, 2, {u'2': [1, 6]}]}, [{'B.2.1': {'$exists': True}}]))
+def test_array10(fixture_datasets):
+    run_and_match(fixture_datasets, ({u'B': [1, 2, {u'2': [1, 6]}]}, [{'B.2.1': {'$exists': True}}]))
 
 
-def test_array11(fixture_collection):
-    run_and_match(fixture_collection, ({
+def test_array11(fixture_datasets):
+    run_and_match(fixture_datasets, ({
         u'2': [2, u'a', [], {
             u'1': u'd',
             u'2': {
@@ -154,78 +152,78 @@ def test_array11(fixture_collection):
     }]))
 
 
-def test_array12(fixture_collection):
-    run_and_match(fixture_collection, ({u'B': [1, 2, {u'2': [1, 6]}]}, [{'B.2.1': 6}]))
+def test_array12(fixture_datasets):
+    run_and_match(fixture_datasets, ({u'B': [1, 2, {u'2': [1, 6]}]}, [{'B.2.1': 6}]))
 
 
-def test_array13(fixture_collection):
-    run_and_match(fixture_collection, ({'E': [[2, 2, [1]]]}, [{'E.0.2': 1}]))
+def test_array13(fixture_datasets):
+    run_and_match(fixture_datasets, ({'E': [[2, 2, [1]]]}, [{'E.0.2': 1}]))
 
 
-def test_array14(fixture_collection):
-    run_and_match(fixture_collection, ({'E': [2, 2, []]}, [{'E': {'$ne': []}}]))
+def test_array14(fixture_datasets):
+    run_and_match(fixture_datasets, ({'E': [2, 2, []]}, [{'E': {'$ne': []}}]))
 
-def test_array15(fixture_collection):
-    run_and_match(fixture_collection, ({'E': [2, 2, [1]]}, [{'E': {'$eq': []}}]))
+def test_array15(fixture_datasets):
+    run_and_match(fixture_datasets, ({'E': [2, 2, [1]]}, [{'E': {'$eq': []}}]))
 
 
-def test_array16(fixture_collection):
-    run_and_match(fixture_collection, ({'E': [2, 2, [1]]}, [{'E': [1]}]))
+def test_array16(fixture_datasets):
+    run_and_match(fixture_datasets, ({'E': [2, 2, [1]]}, [{'E': [1]}]))
 
 
-def test_array17(fixture_collection):
-    run_and_match(fixture_collection, ({'E': [2, 2, {'a': 'b', 'c': ['d', 'e']}]}, [{'E.2.c': 'e'}]))
+def test_array17(fixture_datasets):
+    run_and_match(fixture_datasets, ({'E': [2, 2, {'a': 'b', 'c': ['d', 'e']}]}, [{'E.2.c': 'e'}]))
 
 
-def test_null1(fixture_collection):
-    run_and_match(fixture_collection, ({"_id": 1, "A": [{"B": 5}]}, operator_queries({"A.B": None})))
+def test_null1(fixture_datasets):
+    run_and_match(fixture_datasets, ({"_id": 1, "A": [{"B": 5}]}, operator_queries({"A.B": None})))
 
 
-def test_null2(fixture_collection):
-    run_and_match(fixture_collection, ({"_id": 1, "A": [{}]}, operator_queries({"A.B": None})))
+def test_null2(fixture_datasets):
+    run_and_match(fixture_datasets, ({"_id": 1, "A": [{}]}, operator_queries({"A.B": None})))
 
 
-def test_null3(fixture_collection):
-    run_and_match(fixture_collection, ({"_id": 1, "A": []}, operator_queries({"A.B": None})))
+def test_null3(fixture_datasets):
+    run_and_match(fixture_datasets, ({"_id": 1, "A": []}, operator_queries({"A.B": None})))
 
 
-def test_null4(fixture_collection):
-    run_and_match(fixture_collection, ({"_id": 1, "A": [{}, {"B": 5}]}, operator_queries({"A.B": None})))
+def test_null4(fixture_datasets):
+    run_and_match(fixture_datasets, ({"_id": 1, "A": [{}, {"B": 5}]}, operator_queries({"A.B": None})))
 
 
-def test_null5(fixture_collection):
-    run_and_match(fixture_collection, ({"_id": 1, "A": [5, {"B": 5}]}, operator_queries({"A.B": None})))
+def test_null5(fixture_datasets):
+    run_and_match(fixture_datasets, ({"_id": 1, "A": [5, {"B": 5}]}, operator_queries({"A.B": None})))
 
 
-def test_null6(fixture_collection):
-    run_and_match(fixture_collection, ({'2': ['A', [{}, u'a', 0]]}, operator_queries({"2.1.D": None})))
+def test_null6(fixture_datasets):
+    run_and_match(fixture_datasets, ({'2': ['A', [{}, u'a', 0]]}, operator_queries({"2.1.D": None})))
 
 
-def test_dict1(fixture_collection):
+def test_dict1(fixture_datasets):
     d = OrderedDict()
     d['C'] = 'c'
     d['D'] = 'd'
-    run_and_match(fixture_collection, ({'_id': 'A', 'B': d}, [{'B': d}]))
+    run_and_match(fixture_datasets, ({'_id': 'A', 'B': d}, [{'B': d}]))
 
 
-def test_dict2(fixture_collection):
+def test_dict2(fixture_datasets):
     d = OrderedDict()
     d['C'] = 'c'
     d['D'] = 'd'
     e = OrderedDict()
     e['C'] = 'c'
     e['D'] = 'e'
-    run_and_match(fixture_collection, ({'_id': 'A', 'B': d}, [{'B': e}]))
+    run_and_match(fixture_datasets, ({'_id': 'A', 'B': d}, [{'B': e}]))
 
 
-def test_dict3(fixture_collection):
+def test_dict3(fixture_datasets):
     d = OrderedDict()
     d['C'] = 'c'
     d['D'] = 'd'
     e = OrderedDict()
     e['D'] = 'd'
     e['C'] = 'c'
-    run_and_match(fixture_collection, ({'_id': 'A', 'B': d}, [{'B': e}]))
+    run_and_match(fixture_datasets, ({'_id': 'A', 'B': d}, [{'B': e}]))
 
 
 @pytest.mark.skip
@@ -18,55 +18,27 @@
 # limitations under the License.
 #
 
+import pytest
+
+import explain_plan
+
 
 class Predicates(object):
     @staticmethod
     def no_table_scan(explanation):
-        this_type = explanation['type']
-        if this_type == 'table scan':
-            return False
-        elif this_type == 'union':
-            return all([Predicates.no_table_scan(p) for p in explanation['plans']])
-        elif 'source_plan' in explanation:
-            return Predicates.no_table_scan(explanation['source_plan'])
-        else:
-            return True
+        return not explain_plan.parse(explanation).has(explain_plan.TABLE_SCAN)
 
     @staticmethod
     def only_index_named(index_name, explanation):
-        this_type = explanation['type']
-        if this_type == 'index scan' and explanation['index name'] == index_name:
-            return True
-        elif this_type == 'union':
-            return all([Predicates.only_index_named(index_name, p) for p in explanation['plans']])
-        elif 'source_plan' in explanation:
-            return Predicates.only_index_named(index_name, explanation['source_plan'])
-        else:
-            return False
+        return explain_plan.parse(explanation).uses_only_index(index_name)
 
     @staticmethod
     def pk_lookup(explanation):
-        this_type = explanation['type']
-        if this_type == 'PK lookup':
-            return True
-        elif this_type == 'union':
-            return all([Predicates.pk_lookup(p) for p in explanation['plans']])
-        elif 'source_plan' in explanation:
-            return Predicates.pk_lookup(explanation['source_plan'])
-        else:
-            return False
+        return explain_plan.parse(explanation).all_leaves(lambda leaf: leaf.type == explain_plan.PK_LOOKUP)
 
     @staticmethod
     def no_filter(explanation):
-        this_type = explanation['type']
-        if this_type == 'filter':
-            return False
-        elif this_type == 'union':
-            return all([Predicates.no_filter(p) for p in explanation['plans']])
-        elif 'source_plan' in explanation:
-            return Predicates.no_filter(explanation['source_plan'])
-        else:
-            return True
+        return not explain_plan.parse(explanation).has(explain_plan.FILTER)
 
     @staticmethod
     def pk_lookup_no_filter(explanation):
@@ -437,3 +409,78 @@ def test_compound_index_multi_match(fixture_collection):
     ret = fixture_collection.find(query).explain()
     assert Predicates.only_index_named('da', ret['explanation'])
     assert Predicates.no_table_scan(ret['explanation'])
+
+
+# Explain Plan Analysis Tests
+def test_explain_plan_bounds(fixture_collection):
+    fixture_collection.create_index(keys=[('a', 1)], name='index')
+    plan = explain_plan.explain(fixture_collection, {'a': 1})
+    assert plan.has_tight_bounds()
+    assert plan.leaves()[0].bounds.is_point()
+
+    # Document Layer ends the range of $gt at the first value of the next type
+    plan = explain_plan.explain(fixture_collection, {'a': {'$gt': 1}})
+    assert plan.uses_only_index('index')
+    bounds = plan.leaves()[0].bounds
+    assert bounds.begin is not None and bounds.end is not None
+    assert bounds.end_of_type and not bounds.begin_of_type
+    assert bounds.has_begin() and not bounds.is_bounded()
+
+    # and begins the range of $lt at the first value of the type
+    bounds = explain_plan.explain(fixture_collection, {'a': {'$lt': 1}}).leaves()[0].bounds
+    assert bounds.begin_of_type and not bounds.end_of_type
+    assert bounds.has_end() and not bounds.is_bounded()
+
+    bounds = explain_plan.explain(fixture_collection, {'a': {'$gt': 1, '$lt': 5}}).leaves()[0].bounds
+    assert bounds.is_bounded()
+
+
+def test_explain_plan_diff(fixture_collection):
+    fixture_collection.create_index(keys=[('a', 1)], name='one')
+    fixture_collection.create_index(keys=[('b', 1)], name='two')
+    plan1 = explain_plan.explain(fixture_collection, {'a': 1})
+    assert explain_plan.diff(plan1, explain_plan.explain(fixture_collection, {'a': 1})) == []
+    plan2 = explain_plan.explain(fixture_collection, {'b': 1})
+    differences = explain_plan.diff(plan1, plan2)
+    assert len(differences) == 1
+    assert differences[0][0].endswith('.index name') and differences[0][1:] == ('one', 'two')
+
+    model = explain_plan.CostModel(10000)
+    assert model.estimate(explain_plan.explain(fixture_collection, {'c': 1})) > model.estimate(plan1)
+
+
+# Query Budget Tests
+def insert_grid(collection, size):
+    collection.insert_many([{'_id': i, 'a': i, 'b': i % 10, 'c': i % 7, 'd': i % 3} for i in range(size)])
+
+
+@pytest.mark.query_budget
+def test_budget_pk_lookup(fixture_collection, fixture_query_budget):
+    insert_grid(fixture_collection, 100)
+    cost = fixture_query_budget.check(fixture_collection, {'_id': 5}, scanned=1, transactions=1, no_table_scan=True)
+    assert cost.matched == 1
+
+
+@pytest.mark.query_budget
+def test_budget_pk_range(fixture_collection, fixture_query_budget):
+    insert_grid(fixture_collection, 100)
+    cost = fixture_query_budget.check(fixture_collection, {'_id': {'$gte': 90}}, scanned_per_match=1, transactions=1)
+    assert cost.matched == 10
+
+
+@pytest.mark.query_budget
+def test_budget_simple_index_range(fixture_collection, fixture_query_budget):
+    fixture_collection.create_index(keys=[('a', 1)], name='index')
+    insert_grid(fixture_collection, 100)
+    cost = fixture_query_budget.check(
+        fixture_collection, {'a': {'$gte': 10, '$lt': 20}}, scanned_per_match=2, transactions=1, no_table_scan=True)
+    assert cost.matched == 10
+
+
+@pytest.mark.query_budget
+def test_budget_compound_index_range_at_end(fixture_collection, fixture_query_budget):
+    fixture_collection.create_index(keys=[('d', 1), ('b', 1), ('c', 1)], name='compound')
+    insert_grid(fixture_collection, 210)
+    query = {'$and': [{'d': 1}, {'b': 4}, {'c': {'$gt': 2}}]}
+    cost = fixture_query_budget.check(fixture_collection, query, scanned_per_match=2, transactions=1, no_table_scan=True)
+    assert cost.matched == len([i for i in range(210) if i % 3 == 1 and i % 10 == 4 and i % 7 > 2])
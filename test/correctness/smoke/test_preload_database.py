@@ -0,0 +1,53 @@
+#
+# test_preload_database.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+import Queue
+import random
+
+import preload_database
+
+
+def test_resume_with_batch_bytes(fixture_client):
+    number = 40
+    state = {
+        'collection': 'preload' + str(random.random())[2:],
+        'number': number,
+        'seed': 1,
+        'big_documents': False,
+        'ranges': [[1, number + 1]],
+        'next': [1],
+    }
+    # one document per insert batch, all in one batch of _id's
+    ns = {'host': fixture_client.address[0], 'port': fixture_client.address[1], 'batch_size': 0, 'batch_bytes': 1}
+    collection = fixture_client['test'][state['collection']]
+    try:
+        # an interrupted load inserted the first documents, but did not get to checkpoint them
+        collection.insert_many([{'_id': str(i)} for i in range(1, 11)])
+        progress = Queue.Queue()
+        preload_database.load_range(ns, state, 0, progress, True)
+
+        assert collection.count() == number
+        (_, next_id, docs, size, _) = progress.get_nowait()
+        assert (next_id, docs) == (number + 1, number)
+        assert size > 0
+    finally:
+        collection.drop()
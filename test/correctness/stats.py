@@ -0,0 +1,143 @@
+#!/usr/bin/python
+#
+# stats.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies in microseconds with logarithmic buckets, every power of two is split into
+    2^precision_bits buckets. Recording is O(1) and memory is bounded, the relative error of percentiles is at most
+    2^-precision_bits.
+    """
+
+    def __init__(self, precision_bits=5):
+        self.precision_bits = precision_bits
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket_of(self, value):
+        shift = max(0, value.bit_length() - 1 - self.precision_bits)
+        return (value >> shift) << shift, shift
+
+    def record(self, seconds):
+        self.record_micros(int(seconds * 1000000))
+
+    def record_micros(self, value):
+        value = max(0, value)
+        (lower, _) = self.bucket_of(value)
+        self.buckets[lower] = self.buckets.get(lower, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for (lower, count) in other.buckets.items():
+            self.buckets[lower] = self.buckets.get(lower, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count > 0:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def mean(self):
+        return float(self.total) / self.count if self.count > 0 else 0.0
+
+    def percentile(self, percentile):
+        """Returns the upper bound of the bucket holding the given percentile, capped by the recorded maximum."""
+        if self.count == 0:
+            return 0
+        rank = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for lower in sorted(self.buckets):
+            seen += self.buckets[lower]
+            if seen >= rank:
+                (_, shift) = self.bucket_of(lower)
+                return min(self.max, lower + (1 << shift) - 1)
+        return self.max
+
+    def to_dict(self):
+        return OrderedDict([
+            ('count', self.count),
+            ('total_us', self.total),
+            ('mean_us', round(self.mean(), 1)),
+            ('min_us', self.min),
+            ('p50_us', self.percentile(50)),
+            ('p90_us', self.percentile(90)),
+            ('p99_us', self.percentile(99)),
+            ('max_us', self.max),
+        ])
+
+
+class Timings(object):
+    """
+    Named latency histograms. Operations which run against one of the backends are recorded under
+    "<operation>:<backend>", where the backend is given by its index into the backends list. Consecutive phases are
+    recorded under "phase:<name>".
+    """
+
+    def __init__(self, backends):
+        self.backends = list(backends)
+        if len(set(self.backends)) < len(self.backends):
+            self.backends = [backend + '#' + str(ii + 1) for (ii, backend) in enumerate(self.backends)]
+        self.histograms = OrderedDict()
+        self.current_phase = None
+        self.phase_start = None
+
+    def record(self, name, seconds, backend=None):
+        if backend is not None:
+            name = name + ':' + self.backends[backend]
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        self.histograms[name].record(seconds)
+
+    @contextmanager
+    def timer(self, name, backend=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start, backend)
+
+    def phase(self, name):
+        """Ends the running phase, if any, and starts the given one. None only ends the running phase."""
+        now = time.time()
+        if self.current_phase is not None:
+            self.record('phase:' + self.current_phase, now - self.phase_start)
+        self.current_phase = name
+        self.phase_start = now
+
+    def merge(self, other):
+        for (name, histogram) in other.histograms.items():
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram(histogram.precision_bits)
+            self.histograms[name].merge(histogram)
+
+    def to_dict(self):
+        return OrderedDict([(name, histogram.to_dict()) for (name, histogram) in self.histograms.items()])
@@ -22,36 +22,42 @@
 #
 
 import argparse
+import collections
+import errno
 import fcntl
+import importlib
+import multiprocessing
 import os
 import random
+import select
 import shlex
 import signal
 import subprocess
 import sys
 import time
+import traceback
 
+import gen
 import util
 
 sys.path.append(os.path.dirname(__file__))
 
+# imported here rather than in the pool workers, so that they inherit it when forked
+document_correctness = importlib.import_module('document-correctness')
+
 processes = list()
 instances = list()
 run_path = ""
+monitor = None
 
 
-def get_used_memory_in_mb():
-    import psutil
-    virt_mem = float(0.0)
-    for proc in psutil.process_iter():
-        try:
-            pinfo = proc.as_dict(attrs=['pid', 'name'])
-            for xx in ['bigdoc', 'fdbdoc']:
-                if xx in pinfo['name']:
-                    virt_mem = virt_mem + float(proc.memory_info_ex().vms / (1024 * 1024))
-        except psutil.NoSuchProcess:
-            pass
-    return float(virt_mem)
+def start_memory_monitor(ns):
+    global monitor
+    if ns['memory_interval'] > 0 and "doclayer" in [ns['1'], ns['2']]:
+        import memory_monitor
+        monitor = memory_monitor.MemoryMonitor(ns['doclayer_host'], ns['doclayer_port'], ns['memory_interval'],
+                                               ns['trace_dir'])
+        monitor.start()
 
 
 def kill_process(proc):
@@ -93,15 +99,27 @@ def show_statistics(ns):
         used_mem = float(cmd_output['process memory usage'])
     print "Used memory by FDBDOC : ", str(used_mem)
 
+    if monitor is not None:
+        import memory_monitor
+        monitor.stop()
+        memory_monitor.print_report(memory_monitor.analyze(monitor.samples))
+
 
-def non_block_readline(output):
-    fd = output.fileno()
+def timeout_journal(instance_id):
+    # Journals are named after the seed of the iteration, find the latest one written for this instance
+    pattern = " --instance-id " + str(instance_id) + "\n"
+    journals = [os.path.join(run_path, name) for name in os.listdir(run_path) if name.endswith('.running')]
+    journals.sort(key=lambda fname: os.path.getmtime(fname), reverse=True)
+    for fname in journals:
+        with open(fname, 'r') as fp:
+            if fp.read().endswith(pattern):
+                return util.rename_file(fname, ".timeout")
+    return util.rename_file(run_path + "journal_" + str(instance_id) + ".running", ".timeout")
+
+
+def set_non_blocking(fd):
     fl = fcntl.fcntl(fd, fcntl.F_GETFL)
     fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-    try:
-        return output.readline()
-    except:
-        return ''
 
 
 def start_process(ns):
@@ -109,8 +127,154 @@ def start_process(ns):
     instance_id = int(str(random.random())[2:])
 
     ns['instance_id'] = instance_id
-    processes.append(subprocess.Popen(shlex.split(util.get_cmd_line(ns)), shell=False, stderr=subprocess.PIPE))
+    proc = subprocess.Popen(shlex.split(util.get_cmd_line(ns)), shell=False, stderr=subprocess.PIPE)
+    set_non_blocking(proc.stderr.fileno())
+    processes.append(proc)
     instances.append(instance_id)
+    return proc
+
+
+# if test run did not update itself (write to stderr) in this many seconds, perhaps it is stuck ?
+UNRESPONSIVE_TIMEOUT = 2 * 60
+
+# seconds a retired test process gets to exit on SIGTERM before it is killed
+RETIRE_GRACE_PERIOD = 10
+
+
+class Supervisor(object):
+    """
+    Keeps `num_parallel` test processes running. Instead of spinning over the children, it sleeps in poll() on their
+    stderr pipes and on a self-pipe that wakes it up on SIGCHLD, so it only runs when a child printed something, a
+    child died, or the next timeout is due.
+    """
+
+    def __init__(self, ns):
+        self.ns = ns
+        self.poller = select.poll()
+        self.procs = dict()  # stderr fd -> process
+        self.partial = dict()  # stderr fd -> last incomplete line
+        self.last_update = dict()  # pid -> time of the last output
+
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        set_non_blocking(self.wakeup_r)
+        set_non_blocking(self.wakeup_w)
+        self.poller.register(self.wakeup_r, select.POLLIN)
+
+    def __enter__(self):
+        # The handler itself does nothing, the byte written to the wakeup fd is what interrupts poll()
+        self.old_handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.set_wakeup_fd(self.wakeup_w)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, self.old_handler)
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+    def spawn(self):
+        proc = start_process(self.ns)
+        fd = proc.stderr.fileno()
+        self.procs[fd] = proc
+        self.partial[fd] = ''
+        self.poller.register(fd, select.POLLIN | select.POLLHUP | select.POLLERR)
+        self.last_update[proc.pid] = time.time()
+
+    def retire(self, proc):
+        fd = proc.stderr.fileno()
+        self.drain(fd)
+        if fd in self.procs:
+            self.close(fd)
+        kill_process(proc)
+        # it leaves processes below, so nothing would poll() it again, reap it here instead of leaving a zombie
+        deadline = time.time() + RETIRE_GRACE_PERIOD
+        while proc.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if proc.returncode is None:
+            os.kill(proc.pid, signal.SIGKILL)
+            proc.wait()
+        proc.stderr.close()
+        ii = processes.index(proc)
+        del processes[ii]
+        del instances[ii]
+        del self.last_update[proc.pid]
+
+    def close(self, fd):
+        if self.partial[fd] != '':
+            self.write(self.partial[fd] + '\n')
+        self.poller.unregister(fd)
+        del self.procs[fd]
+        del self.partial[fd]
+
+    @staticmethod
+    def write(out):
+        sys.stdout.write(out)
+        sys.stdout.flush()
+
+    def drain(self, fd):
+        """Forward everything a child has written so far, returns False once the pipe is closed."""
+        if fd not in self.procs:
+            return False
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return True
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if data == '':
+                self.close(fd)
+                return False
+            self.last_update[self.procs[fd].pid] = time.time()
+            lines = (self.partial[fd] + data).split('\n')
+            self.partial[fd] = lines.pop()
+            if lines:
+                self.write('\n'.join(lines) + '\n')
+
+    def clear_wakeup(self):
+        try:
+            while os.read(self.wakeup_r, 512):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def wait(self, timeout):
+        try:
+            if timeout is None:
+                events = self.poller.poll()
+            else:
+                events = self.poller.poll(max(timeout, 0) * 1000)
+        except select.error as e:
+            # SIGCHLD may interrupt the poll before anything is written to the wakeup fd
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        for fd, _ in events:
+            if fd == self.wakeup_r:
+                self.clear_wakeup()
+            else:
+                self.drain(fd)
+
+    def check_processes(self):
+        curr_time = time.time()
+        for proc in list(processes):
+            stop_unresponsive = (curr_time - self.last_update[proc.pid]) > UNRESPONSIVE_TIMEOUT
+            if proc.poll() is not None or stop_unresponsive:
+                if stop_unresponsive:
+                    fname = timeout_journal(instances[processes.index(proc)])
+                    print "Process was stopped because of timeout, check out this file for more info : ", fname
+                self.retire(proc)
+                self.spawn()
+
+    def next_timeout(self, stop_time):
+        deadline = min(self.last_update.values()) + UNRESPONSIVE_TIMEOUT if self.last_update else None
+        if stop_time is not None:
+            deadline = stop_time if deadline is None else min(deadline, stop_time)
+        # None means there is nothing to wait for but signals and output
+        return None if deadline is None else deadline - time.time()
 
 
 def test_auto_forever(ns):
@@ -127,6 +291,7 @@ def test_auto_forever(ns):
     num_min = ns["num_min"]
 
     start_time = time.time()
+    stop_time = start_time + num_min * 60 if num_min > 0 else None
 
     # number of parallel runs
     num_parallel = ns["num_parallel"]
@@ -134,57 +299,210 @@ def test_auto_forever(ns):
     # Initialize it with 0 which means auto-generate it
     ns['instance_id'] = 0
 
-    is_time_to_stop = False
-    last_update = [None] * num_parallel
+    with Supervisor(ns) as supervisor:
+        # create initial number of processes
+        for ii in range(num_parallel):
+            supervisor.spawn()
+        start_memory_monitor(ns)
 
-    while True:
-        try:
-            # Why do we need this here ? - if too many tests start to fail, perhaps we should restore it, but
-            # commenting it out for now.
-            # sleep(0.1)
+        while True:
+            try:
+                curr_time = time.time()
+                if stop_time is not None and curr_time > stop_time:
+                    print "Time to stop, time to run was set to", num_min
+                    print "Start time:", time.asctime(time.localtime(start_time))
+                    print "Finish time:", time.asctime(time.localtime(curr_time))
+                    break
+
+                supervisor.wait(supervisor.next_timeout(stop_time))
+                supervisor.check_processes()
+
+            except Exception as inst:
+                print inst
+                print "Unexpected error:", sys.exc_info()[0]
+                pass
+    print "AUTOMATION FINISHED ITS WORK"
+
+
+def pool_worker(worker_id, connection, heartbeat):
+    """
+    Runs tests in-process, one (instance id, command line) task at a time from its connection, until it gets None.
+    Everything it writes to stdout or stderr counts as a sign of life.
+    """
+
+    class HeartbeatWriter(object):
+        def __init__(self, out):
+            self.out = out
 
-            # if we cannot create new tests and there are no other active, lets finish
-            if is_time_to_stop == True:  # and len(processes) == 0:
+        def write(self, data):
+            heartbeat[worker_id] = time.time()
+            self.out.write(data)
+
+        def __getattr__(self, name):
+            return getattr(self.out, name)
+
+    # Forked workers start from the parent's PRNG state, which would make them all pick the same seeds
+    random.seed()
+    sys.stdout = HeartbeatWriter(sys.stdout)
+    sys.stderr = HeartbeatWriter(sys.stderr)
+
+    parser = document_correctness.get_parser()
+    for (instance_id, cmd_line) in iter(connection.recv, None):
+        heartbeat[worker_id] = time.time()
+        connection.send(('start', worker_id, instance_id))
+
+        gen.reset_generator_options()
+        util.traceLevel = 'error'
+        okay = False
+        try:
+            # skip "python document-correctness.py"
+            task_ns = vars(parser.parse_args(shlex.split(cmd_line)[2:]))
+            okay = task_ns['func'](task_ns)
+        except Exception:
+            traceback.print_exc()
+        sys.stdout.flush()
+        connection.send(('done', worker_id, instance_id, okay))
+
+
+class Pool(object):
+    """
+    Long-lived workers forked once from this process, so interpreter startup and imports are paid for only once. There
+    are at most as many workers as cores, --num-parallel is the number of tasks in flight, which may be higher. Pending
+    tasks wait in one shared queue in this process, and the next one goes to whichever worker is idle first, so a slow
+    task never holds up others. Every worker has a pipe of its own to get its task and report over, a task counts as
+    the worker's from the moment it is sent, and a worker that dies or is killed, even in the middle of a message,
+    only breaks its own pipe, which is replaced along with it.
+    """
+
+    def __init__(self, ns, num_tasks):
+        self.ns = ns
+        self.num_tasks = num_tasks
+        num_workers = max(1, min(num_tasks, multiprocessing.cpu_count()))
+        self.heartbeat = multiprocessing.Array('d', num_workers, lock=False)
+        self.workers = [None] * num_workers
+        self.connections = [None] * num_workers
+        self.assigned = [None] * num_workers  # worker id -> (instance id, command line) sent and not done
+        self.running = dict()  # worker id -> instance id
+        self.pending = collections.deque()
+
+    def fork(self, worker_id):
+        (connection, worker_connection) = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=pool_worker, args=(worker_id, worker_connection, self.heartbeat))
+        worker.daemon = True
+        worker.start()
+        # the worker holds the only other end, so that its death ends the pipe
+        worker_connection.close()
+        self.workers[worker_id] = worker
+        self.connections[worker_id] = connection
+        self.assigned[worker_id] = None
+        processes.append(worker)
+
+    def dispatch(self):
+        """Tops the pending tasks up to the tasks in flight and hands them to the idle workers."""
+        while len(self.pending) + len([task for task in self.assigned if task is not None]) < self.num_tasks:
+            # default random value, in case we do not find anything else to use
+            instance_id = int(str(random.random())[2:])
+            self.ns['instance_id'] = instance_id
+            self.pending.append((instance_id, util.get_cmd_line(self.ns)))
+        for worker_id in range(len(self.workers)):
+            if len(self.pending) == 0:
                 break
+            if self.assigned[worker_id] is not None or not self.workers[worker_id].is_alive():
+                continue
+            task = self.pending.popleft()
+            try:
+                self.connections[worker_id].send(task)
+            except (IOError, OSError):
+                # the worker is gone, check_workers() replaces it
+                self.pending.appendleft(task)
+                continue
+            self.assigned[worker_id] = task
+
+    def start(self):
+        for worker_id in range(len(self.workers)):
+            self.fork(worker_id)
+        self.dispatch()
+
+    def replace(self, worker_id):
+        worker = self.workers[worker_id]
+        kill_process(worker)
+        worker.join()
+        processes.remove(worker)
+        self.connections[worker_id].close()
+        self.running.pop(worker_id, None)
+        self.fork(worker_id)
+        self.dispatch()
+
+    def process_message(self, message):
+        if message[0] == 'start':
+            (_, worker_id, instance_id) = message
+            self.running[worker_id] = instance_id
+        else:
+            (_, worker_id, instance_id, _) = message
+            self.running.pop(worker_id, None)
+            if self.assigned[worker_id] is not None and self.assigned[worker_id][0] == instance_id:
+                self.assigned[worker_id] = None
+            self.dispatch()
+
+    def check_workers(self):
+        curr_time = time.time()
+        for worker_id, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                # the task sent to it dies with it
+                self.replace(worker_id)
+            elif worker_id in self.running and curr_time - self.heartbeat[worker_id] > UNRESPONSIVE_TIMEOUT:
+                fname = timeout_journal(self.running[worker_id])
+                print "Process was stopped because of timeout, check out this file for more info : ", fname
+                self.replace(worker_id)
+
+    def wait(self, timeout):
+        try:
+            (readable, _, _) = select.select(self.connections, [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        for connection in readable:
+            worker_id = self.connections.index(connection)
+            try:
+                self.process_message(connection.recv())
+            except (EOFError, IOError):
+                # the worker died, possibly in the middle of a message
+                self.replace(worker_id)
 
-            # create initial number of processes
-            if not is_time_to_stop and len(processes) == 0:
-                for ii in range(min(len(processes), num_parallel), max(len(processes), num_parallel)):
-                    start_process(ns)
-                    last_update[ii] = time.time()
 
-            for ii, pp in enumerate(processes):
-                # if user provided num of min to run, we should check that here
-                curr_time = time.time()
-                run_min = (curr_time - start_time) / 60
+# Worker liveness is checked at least this often, in seconds
+POOL_CHECK_INTERVAL = 1
 
-                if 0 < num_min < run_min and is_time_to_stop == False:
-                    print "Time to stop, time to run was set to", num_min
-                    print "Start time:", time.asctime(time.localtime(start_time))
-                    print "Finish time:", time.asctime(time.localtime(curr_time))
-                    is_time_to_stop = True
-
-                # if test run did not updated itself in 2 minutes, perhaps it is stuck ?
-                stop_unresponsive = ((curr_time - last_update[ii]) / 60) > 2
-
-                if pp.poll() is not None or stop_unresponsive:
-                    if stop_unresponsive:
-                        fname = run_path + "journal_" + str(instances[ii]) + ".running"
-                        fname = util.rename_file(fname, ".timeout")
-                        print "Process was stopped because of timeout, check out this file for more info : ", fname
-                    kill_process(processes[ii])
-                    del processes[ii]
-                    del instances[ii]
-                    # Start new process only if we are not in time out
-                    if not is_time_to_stop:
-                        start_process(ns)
-                        last_update[ii] = time.time()
-
-                out = non_block_readline(pp.stderr)
-                if out != '':
-                    last_update[ii] = time.time()
-                    sys.stdout.write(out)
-                    sys.stdout.flush()
+
+def test_auto_pool(ns):
+    import atexit
+    atexit.register(show_statistics, ns)
+
+    # make sure the folder where failure will be stored is created
+    global run_path
+    run_path = os.path.dirname(os.path.realpath(__file__)) + '/test_results/'
+    if not os.path.exists(run_path):
+        os.makedirs(run_path)
+
+    num_min = ns["num_min"]
+    start_time = time.time()
+
+    pool = Pool(ns, ns["num_parallel"])
+    pool.start()
+    start_memory_monitor(ns)
+
+    while True:
+        try:
+            curr_time = time.time()
+            if 0 < num_min < (curr_time - start_time) / 60:
+                print "Time to stop, time to run was set to", num_min
+                print "Start time:", time.asctime(time.localtime(start_time))
+                print "Finish time:", time.asctime(time.localtime(curr_time))
+                break
+
+            pool.wait(POOL_CHECK_INTERVAL)
+            pool.check_workers()
 
         except Exception as inst:
             print inst
@@ -201,6 +519,13 @@ if __name__ == '__main__':
     parser.add_argument('--doclayer-host', type=str, default='localhost', help='hostname of document layer server')
     parser.add_argument('--doclayer-port', type=int, default=27019, help='port of document layer server')
     parser.add_argument('--max-pool-size', type=int, default=None, help='maximum number of threads in the thread pool')
+    parser.add_argument(
+        '--memory-interval',
+        type=float,
+        default=0,
+        help='seconds between memory samples of document layer to look for leaks at the end, 0 to not sample')
+    parser.add_argument(
+        '--trace-dir', default='', help='trace directory of document layer, for operations and cursors of the samples')
     subparsers = parser.add_subparsers(help='type of test to run')
 
     parser_auto_forever = subparsers.add_parser(
@@ -218,8 +543,36 @@ if __name__ == '__main__':
         type=int,
         default=2,
         help='number of parallel runs of forever tests, if not specified is only 2')
+    parser_auto_forever.add_argument(
+        '--reset-mode',
+        choices=['drop', 'pool'],
+        default='drop',
+        help='how the forever tests reset their collections between iterations, see document-correctness.py')
     parser_auto_forever.set_defaults(func=test_auto_forever)
 
+    parser_auto_pool = subparsers.add_parser(
+        'auto-pool', help='same as auto-forever, but run the tests in a pool of long-lived worker processes')
+    parser_auto_pool.add_argument('1', choices=['mongo', 'mm', 'doclayer'], help='first tester')
+    parser_auto_pool.add_argument('2', choices=['mongo', 'mm', 'doclayer'], help='second tester')
+    parser_auto_pool.add_argument(
+        '--num-min',
+        type=int,
+        default=0,
+        help='number of minutes the auto-pool test run, if not specified is really'
+        ' forever')
+    parser_auto_pool.add_argument(
+        '--num-parallel',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='number of tests in flight, if not specified is the number of cores. They run in at most one worker '
+        'process per core, so this can be a multiple of the cores without oversubscribing them')
+    parser_auto_pool.add_argument(
+        '--reset-mode',
+        choices=['drop', 'pool'],
+        default='drop',
+        help='how the forever tests reset their collections between iterations, see document-correctness.py')
+    parser_auto_pool.set_defaults(func=test_auto_pool)
+
     ns = vars(parser.parse_args())
 
     ns['func'](ns)
@@ -1094,10 +1094,18 @@ def join_n(*args):
     return '\n'.join(args)
 
 
+def tester_kind(tester):
+    # a tester is mongo, doclayer or mm, optionally followed by @host:port or :flavour
+    return tester.split('@', 1)[0].split(':', 1)[0]
+
+
 def weaken_tests(ns):
-    if 'mongo' in [ns['1'], ns['2']]:
+    testers = ns['testers'] if 'testers' in ns else [ns['1'], ns['2']]
+    kinds = set([tester_kind(tester) for tester in testers])
+    if 'mongo' in kinds:
         weaken_tests_for_mongo(ns)
-    else:
+    # with more than two kinds of testers, some pairs do not involve MongoDB
+    if 'mongo' not in kinds or len(kinds) > 2:
         weaken_tests_for_doclayer()
 
 
@@ -1172,7 +1180,11 @@ def command_line_str(ns, seed):
     cmd_line = cmd_line + " --doclayer-host " + str(ns["doclayer_host"])
     cmd_line = cmd_line + " --doclayer-port " + str(ns["doclayer_port"])
     cmd_line = cmd_line + ("" if max_pool_size is None else " --max-pool-size " + str(max_pool_size))
-    cmd_line = cmd_line + " forever " + str(ns["1"]) + " " + str(ns["2"])
+    if ns.get('backend') is not None:
+        cmd_line = cmd_line + " fanout" + "".join([" --backend " + backend for backend in ns['backend']])
+        cmd_line = cmd_line + " --reference " + ns['reference']
+    else:
+        cmd_line = cmd_line + " forever " + str(ns["1"]) + " " + str(ns["2"])
     cmd_line = cmd_line + " --seed " + str(seed)
     cmd_line = cmd_line + " --num-doc " + str(ns['num_doc'])
     cmd_line = cmd_line + " --num-iter " + str(ns['num_iter'])
@@ -1183,6 +1195,10 @@ def command_line_str(ns, seed):
     cmd_line = cmd_line + ("" if gen.generator_options.upserts_enabled else " --no-upserts")
     cmd_line = cmd_line + ("" if ns['no_indexes'] else " --no-indexes")
     cmd_line = cmd_line + ("" if ns['no_projections'] else " --no-projections")
+    cmd_line = cmd_line + ("" if ns.get('reset_mode', 'drop') == 'drop' else " --reset-mode " + ns['reset_mode'])
+    cmd_line = cmd_line + ("" if ns.get('pool_size', 1) == 1 else " --pool-size " + str(ns['pool_size']))
+    cmd_line = cmd_line + ("" if ns.get('insert_batch_size', 0) == 0 else " --insert-batch-size " + str(ns['insert_batch_size']))
+    cmd_line = cmd_line + ("" if ns.get('insert_batch_bytes', 0) == 0 else " --insert-batch-bytes " + str(ns['insert_batch_bytes']))
     cmd_line = cmd_line + ("" if instance_id == 0 else " --instance-id " + str(instance_id))
 
     return cmd_line + '\n'
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+#
+# ycsb.py
+#
+# This source file is part of the FoundationDB open source project
+#
+# Copyright 2013-2019 Apple Inc. and the FoundationDB project authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MongoDB is a registered trademark of MongoDB, Inc.
+#
+
+# Benchmark driver running the core workloads of YCSB (Yahoo! Cloud Serving Benchmark) against Document Layer. The
+# records are loaded by preload_database, their keys are the _id's "1" to "<record count>".
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+import pymongo
+
+import console_metrics
+import gen
+import preload_database
+import stats
+
+# operation mixes and key distributions of the core workloads
+WORKLOADS = {
+    'A': ({'read': 0.5, 'update': 0.5}, 'zipfian'),
+    'B': ({'read': 0.95, 'update': 0.05}, 'zipfian'),
+    'C': ({'read': 1.0}, 'zipfian'),
+    'D': ({'read': 0.95, 'insert': 0.05}, 'latest'),
+    'E': ({'scan': 0.95, 'insert': 0.05}, 'zipfian'),
+    'F': ({'read': 0.5, 'read-modify-write': 0.5}, 'zipfian'),
+}
+
+OPERATIONS = ['read', 'update', 'scan', 'insert', 'read-modify-write']
+
+ZIPFIAN_CONSTANT = 0.99
+
+
+class ZipfianGenerator(object):
+    """
+    Zipfian distributed integers in [0, items), 0 being the most popular, as in "Quickly Generating Billion-Record
+    Synthetic Databases" by Gray et al. Computing zeta takes a pass over the items, so one generator is shared by the
+    threads of a workload, each drawing with its own PRNG. The number of items can grow, zeta is then extended
+    incrementally.
+    """
+
+    def __init__(self, items, theta=ZIPFIAN_CONSTANT):
+        self.theta = theta
+        self.alpha = 1.0 / (1.0 - theta)
+        self.zeta2 = 1.0 + 0.5**theta
+        self.lock = threading.Lock()
+        # (items, zetan, eta), replaced as a whole so that next() never sees a partly grown state
+        self.state = (0, 0.0, 0.0)
+        self.grow(items)
+
+    @property
+    def items(self):
+        return self.state[0]
+
+    def grow(self, items):
+        with self.lock:
+            (current, zetan, _) = self.state
+            if items <= current:
+                return
+            for i in range(current + 1, items + 1):
+                zetan += 1.0 / (i**self.theta)
+            eta = (1.0 - (2.0 / items)**(1.0 - self.theta)) / (1.0 - self.zeta2 / zetan)
+            self.state = (items, zetan, eta)
+
+    def next(self, prng):
+        (items, zetan, eta) = self.state
+        u = prng.random()
+        uz = u * zetan
+        if uz < 1.0:
+            return 0
+        if uz < self.zeta2:
+            return 1
+        return min(items - 1, int(items * (eta * u - eta + 1.0)**self.alpha))
+
+
+def fnv_hash(value):
+    # 64 bit FNV-1a, used to scatter the popular items over the whole key space
+    h = 0xcbf29ce484222325
+    for _ in range(0, 8):
+        h = ((h ^ (value & 0xff)) * 0x100000001b3) & 0xffffffffffffffff
+        value >>= 8
+    return h
+
+
+class KeyChooser(object):
+    """Chooses the number of an existing record, i.e. in [1, count], where count grows with inserts."""
+
+    def __init__(self, distribution, zipfian, prng):
+        self.distribution = distribution
+        self.prng = prng
+        self.zipfian = zipfian
+
+    def next(self, count):
+        if self.distribution == 'uniform':
+            return self.prng.randint(1, count)
+        if self.zipfian.items < count:
+            self.zipfian.grow(count)
+        if self.distribution == 'latest':
+            # the most recently inserted records are the most popular ones
+            return max(1, count - self.zipfian.next(self.prng))
+        return 1 + fnv_hash(self.zipfian.next(self.prng)) % count
+
+
+class Workload(object):
+    def __init__(self, ns, collection):
+        (self.mix, distribution) = WORKLOADS[ns['workload']]
+        self.distribution = ns['distribution'] if ns['distribution'] is not None else distribution
+        self.collection = collection
+        self.max_scan_length = ns['max_scan_length']
+        self.count = ns['record_count']
+        self.lock = threading.Lock()
+        self.zipfian = ZipfianGenerator(self.count) if self.distribution != 'uniform' else None
+
+    def key_chooser(self, prng):
+        return KeyChooser(self.distribution, self.zipfian, prng)
+
+    def next_insert_key(self):
+        with self.lock:
+            self.count += 1
+            return self.count
+
+    def choose_operation(self, prng):
+        r = prng.random()
+        for op in OPERATIONS:
+            r -= self.mix.get(op, 0)
+            if r < 0:
+                return op
+        return max(self.mix, key=self.mix.get)
+
+    def run_operation(self, op, keys, prng):
+        if op == 'insert':
+            i = self.next_insert_key()
+            doc = gen.random_document(False)
+            doc['boo'] = i
+            doc['_id'] = str(i)
+            self.collection.insert_one(doc)
+            return
+        key = str(keys.next(self.count))
+        if op == 'read':
+            self.collection.find_one({'_id': key})
+        elif op == 'update':
+            self.collection.update_one({'_id': key}, {'$set': {'field0': gen.random_string(prng.randint(1, 100))}})
+        elif op == 'scan':
+            length = prng.randint(1, self.max_scan_length)
+            list(self.collection.find({'_id': {'$gte': key}}).sort('_id', 1).limit(length))
+        elif op == 'read-modify-write':
+            # the read and the write are a single findAndModify
+            self.collection.find_one_and_update({'_id': key}, {'$inc': {'boo': 1}})
+
+
+def run_thread(workload, ns, thread_id, stop_time, operations, results, errors):
+    prng = random.Random(ns['seed'] + thread_id)
+    keys = workload.key_chooser(prng)
+    histograms = dict([(op, stats.LatencyHistogram()) for op in workload.mix])
+    done = 0
+    while (operations == 0 or done < operations) and (stop_time is None or time.time() < stop_time):
+        op = workload.choose_operation(prng)
+        start = time.time()
+        try:
+            workload.run_operation(op, keys, prng)
+        except pymongo.errors.PyMongoError as e:
+            # e.g. AutoReconnect, which would otherwise end the thread and lose its results
+            errors.append((op, str(e)))
+        histograms[op].record(time.time() - start)
+        done += 1
+    results[thread_id] = histograms
+
+
+def print_results(histograms, elapsed):
+    total = sum([h.count for h in histograms.values()])
+    print 'Throughput: %.1f ops/s (%d operations in %.2f s)' % (total / elapsed, total, elapsed)
+    print '{:<18} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'operation', 'count', 'ops/s', 'mean us', 'p50 us', 'p95 us', 'p99 us', 'max us')
+    for op in OPERATIONS:
+        if op not in histograms:
+            continue
+        h = histograms[op]
+        print '{:<18} {:>10} {:>10.1f} {:>10.1f} {:>10} {:>10} {:>10} {:>10}'.format(
+            op, h.count, h.count / elapsed, h.mean(), h.percentile(50), h.percentile(95), h.percentile(99), h.max)
+
+
+def start_collector(ns):
+    """Starts collecting the ConsoleMetric metrics of the server if --trace-dir is given, returns the collector."""
+    if ns['trace_dir'] == '':
+        return None
+    collector = console_metrics.MetricsCollector(ns['trace_dir'])
+    collector.start()
+    return collector
+
+
+def print_server_comparison(collector, histograms, start):
+    """Prints the latency seen by the clients since start next to the query latency measured by the server."""
+    client = stats.LatencyHistogram()
+    for h in histograms:
+        client.merge(h)
+    collector.wait_for_flush()
+    comparison = console_metrics.compare_latency(client, collector.series(console_metrics.QUERY_LATENCY, start))
+    console_metrics.print_comparison('all operations', comparison)
+
+
+def load_records(ns):
+    """Loads the records unless --skip-load is given, returns the name of their collection or None on failure."""
+    gen.global_prng = random.Random(ns['seed'])
+    collection_name = ns['collection'] if ns['collection'] != '' else 'ycsb' + str(random.random())[2:]
+
+    if not ns['skip_load']:
+        print 'Loading %d records into test.%s' % (ns['record_count'], collection_name)
+        okay = preload_database.preload_database({
+            'host': ns['host'],
+            'port': ns['port'],
+            'number': ns['record_count'],
+            'collection': collection_name,
+            'big_documents': False,
+            'batch_size': ns['load_batch_size'],
+            'batch_bytes': 0,
+            'unordered': False,
+            'processes': ns['load_processes'],
+            'checkpoint': None,
+            'seed': ns['seed'],
+            'report_interval': 5,
+            'no_numeric_fieldnames': True,
+            'no_nulls': True,
+        })
+        if not okay:
+            return None
+    return collection_name
+
+
+def describe_workload(ns, workload):
+    return 'workload %s (%s, %s keys)' % (
+        ns['workload'], ', '.join(['%s %d%%' % (op, workload.mix[op] * 100) for op in OPERATIONS if op in workload.mix]),
+        workload.distribution)
+
+
+def run_workload(ns):
+    collection_name = load_records(ns)
+    if collection_name is None:
+        return False
+
+    client = pymongo.MongoClient(ns['host'], ns['port'], maxPoolSize=ns['threads'])
+    workload = Workload(ns, client['test'][collection_name])
+    print 'Running %s with %d threads' % (describe_workload(ns, workload), ns['threads'])
+
+    stop_time = time.time() + ns['duration'] if ns['duration'] > 0 else None
+    operations = ns['operation_count'] / ns['threads'] if ns['operation_count'] > 0 else 0
+    results = {}
+    errors = []
+    collector = start_collector(ns)
+    threads = [
+        threading.Thread(target=run_thread, args=(workload, ns, t, stop_time, operations, results, errors))
+        for t in range(0, ns['threads'])
+    ]
+    start = time.time()
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    histograms = dict([(op, stats.LatencyHistogram()) for op in workload.mix])
+    for thread_histograms in results.values():
+        for (op, h) in thread_histograms.items():
+            histograms[op].merge(h)
+    print_results(histograms, elapsed)
+    if collector is not None:
+        print_server_comparison(collector, histograms.values(), start)
+        collector.stop()
+
+    if len(errors) > 0:
+        print 'Errors: %d, first: %s %s' % (len(errors), errors[0][0], errors[0][1])
+    if ns['drop']:
+        client['test'][collection_name].drop()
+    client.close()
+    return len(errors) == 0
+
+
+def add_workload_arguments(parser):
+    parser.add_argument('-o', '--host', default='localhost')
+    parser.add_argument('-p', '--port', type=int, default=27019)
+    parser.add_argument('-w', '--workload', choices=sorted(WORKLOADS.keys()), default='A', help='core workload to run')
+    parser.add_argument(
+        '-r', '--record-count', type=int, default=1000, help='number of records to load, or loaded before with --skip-load')
+    parser.add_argument(
+        '-d',
+        '--distribution',
+        choices=['zipfian', 'uniform', 'latest'],
+        default=None,
+        help='key distribution, by default the one of the workload')
+    parser.add_argument('--max-scan-length', type=int, default=100, help='maximum number of records of a scan')
+    parser.add_argument('-c', '--collection', default='', help='collection in database test, generated by default')
+    parser.add_argument(
+        '--skip-load', default=False, action='store_true', help='run on the records loaded into --collection before')
+    parser.add_argument('--load-processes', type=int, default=1, help='number of processes loading the records')
+    parser.add_argument('--load-batch-size', type=int, default=100, help='number of records per insert when loading')
+    parser.add_argument('--drop', default=False, action='store_true', help='drop the collection afterwards')
+    parser.add_argument('--seed', type=int, default=random.randint(0, sys.maxint), help='random seed to use')
+    parser.add_argument(
+        '--trace-dir', default='', help='trace directory of Document Layer to compare with its query latency metric')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='YCSB core workloads against Document Layer')
+    add_workload_arguments(parser)
+    parser.add_argument('-t', '--threads', type=int, default=1, help='number of client threads')
+    parser.add_argument(
+        '--duration', type=float, default=30, help='seconds to run the workload for, 0 to only stop on --operation-count')
+    parser.add_argument(
+        '--operation-count', type=int, default=0, help='number of operations to run over all threads, 0 for no limit')
+
+    ns = vars(parser.parse_args())
+    if ns['skip_load'] and ns['collection'] == '':
+        parser.error('--skip-load needs --collection')
+    if ns['duration'] <= 0 and ns['operation_count'] <= 0:
+        parser.error('either --duration or --operation-count is needed')
+    sys.exit(not run_workload(ns))